@@ -0,0 +1,141 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+import sys
+
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("rebuild-scheme-accruals")
+@click.option("--scheme", "schemes", multiple=True, help="Custom Promotional Scheme to rebuild (repeatable, default: all)")
+@click.option("--chunk-size", default=500, type=int, help="Invoices per chunk / commit")
+@pass_context
+def rebuild_scheme_accruals(context, schemes=None, chunk_size=500):
+    "Rebuild the Promotional Scheme Accrual ledger from submitted invoices"
+    import frappe
+
+    from promotional_scheme.promotional_scheme.accruals import rebuild_accruals
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        rebuild_accruals(schemes=list(schemes) or None, chunk_size=chunk_size, log=click.echo)
+    finally:
+        frappe.destroy()
+
+
+@click.command("reevaluate-scheme-invoices")
+@click.option("--scheme", required=True, help="Custom Promotional Scheme")
+@click.option("--workers", type=int, help="Partitions / background jobs (default: site config or 1)")
+@click.option("--chunk-size", default=1000, type=int, help="Invoices per chunk / commit")
+@click.option("--restart", is_flag=True, default=False, help="Ignore checkpoints and start over")
+@click.option("--enqueue", is_flag=True, default=False, help="Run the partitions as long-queue jobs instead of here")
+@pass_context
+def reevaluate_scheme_invoices(context, scheme, workers=None, chunk_size=1000, restart=False, enqueue=False):
+    "Re-evaluate submitted invoices against a scheme and write Promotional Scheme Proposals"
+    import frappe
+
+    from promotional_scheme.promotional_scheme.reevaluation import reevaluate_scheme
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        reevaluate_scheme(
+            scheme, workers=workers, chunk_size=chunk_size, restart=restart, enqueue=enqueue, log=click.echo
+        )
+    finally:
+        frappe.destroy()
+
+
+@click.command("promotional-scheme-benchmark")
+@click.option("--schemes", type=int, help="Number of schemes")
+@click.option("--customers", type=int, help="Number of customers")
+@click.option("--items", type=int, help="Number of items")
+@click.option("--item-groups", type=int, help="Number of item groups")
+@click.option("--invoices", type=int, help="Number of submitted invoices")
+@click.option("--lines", type=int, help="Lines per invoice")
+@click.option("--submits", type=int, help="Timed apply_promotional_schemes calls")
+@click.option("--report-runs", type=int, help="Runs per report filter set")
+@click.option("--seed", type=int, help="Random seed")
+@click.option("--output", help="Write the JSON results to this file")
+@pass_context
+def promotional_scheme_benchmark(context, output=None, **scale):
+    "Time scheme application and the report on synthetic data (rolled back afterwards)"
+    import frappe
+
+    from promotional_scheme.promotional_scheme.benchmark import run_to_file
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        click.echo(run_to_file(output=output, **scale))
+    finally:
+        frappe.destroy()
+
+
+@click.command("promotional-scheme-explain")
+@click.option("--from-date", help="Report window start (default: 90 days before --to-date)")
+@click.option("--to-date", help="Report window end (default: today)")
+@click.option("--min-rows", default=10000, type=int, help="Flag full scans from this many (estimated) rows")
+@click.option("--create-indexes", is_flag=True, default=False, help="Create / update the app's indexes first")
+@click.option("--verbose", is_flag=True, default=False, help="Print every query plan, not just flagged ones")
+@pass_context
+def promotional_scheme_explain(context, from_date=None, to_date=None, min_rows=10000, create_indexes=False, verbose=False):
+    "EXPLAIN the report's queries and flag full scans of large tables"
+    import frappe
+
+    from promotional_scheme.promotional_scheme.db_indexes import ensure_indexes, explain_hot_queries
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        if create_indexes:
+            ensure_indexes(log=click.echo)
+        results = explain_hot_queries(from_date, to_date, min_rows=min_rows)
+        flagged = 0
+        for result in results:
+            if not (result["full_scans"] or verbose):
+                continue
+            flagged += bool(result["full_scans"])
+            click.echo(result["query"])
+            for step in result["plan"]:
+                mark = "FULL SCAN" if step in result["full_scans"] else ""
+                click.echo(f"    {step['table']}: {step['access']} key={step['key']} rows={step['rows']} {mark}".rstrip())
+        click.echo(f"{len(results)} queries explained, {flagged} with full scans of {min_rows}+ rows")
+        if flagged:
+            sys.exit(1)
+    finally:
+        frappe.destroy()
+
+
+@click.command("refresh-scheme-report-snapshot")
+@click.option("--full", is_flag=True, default=False, help="Recompute every scheme, not only what changed")
+@pass_context
+def refresh_scheme_report_snapshot(context, full=False):
+    "Refresh the precomputed rows of the Custom Promotional Scheme Report"
+    import frappe
+
+    from promotional_scheme.promotional_scheme.snapshots import refresh_report_snapshot
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        result = refresh_report_snapshot(full=full, log=click.echo)
+        click.echo(f"{result['schemes']} schemes refreshed, watermark {result['watermark']}")
+    finally:
+        frappe.destroy()
+
+
+commands = [
+    rebuild_scheme_accruals,
+    reevaluate_scheme_invoices,
+    promotional_scheme_benchmark,
+    promotional_scheme_explain,
+    refresh_scheme_report_snapshot,
+]
@@ -11,11 +11,30 @@ app_license = "mit"
 # required_apps = []
 
 doc_events = {
+    # accrue first: apply_promotional_schemes changes line rates in memory only
     "Sales Invoice": {
-        "on_submit": "promotional_scheme.promotional_scheme.doctype.custom_promotional_scheme.custom_promotional_scheme.apply_promotional_schemes"
+        "on_submit": [
+            "promotional_scheme.promotional_scheme.accruals.accrue_invoice",
+            "promotional_scheme.promotional_scheme.doctype.custom_promotional_scheme.custom_promotional_scheme.apply_promotional_schemes",
+        ],
+        "on_cancel": "promotional_scheme.promotional_scheme.accruals.accrue_invoice",
     },
     "Purchase Invoice": {
-        "on_submit": "promotional_scheme.promotional_scheme.doctype.custom_promotional_scheme.custom_promotional_scheme.apply_promotional_schemes"
+        "on_submit": [
+            "promotional_scheme.promotional_scheme.accruals.accrue_invoice",
+            "promotional_scheme.promotional_scheme.doctype.custom_promotional_scheme.custom_promotional_scheme.apply_promotional_schemes",
+        ],
+        "on_cancel": "promotional_scheme.promotional_scheme.accruals.accrue_invoice",
+    },
+    "Item": {
+        "on_update": "promotional_scheme.promotional_scheme.item_groups.invalidate_item_cache",
+        "on_trash": "promotional_scheme.promotional_scheme.item_groups.invalidate_item_cache",
+        "after_rename": "promotional_scheme.promotional_scheme.item_groups.invalidate_item_cache",
+    },
+    "Item Group": {
+        "on_update": "promotional_scheme.promotional_scheme.item_groups.invalidate_item_group_cache",
+        "on_trash": "promotional_scheme.promotional_scheme.item_groups.invalidate_item_group_cache",
+        "after_rename": "promotional_scheme.promotional_scheme.item_groups.invalidate_item_group_cache",
     },
 }
 
@@ -54,6 +73,10 @@ doc_events = {
 
 # include js in doctype views
 # doctype_js = {"doctype" : "public/js/doctype.js"}
+doctype_js = {
+    "Sales Invoice": "public/js/invoice_promotional_schemes.js",
+    "Purchase Invoice": "public/js/invoice_promotional_schemes.js",
+}
 # doctype_list_js = {"doctype" : "public/js/doctype_list.js"}
 # doctype_tree_js = {"doctype" : "public/js/doctype_tree.js"}
 # doctype_calendar_js = {"doctype" : "public/js/doctype_calendar.js"}
@@ -95,6 +118,9 @@ doc_events = {
 # before_install = "promotional_scheme.install.before_install"
 # after_install = "promotional_scheme.install.after_install"
 
+# composite indexes for the report / scheme lookups, see db_indexes.py
+after_migrate = ["promotional_scheme.promotional_scheme.db_indexes.ensure_indexes"]
+
 # Uninstallation
 # ------------
 
@@ -176,6 +202,13 @@ doc_events = {
 # 	],
 # }
 
+scheduler_events = {
+    # report rows of schemes / parties with new invoices, see snapshots.py
+    "hourly_long": [
+        "promotional_scheme.promotional_scheme.snapshots.refresh_report_snapshot",
+    ],
+}
+
 # Testing
 # -------
 
@@ -203,6 +236,8 @@ doc_events = {
 # -----------------------------------------------------------
 
 # ignore_links_on_delete = ["Communication", "ToDo"]
+# accrual rows are removed by the scheme's on_trash
+ignore_links_on_delete = ["Promotional Scheme Accrual"]
 
 # Request Events
 # ----------------
@@ -0,0 +1,600 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Promotional Scheme Accrual ledger.
+
+Instead of summing raw invoice lines on every report run, every scheme keeps
+running totals per (scheme, party, item_or_group, posting_date):
+  - Sales / Purchase Invoice on_submit adds the invoice lines a scheme covers,
+    on_cancel subtracts them again (atomic upsert on the unique key).
+  - rebuild_accruals (bench rebuild-scheme-accruals, or a background job after
+    a scheme is edited) recomputes the rows of some / all schemes in chunks.
+
+A rebuild and the hooks are serialized on a per party side row (see
+_lock_rebuild_state): the hooks read it with a shared lock, every rebuild
+chunk takes it exclusively. A rebuild scans the submitted invoices in name
+order and records how far it got (the cursor) in that row; while it runs the
+hooks leave the invoices past the cursor to the scan and only accrue the ones
+it already passed, so every invoice is counted exactly once whatever
+happens to it during the rebuild.
+
+A scheme's rows are used by the report only once a rebuild completed for the
+scheme's current version (see is_ledger_ready); until then the report keeps
+querying the invoices. Lines are matched with the report's rules: item codes,
+else item groups (with nested groups, as of accrual time), within the scheme
+validity. Rows are kept for every party of the side: the report narrows them
+to the scheme's customers / suppliers and the members of its groups when it
+reads them (party_scope.PartyScope, against the party masters as they are
+then), so party group / territory changes need nothing here. Moving items
+between item groups, renaming items and restructuring the tree do: they bump
+the item version every ready stamp carries and queue a rebuild of all
+schemes (item_groups_changed).
+"""
+
+import json
+
+import frappe
+from frappe.utils import flt, getdate, now
+
+from promotional_scheme.promotional_scheme.compiled_cache import get_compiled_schemes
+from promotional_scheme.promotional_scheme.item_groups import get_item_group_of
+from promotional_scheme.promotional_scheme.loader import load_schemes
+from promotional_scheme.promotional_scheme.scheme_index import CompiledScheme, _current_version
+
+ACCRUAL_DOCTYPE = "Promotional Scheme Accrual"
+# global default holding the scheme "modified" + item version the ledger was last rebuilt for
+READY_KEY_PREFIX = "promotional_scheme_accrual_ready:"
+# global default changed whenever items move between item groups (see item_groups_changed)
+ITEM_VERSION_KEY = "promotional_scheme_accrual_item_version"
+# global default per party side: {scheme: {"token", "cursor"}} of the rebuilds running
+REBUILD_KEY_PREFIX = "promotional_scheme_accrual_rebuild:"
+GLOBAL_DEFAULTS = "__global"
+
+# (site, party_side) -> (index version, AccrualIndex), per process
+_scheme_cache = {}
+
+INVOICE_TABLES = {
+    "Selling": ("Sales Invoice", "`tabSales Invoice`", "`tabSales Invoice Item`", "customer", "Customer"),
+    "Buying": ("Purchase Invoice", "`tabPurchase Invoice`", "`tabPurchase Invoice Item`", "supplier", "Supplier"),
+}
+
+UPSERT_BATCH_SIZE = 500
+
+
+def _party_side(select_the_party):
+    # same default as the report: anything but Buying is Selling
+    return "Buying" if (select_the_party or "").strip() == "Buying" else "Selling"
+
+
+class AccrualIndex:
+    """
+    Schemes of one party side (any validity) with posting lists on the line
+    field _accrual_key reads for them: item code, item group, or neither
+    (wildcards). match() is a superset of the schemes a line accrues for,
+    _accrual_key decides.
+    """
+
+    __slots__ = ("group_postings", "item_postings", "schemes", "wildcards")
+
+    def __init__(self, schemes):
+        self.schemes = list(schemes)
+        self.item_postings = {}
+        self.group_postings = {}
+        self.wildcards = set()
+        for pos, scheme in enumerate(self.schemes):
+            if scheme.apply_on != "Item Group" and scheme.item_codes:
+                for code in scheme.item_codes:
+                    self.item_postings.setdefault(code, set()).add(pos)
+            elif scheme.item_groups:
+                for group in scheme.item_groups:
+                    self.group_postings.setdefault(group, set()).add(pos)
+            else:
+                self.wildcards.add(pos)
+
+    def match(self, item_code, item_group):
+        """Positions of the schemes that may cover a line."""
+        hits = set(self.wildcards)
+        hits.update(self.item_postings.get(item_code, ()))
+        if item_group:
+            hits.update(self.group_postings.get(item_group, ()))
+        return hits
+
+
+def get_accrual_schemes(party_side):
+    """AccrualIndex of a party side, rebuilt once per scheme index version."""
+    version = _current_version()
+    key = (frappe.local.site, party_side)
+    cached = _scheme_cache.get(key)
+    if cached is None or cached[0] != version:
+        rows = [
+            row
+            for row in frappe.get_all("Custom Promotional Scheme", fields=["name", "modified", "select_the_party"])
+            if _party_side(row.select_the_party) == party_side
+        ]
+        cached = _scheme_cache[key] = (version, AccrualIndex(get_compiled_schemes(rows)))
+    return cached[1]
+
+
+def _line_amount(line):
+    # COALESCE(base_net_amount, base_amount, amount, 0), like the report query
+    for fieldname in ("base_net_amount", "base_amount", "amount"):
+        value = line.get(fieldname)
+        if value is not None:
+            return flt(value)
+    return 0.0
+
+
+def _accrual_key(scheme, item_code, item_group):
+    """Item code / item group the line accrues under for this scheme, or None if not covered."""
+    if scheme.apply_on == "Item Group":
+        # Item Group mode joins Item, lines without an item group drop out
+        if not item_group or (scheme.item_groups and item_group not in scheme.item_groups):
+            return None
+        return item_group
+
+    if scheme.item_codes:
+        if item_code not in scheme.item_codes:
+            return None
+    elif scheme.item_groups and item_group not in scheme.item_groups:
+        return None
+    return item_code or ""
+
+
+def _in_validity(scheme, posting_date):
+    if scheme.valid_from and posting_date < scheme.valid_from:
+        return False
+    if scheme.valid_to and posting_date > scheme.valid_to:
+        return False
+    return True
+
+
+def _accumulate(accruals, scheme_name, party_type, party, key, posting_date, amount, qty, line_count):
+    row_key = (scheme_name, party or "", key, posting_date)
+    acc = accruals.get(row_key)
+    if acc is None:
+        acc = accruals[row_key] = [party_type, 0.0, 0.0, 0]
+    acc[1] += amount
+    acc[2] += qty
+    acc[3] += line_count
+
+
+def _upsert_accruals(accruals):
+    """accruals: {(scheme, party, item_or_group, posting_date): [party_type, amount, qty, line_count]}"""
+    if not accruals:
+        return
+
+    timestamp, user = now(), frappe.session.user
+    rows = [
+        (frappe.generate_hash(length=10), timestamp, timestamp, user, user,
+         scheme, party_type, party, key, posting_date, amount, qty, line_count)
+        for (scheme, party, key, posting_date), (party_type, amount, qty, line_count) in accruals.items()
+    ]
+
+    columns = (
+        "name, creation, modified, modified_by, owner, scheme, party_type, party, "
+        "item_or_group, posting_date, total_amount, total_qty, line_count"
+    )
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        batch = rows[start : start + UPSERT_BATCH_SIZE]
+        placeholders = ", ".join(["(" + ", ".join(["%s"] * 13) + ")"] * len(batch))
+        values = tuple(v for row in batch for v in row)
+        frappe.db.multisql(
+            {
+                "mariadb": f"""
+                    INSERT INTO `tab{ACCRUAL_DOCTYPE}` ({columns}) VALUES {placeholders}
+                    ON DUPLICATE KEY UPDATE
+                        total_amount = total_amount + VALUES(total_amount),
+                        total_qty = total_qty + VALUES(total_qty),
+                        line_count = line_count + VALUES(line_count),
+                        modified = VALUES(modified)
+                """,
+                "postgres": f"""
+                    INSERT INTO `tab{ACCRUAL_DOCTYPE}` ({columns}) VALUES {placeholders}
+                    ON CONFLICT (scheme, party, item_or_group, posting_date) DO UPDATE SET
+                        total_amount = `tab{ACCRUAL_DOCTYPE}`.total_amount + EXCLUDED.total_amount,
+                        total_qty = `tab{ACCRUAL_DOCTYPE}`.total_qty + EXCLUDED.total_qty,
+                        line_count = `tab{ACCRUAL_DOCTYPE}`.line_count + EXCLUDED.line_count,
+                        modified = EXCLUDED.modified
+                """,
+            },
+            values,
+        )
+
+
+def _drop_empty_rows(scheme_names):
+    # a fully cancelled key must not show up as a (zero) party / item in the report
+    if scheme_names:
+        frappe.db.delete(ACCRUAL_DOCTYPE, {"scheme": ["in", list(scheme_names)], "line_count": ["<=", 0]})
+
+
+# -------------------------
+# doc_events: Sales / Purchase Invoice on_submit / on_cancel
+# -------------------------
+def accrue_invoice(doc, method=None):
+    """Add (submit) or subtract (cancel) the invoice lines every covering scheme accrues."""
+    if doc.doctype not in ("Sales Invoice", "Purchase Invoice"):
+        return
+
+    party_side = "Selling" if doc.doctype == "Sales Invoice" else "Buying"
+    index = get_accrual_schemes(party_side)
+    if not index.schemes:
+        return
+
+    sign = -1 if (method == "on_cancel" or doc.docstatus == 2) else 1
+    _, header, _, party_field, party_type = INVOICE_TABLES[party_side]
+    party = doc.get(party_field)
+    posting_date = getdate(doc.posting_date)
+    # held until the invoice commits: a rebuild chunk can't run in between
+    rebuilding = _lock_rebuild_state(party_side, shared=True)
+    left_to_rebuild = _left_to_rebuild(header, doc.name, rebuilding)
+
+    accruals = {}
+    # position -> accrues this invoice at all, decided once per scheme
+    live = {}
+    for line in doc.get("items") or []:
+        # the Item's group, as the report and the rebuild read it (not the line's copy)
+        item_group = get_item_group_of(line.item_code)
+        for pos in index.match(line.item_code, item_group):
+            scheme = index.schemes[pos]
+            if pos not in live:
+                live[pos] = scheme.name not in left_to_rebuild and _in_validity(scheme, posting_date)
+            if not live[pos]:
+                continue
+            key = _accrual_key(scheme, line.item_code, item_group)
+            if key is None:
+                continue
+            _accumulate(
+                accruals, scheme.name, party_type, party, key, posting_date,
+                sign * _line_amount(line), sign * flt(line.qty), sign,
+            )
+
+    _upsert_accruals(accruals)
+    if sign < 0:
+        _drop_empty_rows({scheme_name for (scheme_name, _, _, _) in accruals})
+
+
+# -------------------------
+# Rebuild / backfill
+# -------------------------
+def _ready_key(scheme_name):
+    return f"{READY_KEY_PREFIX}{scheme_name}"
+
+
+def _rebuild_key(party_side):
+    return f"{REBUILD_KEY_PREFIX}{party_side}"
+
+
+def _ensure_rebuild_state(party_side):
+    # the row must exist before anyone locks it, a missing row locks nothing
+    if not frappe.db.sql(
+        "SELECT 1 FROM `tabDefaultValue` WHERE parent = %s AND defkey = %s",
+        (GLOBAL_DEFAULTS, _rebuild_key(party_side)),
+    ):
+        frappe.db.set_global(_rebuild_key(party_side), "{}")
+        frappe.db.commit()
+
+
+def _lock_rebuild_state(party_side, shared=False):
+    """
+    {scheme: {"token", "cursor"}} of the rebuilds running on party_side, read
+    with a lock on its row held until commit: shared for the hooks (they don't
+    block each other), exclusive for the rebuild.
+    """
+    query = "SELECT defvalue FROM `tabDefaultValue` WHERE parent = %s AND defkey = %s"
+    rows = frappe.db.multisql(
+        {
+            "mariadb": query + (" LOCK IN SHARE MODE" if shared else " FOR UPDATE"),
+            "postgres": query + (" FOR SHARE" if shared else " FOR UPDATE"),
+        },
+        (GLOBAL_DEFAULTS, _rebuild_key(party_side)),
+    )
+    return json.loads(rows[0][0] or "{}") if rows else {}
+
+
+def _save_rebuild_state(party_side, state):
+    frappe.db.sql(
+        "UPDATE `tabDefaultValue` SET defvalue = %s WHERE parent = %s AND defkey = %s",
+        (json.dumps(state), GLOBAL_DEFAULTS, _rebuild_key(party_side)),
+    )
+
+
+def _left_to_rebuild(header, invoice_name, rebuilding):
+    """Schemes whose running rebuild hasn't scanned invoice_name yet (it counts the invoice itself)."""
+    left = set()
+    for cursor in {entry["cursor"] for entry in rebuilding.values()}:
+        # compared by the database, with the collation the scan orders by
+        passed = bool(cursor) and bool(
+            frappe.db.sql(f"SELECT 1 FROM {header} WHERE name = %s AND name <= %s", (invoice_name, cursor))
+        )
+        if not passed:
+            left.update(scheme for scheme, entry in rebuilding.items() if entry["cursor"] == cursor)
+    return left
+
+
+def _item_version():
+    return frappe.db.get_global(ITEM_VERSION_KEY) or ""
+
+
+def _ready_stamp(modified, item_version):
+    return f"{modified or ''}|{item_version}"
+
+
+def mark_ledger_ready(scheme_name, stamp):
+    frappe.db.set_global(_ready_key(scheme_name), stamp)
+
+
+def clear_ledger_ready(scheme_name):
+    frappe.db.set_global(_ready_key(scheme_name), "")
+
+
+def is_ledger_ready(scheme_doc):
+    """True when the ledger was rebuilt for this exact version of the scheme and of the items."""
+    stamp = frappe.db.get_global(_ready_key(scheme_doc.name))
+    return bool(stamp) and stamp == _ready_stamp(scheme_doc.modified, _item_version())
+
+
+def _union_validity(schemes):
+    from_dates = [s.valid_from for s in schemes]
+    to_dates = [s.valid_to for s in schemes]
+    from_date = None if any(d is None for d in from_dates) else min(from_dates)
+    to_date = None if any(d is None for d in to_dates) else max(to_dates)
+    return from_date, to_date
+
+
+def _rebuild_side(party_side, schemes, token, stamps, chunk_size, log):
+    doctype, header, item_table, party_field, party_type = INVOICE_TABLES[party_side]
+    from_date, to_date = _union_validity(schemes)
+
+    # every chunk reads the invoices as they are now: the hooks don't touch
+    # the schemes' rows for invoices past the cursor, and accrue the ones
+    # before it themselves
+    where_clauses = ["si.docstatus = 1"]
+    base_params = []
+    if from_date:
+        where_clauses.append("si.posting_date >= %s")
+        base_params.append(str(from_date))
+    if to_date:
+        where_clauses.append("si.posting_date <= %s")
+        base_params.append(str(to_date))
+
+    last_name, processed = "", 0
+    while True:
+        state = _lock_rebuild_state(party_side)
+        # a newer rebuild of a scheme (saved again meanwhile) takes it over
+        schemes = [s for s in schemes if state.get(s.name, {}).get("token") == token]
+        if not schemes:
+            frappe.db.commit()
+            break
+
+        names = frappe.db.sql_list(
+            f"""
+            SELECT si.name FROM {header} si
+            WHERE {" AND ".join(where_clauses)} AND si.name > %s
+            ORDER BY si.name
+            LIMIT %s
+            """,
+            (*base_params, last_name, chunk_size),
+        )
+        if not names:
+            scheme_names = [scheme.name for scheme in schemes]
+            _drop_empty_rows(scheme_names)
+            for scheme_name in scheme_names:
+                del state[scheme_name]
+                mark_ledger_ready(scheme_name, stamps[scheme_name])
+            _save_rebuild_state(party_side, state)
+            frappe.db.commit()
+            break
+        last_name = names[-1]
+
+        placeholders = ", ".join(["%s"] * len(names))
+        lines = frappe.db.sql(
+            f"""
+            SELECT
+                si.{party_field} AS party,
+                si.posting_date AS posting_date,
+                sii.item_code AS item_code,
+                i.item_group AS item_group,
+                SUM(COALESCE(sii.base_net_amount, sii.base_amount, sii.amount, 0)) AS total_amount,
+                SUM(COALESCE(sii.qty, 0)) AS total_qty,
+                COUNT(*) AS line_count
+            FROM {header} si
+            JOIN {item_table} sii ON sii.parent = si.name
+            LEFT JOIN `tabItem` i ON i.name = sii.item_code
+            WHERE si.name IN ({placeholders})
+            GROUP BY si.{party_field}, si.posting_date, sii.item_code, i.item_group
+            """,
+            tuple(names),
+            as_dict=True,
+        )
+
+        accruals = {}
+        index = AccrualIndex(schemes)
+        for line in lines:
+            posting_date = getdate(line.posting_date)
+            for pos in index.match(line.item_code, line.item_group):
+                scheme = index.schemes[pos]
+                if not _in_validity(scheme, posting_date):
+                    continue
+                key = _accrual_key(scheme, line.item_code, line.item_group)
+                if key is None:
+                    continue
+                _accumulate(
+                    accruals, scheme.name, party_type, line.party, key, posting_date,
+                    flt(line.total_amount), flt(line.total_qty), int(line.line_count or 0),
+                )
+
+        _upsert_accruals(accruals)
+        for scheme in schemes:
+            state[scheme.name]["cursor"] = last_name
+        _save_rebuild_state(party_side, state)
+        frappe.db.commit()
+
+        processed += len(names)
+        if log:
+            log(f"{doctype}: {processed} invoices processed")
+
+
+def rebuild_accruals(schemes=None, chunk_size=500, log=None):
+    """
+    Recompute the ledger rows of the given scheme names (default: all schemes)
+    from submitted invoices, chunk_size invoices at a time (keyset on name),
+    committing after every chunk. Each scheme is marked ready once its side
+    is done, unless a newer rebuild of it started meanwhile. A rebuild that
+    dies leaves its schemes not ready until the next one.
+    """
+    chunk_size = max(int(chunk_size or 500), 1)
+    names = schemes or frappe.get_all("Custom Promotional Scheme", pluck="name")
+    token = frappe.generate_hash(length=10)
+    # read before the scan: an item moved after this leaves the schemes not ready
+    item_version = _item_version()
+
+    by_side = {}
+    stamps = {}
+    for scheme_doc in load_schemes(names):
+        clear_ledger_ready(scheme_doc.name)
+        stamps[scheme_doc.name] = _ready_stamp(scheme_doc.modified, item_version)
+        scheme = CompiledScheme(scheme_doc)
+        by_side.setdefault(_party_side(scheme.select_the_party), []).append(scheme)
+
+    if not stamps:
+        return
+
+    # claim the schemes and empty their rows under the side locks (always
+    # taken in the same order), nothing scanned yet: the hooks leave them alone
+    for party_side in sorted(by_side):
+        _ensure_rebuild_state(party_side)
+    for party_side in sorted(by_side):
+        state = _lock_rebuild_state(party_side)
+        for scheme in by_side[party_side]:
+            state[scheme.name] = {"token": token, "cursor": ""}
+        _save_rebuild_state(party_side, state)
+    frappe.db.delete(ACCRUAL_DOCTYPE, {"scheme": ["in", list(stamps)]})
+    frappe.db.commit()
+
+    for party_side, side_schemes in by_side.items():
+        _rebuild_side(party_side, side_schemes, token, stamps, chunk_size, log)
+
+
+def enqueue_accrual_rebuild(scheme_name, modified=None):
+    """Scheme changed: its rows no longer match its rules, recompute them in the background."""
+    clear_ledger_ready(scheme_name)
+    frappe.enqueue(
+        "promotional_scheme.promotional_scheme.accruals.rebuild_accruals",
+        queue="long",
+        # per version: a save while a rebuild runs must get its own job
+        job_id=f"promotional_scheme_accrual_rebuild::{scheme_name}::{modified or ''}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        schemes=[scheme_name],
+    )
+
+
+def item_groups_changed():
+    """
+    Items moved between item groups, an item / item group was renamed or the
+    tree changed: every scheme's rows may sit under the wrong item / group.
+    A new item version makes them not ready (rebuilds running now included)
+    and one rebuild of all schemes runs for it.
+    """
+    item_version = frappe.generate_hash(length=12)
+    frappe.db.set_global(ITEM_VERSION_KEY, item_version)
+    frappe.enqueue(
+        "promotional_scheme.promotional_scheme.accruals.rebuild_after_item_change",
+        queue="long",
+        job_id=f"promotional_scheme_accrual_rebuild::items::{item_version}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        item_version=item_version,
+    )
+
+
+def rebuild_after_item_change(item_version):
+    # a later change queued its own rebuild, this one would be stale on arrival
+    if item_version == _item_version():
+        rebuild_accruals()
+
+
+def delete_scheme_accruals(scheme_name):
+    frappe.db.delete(ACCRUAL_DOCTYPE, {"scheme": scheme_name})
+    clear_ledger_ready(scheme_name)
+
+
+def rename_scheme_accruals(old_name, new_name):
+    # the scheme link on the rows is renamed by frappe, only the ready stamp is ours
+    stamp = frappe.db.get_global(_ready_key(old_name))
+    clear_ledger_ready(old_name)
+    if stamp:
+        frappe.db.set_global(_ready_key(new_name), stamp)
+
+
+# -------------------------
+# Report side
+# -------------------------
+def ledger_covers(scheme_doc, from_date, to_date):
+    """Ledger can answer for [from_date, to_date]: rebuilt for this version and inside the validity."""
+    valid_from = getdate(scheme_doc.valid_from) if scheme_doc.valid_from else None
+    valid_to = getdate(scheme_doc.valid_to) if scheme_doc.valid_to else None
+    if valid_from and (from_date is None or from_date < valid_from):
+        return False
+    if valid_to and (to_date is None or to_date > valid_to):
+        return False
+    return is_ledger_ready(scheme_doc)
+
+
+def get_accrued_totals(scheme_name, from_date=None, to_date=None, party_scope=None, item_keys=None, party_name=None, having=None):
+    """
+    Same shape as the report's _get_totals_for_scheme, read from the ledger:
+    {(party or None, item_or_group or None): {"total_amount", "total_qty"}}.
+    party_scope (party_scope.PartyScope) narrows to the scheme's parties (the
+    ledger holds every party's lines); item_keys to some item codes / item
+    groups (the ledger already holds only the items the scheme covers).
+    """
+    where_clauses = ["a.scheme = %s"]
+    params = [scheme_name]
+    if from_date:
+        where_clauses.append("a.posting_date >= %s")
+        params.append(str(from_date))
+    if to_date:
+        where_clauses.append("a.posting_date <= %s")
+        params.append(str(to_date))
+    party_join, party_condition, party_params = party_scope.sql("a.party") if party_scope else ("", "", [])
+    if party_condition:
+        where_clauses.append(party_condition)
+        params.extend(party_params)
+    if party_name:
+        where_clauses.append("a.party = %s")
+        params.append(party_name)
+    if item_keys:
+        where_clauses.append(f"a.item_or_group IN ({', '.join(['%s'] * len(item_keys))})")
+        params.extend(item_keys)
+
+    having_clauses = ["SUM(a.line_count) > 0"]
+    if having and flt(having.get("total_amount")) > 0:
+        having_clauses.append("SUM(a.total_amount) >= %s")
+        params.append(flt(having.get("total_amount")))
+    if having and flt(having.get("total_qty")) > 0:
+        having_clauses.append("SUM(a.total_qty) >= %s")
+        params.append(flt(having.get("total_qty")))
+
+    rows = frappe.db.sql(
+        f"""
+        SELECT a.party AS party, a.item_or_group AS item_or_group,
+            SUM(a.total_amount) AS total_amount, SUM(a.total_qty) AS total_qty
+        FROM `tab{ACCRUAL_DOCTYPE}` a
+        {party_join}
+        WHERE {" AND ".join(where_clauses)}
+        GROUP BY a.party, a.item_or_group
+        HAVING {" AND ".join(having_clauses)}
+        """,
+        tuple(params),
+        as_dict=True,
+    ) or []
+
+    return {
+        (r.party or None, r.item_or_group or None): {
+            "total_amount": flt(r.total_amount),
+            "total_qty": flt(r.total_qty),
+        }
+        for r in rows
+    }
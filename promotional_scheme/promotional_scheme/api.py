@@ -0,0 +1,178 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Whitelisted endpoints.
+
+preview_promotional_schemes runs a draft invoice through the same path as
+the submit hook (compiled scheme index -> engine) and returns what would be
+applied, without touching the document. The invoice form calls it (debounced)
+while lines are entered, see public/js/invoice_promotional_schemes.js.
+
+get_overlapping_schemes lists the schemes whose validity overlaps a date
+range for the scheme form, from the validity calendar (validity_calendar.py).
+"""
+
+import json
+from time import perf_counter
+
+import frappe
+from frappe.utils import flt
+
+from promotional_scheme.promotional_scheme.doctype.promotional_scheme_settings.promotional_scheme_settings import (
+    get_stacking_policy,
+)
+from promotional_scheme.promotional_scheme.engine import (
+    PARTY_DIMENSIONS,
+    Invoice,
+    InvoiceLine,
+    apply_adjustments,
+    evaluate_candidates,
+)
+from promotional_scheme.promotional_scheme.policy import resolve
+from promotional_scheme.promotional_scheme.scheme_index import get_active_scheme_index
+from promotional_scheme.promotional_scheme.validity_calendar import get_validity_calendar
+
+PARTY_SIDES = {"Sales Invoice": "Selling", "Purchase Invoice": "Buying"}
+
+# party-only previews: party master fields that fill the other dimensions
+PARTY_MASTERS = {
+    "Selling": ("Customer", "customer", ("customer_group", "territory")),
+    "Buying": ("Supplier", "supplier", ("supplier_group",)),
+}
+
+
+def _parse(value):
+    if isinstance(value, str):
+        value = json.loads(value) if value else None
+    return value
+
+
+def _preview_line(position, row):
+    qty = flt(row.get("qty"))
+    rate = flt(row.get("rate"))
+    # a draft may not have its totals computed yet
+    amount = row.get("base_net_amount")
+    if amount in (None, ""):
+        amount = row.get("net_amount") if row.get("net_amount") not in (None, "") else qty * rate
+    return InvoiceLine(
+        idx=position,
+        item_code=row.get("item_code"),
+        item_group=row.get("item_group"),
+        qty=qty,
+        rate=rate,
+        base_net_amount=flt(amount),
+    )
+
+
+def _party_values(doc, party_side, party):
+    fields = PARTY_DIMENSIONS[party_side]
+    if doc is not None:
+        # exactly what the submit hook reads off the invoice
+        return {f: doc.get(f) for f, _ in fields}
+
+    doctype, party_field, other_fields = PARTY_MASTERS[party_side]
+    parties = {party_field: party}
+    if party:
+        values = frappe.get_cached_value(doctype, party, list(other_fields), as_dict=True) or {}
+        parties.update({f: values.get(f) for f in other_fields})
+    return parties
+
+
+@frappe.whitelist()
+def preview_promotional_schemes(doc=None, doctype=None, party=None, items=None, posting_date=None):
+    """
+    Schemes that would apply to a draft invoice, and their effect per line.
+
+    Either doc (the draft Sales / Purchase Invoice, dict or JSON) or
+    doctype + party + items ([{item_code, qty, rate, ...}]) + posting_date
+    (default today). Nothing is saved.
+    """
+    started = perf_counter()
+    doc = _parse(doc)
+    if doc is not None:
+        doc = frappe._dict(doc)
+        doctype = doc.get("doctype")
+        items = doc.get("items")
+        posting_date = doc.get("posting_date")
+    items = _parse(items) or []
+
+    party_side = PARTY_SIDES.get(doctype)
+    if not party_side:
+        frappe.throw(frappe._("Preview is only available for Sales Invoice and Purchase Invoice."))
+    frappe.has_permission(doctype, "read", throw=True)
+
+    invoice = Invoice(
+        party_side=party_side,
+        parties=_party_values(doc, party_side, party),
+        lines=[_preview_line(i, frappe._dict(row)) for i, row in enumerate(items) if row],
+    )
+
+    # same compiled / cached lookup, evaluation and stacking policy as on submit
+    scheme_index = get_active_scheme_index(party_side, posting_date)
+    evaluated = evaluate_candidates(scheme_index.match_invoice(invoice.parties, invoice.lines))
+    adjustments = resolve(invoice, evaluated, *get_stacking_policy())
+    applied = {adj.scheme for adj in adjustments}
+
+    schemes = [
+        {
+            "scheme": scheme.name,
+            "scheme_name": scheme.scheme_name,
+            "validation_type": scheme.validation_type,
+            "lines": sorted({i + 1 for adj in scheme_adjustments for i in adj.lines}),
+            "slabs": [scheme.slabs.as_dict(adj.slab) for adj in scheme_adjustments],
+            "applies": scheme.name in applied,
+        }
+        for scheme, scheme_adjustments in evaluated
+    ]
+
+    original_rates = [line.rate for line in invoice.lines]
+    apply_adjustments(invoice, adjustments)
+
+    line_results = [
+        {
+            "idx": line.idx + 1,
+            "item_code": line.item_code,
+            "rate": original_rates[pos],
+            "new_rate": line.rate,
+            "adjustments": [],
+        }
+        for pos, line in enumerate(invoice.lines)
+    ]
+    by_idx = {line.idx: result for line, result in zip(invoice.lines, line_results, strict=True)}
+    for adj in adjustments:
+        for i in adj.lines:
+            by_idx[i]["adjustments"].append(
+                {
+                    "scheme": adj.scheme,
+                    "kind": adj.kind,
+                    "value": adj.value,
+                    "free_product": adj.free_product,
+                }
+            )
+
+    return {
+        "party_side": party_side,
+        "schemes": schemes,
+        "lines": line_results,
+        "elapsed_ms": round((perf_counter() - started) * 1000, 2),
+    }
+
+
+@frappe.whitelist()
+def get_overlapping_schemes(valid_from, valid_to, party_side=None, limit=50):
+    """Schemes whose validity overlaps [valid_from, valid_to], in scheme order (at most limit)."""
+    frappe.has_permission("Custom Promotional Scheme", "read", throw=True)
+    rows = get_validity_calendar().overlapping(valid_from, valid_to, party_side or None)
+    schemes = [
+        {
+            "name": row.name,
+            "scheme_name": row.scheme_name,
+            "select_the_party": row.select_the_party,
+            "valid_from": row.valid_from,
+            "valid_to": row.valid_to,
+        }
+        for row in rows
+    ]
+    limit = int(limit or 0)
+    return schemes[:limit] if limit > 0 else schemes
@@ -0,0 +1,390 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Benchmark harness for scheme application and the report.
+
+    bench --site test_site promotional-scheme-benchmark --schemes 200 --customers 500 \\
+        --items 1000 --item-groups 40 --invoices 5000 --lines 8 --output bench.json
+
+Generates synthetic Item Groups, Items, Customers, Custom Promotional Schemes
+and submitted Sales Invoices (seeded, so runs are comparable), times
+apply_promotional_schemes per submit and the report's execute() over a set of
+filter combinations, and writes the results as JSON.
+
+All rows are written with frappe.db.bulk_insert (no controllers / hooks) and
+rolled back at the end. Use a test site anyway: caches are shared with it.
+"""
+
+import json
+import random
+import statistics
+import subprocess
+from datetime import timedelta
+from time import perf_counter
+
+import frappe
+from frappe.utils import add_days, getdate, now, nowdate
+
+from promotional_scheme.promotional_scheme.item_groups import ITEM_GROUP_TREE_VERSION_KEY
+from promotional_scheme.promotional_scheme.slabs import AMOUNT, QUANTITY, QUANTITY_AND_AMOUNT
+
+PREFIX = "BENCH-"
+SCHEME_DOCTYPE = "Custom Promotional Scheme"
+
+DEFAULT_SCALE = {
+    "schemes": 100,
+    "customers": 200,
+    "items": 500,
+    "item_groups": 20,
+    "invoices": 2000,
+    "lines": 8,
+    "submits": 200,
+    "report_runs": 3,
+    "seed": 42,
+}
+
+
+# -------------------------
+# Synthetic data
+# -------------------------
+def _base_row(name, timestamp):
+    return [name, timestamp, timestamp, "Administrator", "Administrator"]
+
+
+BASE_FIELDS = ["name", "creation", "modified", "owner", "modified_by"]
+CHILD_FIELDS = [*BASE_FIELDS, "parent", "parenttype", "parentfield", "idx"]
+
+
+def _insert(doctype, fields, rows):
+    if rows:
+        frappe.db.bulk_insert(doctype, fields, rows, ignore_duplicates=True)
+
+
+def _make_item_groups(rnd, count, timestamp):
+    """A separate subtree right of the existing tree, some groups nested one level."""
+    start = (frappe.db.sql("SELECT MAX(rgt) FROM `tabItem Group`")[0][0] or 0) + 1
+    root = f"{PREFIX}Item Groups"
+    tops, nested = [], {}
+    for i in range(count):
+        name = f"{PREFIX}IG-{i:03d}"
+        if tops and rnd.random() < 0.3:
+            nested.setdefault(rnd.choice(tops), []).append(name)
+        else:
+            tops.append(name)
+
+    rows, counter = [], [start + 1]
+
+    def place(name, parent, children):
+        lft = counter[0]
+        counter[0] += 1
+        for child in children:
+            place(child, name, [])
+        rows.append([*_base_row(name, timestamp), name, parent, lft, counter[0], 1 if children else 0])
+        counter[0] += 1
+
+    for name in tops:
+        place(name, root, nested.get(name, []))
+    rows.append([*_base_row(root, timestamp), root, None, start, counter[0], 1])
+
+    _insert("Item Group", [*BASE_FIELDS, "item_group_name", "parent_item_group", "lft", "rgt", "is_group"], rows)
+    return [r[0] for r in rows if r[0] != root]
+
+
+def _make_master_data(rnd, scale, timestamp):
+    groups = _make_item_groups(rnd, scale["item_groups"], timestamp)
+
+    items = []
+    for i in range(scale["items"]):
+        name = f"{PREFIX}ITEM-{i:05d}"
+        items.append([*_base_row(name, timestamp), name, name, rnd.choice(groups), "Nos"])
+    _insert("Item", [*BASE_FIELDS, "item_code", "item_name", "item_group", "stock_uom"], items)
+
+    customer_groups = [f"{PREFIX}CG-{i}" for i in range(5)]
+    territories = [f"{PREFIX}TER-{i}" for i in range(5)]
+    customers = []
+    for i in range(scale["customers"]):
+        name = f"{PREFIX}CUST-{i:05d}"
+        customers.append(
+            [*_base_row(name, timestamp), name, rnd.choice(customer_groups), rnd.choice(territories)]
+        )
+    _insert("Customer", [*BASE_FIELDS, "customer_name", "customer_group", "territory"], customers)
+
+    return frappe._dict(
+        groups=groups,
+        item_list=[(r[0], r[-2]) for r in items],
+        customers=[(r[0], r[-2], r[-1]) for r in customers],
+        customer_groups=customer_groups,
+        territories=territories,
+    )
+
+
+def _child(name, parent, parentfield, idx, timestamp):
+    return [*_base_row(name, timestamp), parent, SCHEME_DOCTYPE, parentfield, idx]
+
+
+def _make_schemes(rnd, scale, data, timestamp):
+    today = getdate(nowdate())
+    parents = []
+    children = {}
+
+    def add_child(doctype, fields, row):
+        children.setdefault((doctype, tuple(fields)), []).append(row)
+
+    for i in range(scale["schemes"]):
+        name = f"{PREFIX}SCHEME-{i:04d}"
+        apply_on = rnd.choice(["Item Code", "Item Group"])
+        validation = rnd.choice([AMOUNT, QUANTITY, QUANTITY_AND_AMOUNT])
+        # most schemes active today, the rest in the past year
+        if rnd.random() < 0.7:
+            valid_from = today - timedelta(days=rnd.randint(0, 180))
+            valid_to = today + timedelta(days=rnd.randint(0, 180))
+        else:
+            valid_from = today - timedelta(days=rnd.randint(181, 365))
+            valid_to = valid_from + timedelta(days=rnd.randint(10, 150))
+        parents.append(
+            [*_base_row(name, timestamp), name, apply_on, str(valid_from), str(valid_to), "Selling", validation]
+        )
+
+        idx = 0
+        if apply_on == "Item Code":
+            for item_code, _ in rnd.sample(data.item_list, min(len(data.item_list), rnd.randint(1, 20))):
+                idx += 1
+                add_child("Pricing Rule Item Code", ["item_code"],
+                          [*_child(f"{name}-IC-{idx}", name, "promotional_scheme_on_item_code", idx, timestamp), item_code])
+        else:
+            for group in rnd.sample(data.groups, min(len(data.groups), rnd.randint(1, 3))):
+                idx += 1
+                add_child("Pricing Rule Item Group", ["item_group"],
+                          [*_child(f"{name}-IG-{idx}", name, "promotional_scheme_on_item_group", idx, timestamp), group])
+
+        # party restriction: none / customers / customer group / territory
+        party_kind = rnd.choice([None, None, "customer", "customer_group", "territory"])
+        if party_kind == "customer":
+            for k, (customer, _, _) in enumerate(rnd.sample(data.customers, min(len(data.customers), rnd.randint(1, 30)))):
+                add_child("Customer Item", ["customer"], [*_child(f"{name}-C-{k}", name, "customer", k + 1, timestamp), customer])
+        elif party_kind == "customer_group":
+            add_child("Customer Group Item", ["customer_group"],
+                      [*_child(f"{name}-CG", name, "customer_group", 1, timestamp), rnd.choice(data.customer_groups)])
+        elif party_kind == "territory":
+            add_child("Territory Item", ["territory"],
+                      [*_child(f"{name}-T", name, "territory", 1, timestamp), rnd.choice(data.territories)])
+
+        for k in range(rnd.randint(1, 5)):
+            row = _child(f"{name}-S-{k}", name, None, k + 1, timestamp)
+            if validation == AMOUNT:
+                row[-2] = "amount_discount_slabs"
+                add_child("Promotional scheme Amount Slab", ["minimum_amount", "discount_percentage"],
+                          [*row, rnd.choice([1000, 5000, 10000, 50000]), rnd.choice([2, 5, 10, 15])])
+            elif validation == QUANTITY:
+                row[-2] = "quantity_discount_slabs"
+                add_child("Promotional Scheme Quantity Slab", ["minimum_quantity", "free_quantity"],
+                          [*row, rnd.choice([5, 10, 50, 100]), rnd.choice([1, 2, 5])])
+            else:
+                row[-2] = "free_qty_with_amount_off"
+                add_child("Promotional Scheme Quantity with Amount", ["min_qty", "free_qty", "amount_off"],
+                          [*row, rnd.choice([5, 10, 50]), rnd.choice([0, 1]), rnd.choice([100, 500, 1000])])
+
+    _insert(
+        SCHEME_DOCTYPE,
+        [*BASE_FIELDS, "scheme_name", "apply_on", "valid_from", "valid_to", "select_the_party", "type_of_promo_validation"],
+        parents,
+    )
+    for (doctype, fields), rows in children.items():
+        _insert(doctype, [*CHILD_FIELDS, *fields], rows)
+    return [r[0] for r in parents]
+
+
+def _invoice_lines(rnd, data, count):
+    lines = []
+    for _ in range(count):
+        item_code, item_group = rnd.choice(data.item_list)
+        qty = rnd.choice([1, 2, 5, 10, 20])
+        rate = rnd.choice([50, 100, 250, 1000])
+        lines.append((item_code, item_group, qty, rate))
+    return lines
+
+
+def _make_invoices(rnd, scale, data, timestamp):
+    today = getdate(nowdate())
+    invoices, items = [], []
+    for i in range(scale["invoices"]):
+        name = f"{PREFIX}SINV-{i:06d}"
+        customer = rnd.choice(data.customers)[0]
+        posting_date = today - timedelta(days=rnd.randint(0, 365))
+        invoices.append([*_base_row(name, timestamp), customer, str(posting_date), 1])
+        for idx, (item_code, item_group, qty, rate) in enumerate(_invoice_lines(rnd, data, scale["lines"]), 1):
+            amount = qty * rate
+            items.append(
+                [*_base_row(f"{name}-{idx}", timestamp), name, "Sales Invoice", "items", idx, 1, item_code, item_group, qty, rate, amount, amount, amount, amount]
+            )
+
+    _insert("Sales Invoice", [*BASE_FIELDS, "customer", "posting_date", "docstatus"], invoices)
+    _insert(
+        "Sales Invoice Item",
+        [*CHILD_FIELDS, "docstatus", "item_code", "item_group", "qty", "rate", "amount", "base_amount", "net_amount", "base_net_amount"],
+        items,
+    )
+
+
+def _reset_caches():
+    """New data must be visible: bump every version stamp the app caches on."""
+    from promotional_scheme.promotional_scheme.scheme_index import _bump_version, _index_cache
+    from promotional_scheme.promotional_scheme.validity_calendar import _calendar_cache
+
+    frappe.cache().delete_value(ITEM_GROUP_TREE_VERSION_KEY)
+    _bump_version()
+    _index_cache.clear()
+    _calendar_cache.clear()
+
+
+# -------------------------
+# Timings
+# -------------------------
+def _summary(samples_ms):
+    samples = sorted(samples_ms)
+    if not samples:
+        return {}
+    return {
+        "n": len(samples),
+        "min_ms": round(samples[0], 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "max_ms": round(samples[-1], 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+    }
+
+
+def _new_invoice(rnd, data, lines):
+    customer, customer_group, territory = rnd.choice(data.customers)
+    doc = frappe.new_doc("Sales Invoice")
+    doc.customer = customer
+    doc.customer_group = customer_group
+    doc.territory = territory
+    doc.posting_date = nowdate()
+    for item_code, item_group, qty, rate in _invoice_lines(rnd, data, lines):
+        amount = qty * rate
+        doc.append("items", {
+            "item_code": item_code,
+            "item_group": item_group,
+            "qty": qty,
+            "rate": rate,
+            "amount": amount,
+            "base_amount": amount,
+            "net_amount": amount,
+            "base_net_amount": amount,
+        })
+    return doc
+
+
+def time_apply(rnd, scale, data):
+    """apply_promotional_schemes on in-memory invoices; the first (cold index) call is reported apart."""
+    from promotional_scheme.promotional_scheme.doctype.custom_promotional_scheme.custom_promotional_scheme import (
+        apply_promotional_schemes,
+    )
+
+    docs = [_new_invoice(rnd, data, scale["lines"]) for _ in range(max(scale["submits"], 1) + 1)]
+    samples = []
+    for doc in docs:
+        started = perf_counter()
+        apply_promotional_schemes(doc, "on_submit")
+        samples.append((perf_counter() - started) * 1000)
+        frappe.local.message_log = []
+
+    return {"cold_ms": round(samples[0], 3), "warm": _summary(samples[1:])}
+
+
+def report_filter_sets(data):
+    today = getdate(nowdate())
+    return [
+        {},
+        {"party_type": "Customer"},
+        {"from_date": str(add_days(today, -90)), "to_date": str(today)},
+        {"apply_on": "Item Group"},
+        {"apply_on": "Item Code", "item_or_group": "item-00"},
+        {"party_name": data.customers[0][0]},
+        {"min_invoice_amount": 5000},
+        {"show_only_eligible": 1},
+        {"discount_min": 10},
+    ]
+
+
+def time_report(scale, data):
+    from promotional_scheme.promotional_scheme.engine import evaluation_memo_stats
+    from promotional_scheme.promotional_scheme.report.custom_promotional_scheme_report.custom_promotional_scheme_report import (
+        execute,
+        np,
+    )
+
+    # both paths evaluate slabs through the engine memo (columnar: once per distinct totals)
+    slab_path = "rows" if np is None else "columnar"
+    results = []
+    for filters in report_filter_sets(data):
+        samples, rows = [], 0
+        evaluation_memo_stats(reset=True)
+        for _ in range(max(scale["report_runs"], 1)):
+            started = perf_counter()
+            # live: time the computation, not the snapshot read
+            data_rows = execute(frappe._dict(filters, live=1))[1]
+            samples.append((perf_counter() - started) * 1000)
+            rows = len(data_rows)
+        memo = evaluation_memo_stats(reset=True)
+        results.append({
+            "filters": filters,
+            "rows": rows,
+            "slab_path": slab_path,
+            "slab_memo": memo,
+            **_summary(samples),
+        })
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=frappe.get_app_path("promotional_scheme"),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except Exception:
+        return None
+
+
+def run(**scale):
+    """Generate data, time both paths, roll everything back and return the results dict."""
+    scale = {**DEFAULT_SCALE, **{k: v for k, v in scale.items() if v is not None}}
+    rnd = random.Random(scale["seed"])
+    timestamp = now()
+
+    try:
+        started = perf_counter()
+        data = _make_master_data(rnd, scale, timestamp)
+        _make_schemes(rnd, scale, data, timestamp)
+        _make_invoices(rnd, scale, data, timestamp)
+        _reset_caches()
+        setup_ms = (perf_counter() - started) * 1000
+
+        results = {
+            "revision": _git_revision(),
+            "site": frappe.local.site,
+            "timestamp": timestamp,
+            "scale": scale,
+            "setup_ms": round(setup_ms, 3),
+            "apply_promotional_schemes": time_apply(rnd, scale, data),
+            "report": time_report(scale, data),
+        }
+    finally:
+        frappe.db.rollback()
+        _reset_caches()
+
+    return results
+
+
+def run_to_file(output=None, **scale):
+    results = run(**scale)
+    payload = json.dumps(results, indent=2, default=str)
+    if output:
+        with open(output, "w") as f:
+            f.write(payload)
+    return payload
@@ -0,0 +1,107 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Shared cache of compiled schemes (CompiledScheme) across workers.
+
+Every web / background worker used to compile its own copy of each scheme
+from the database. The compiled form (parties, items, slab table) is now kept
+in the site's Redis as plain tuples, keyed by scheme name + modified + item
+group tree version, so a changed scheme or tree simply misses. A cold worker
+gets all schemes it needs with one MGET; only misses are loaded (in bulk)
+and compiled. A small per-process LRU sits in front of Redis.
+"""
+
+import pickle
+from collections import OrderedDict
+
+import frappe
+
+from promotional_scheme.promotional_scheme.item_groups import get_item_group_tree_version
+from promotional_scheme.promotional_scheme.loader import load_schemes
+from promotional_scheme.promotional_scheme.scheme_index import CompiledScheme
+
+COMPILED_KEY_PREFIX = "promotional_scheme:compiled:"
+# old versions are never read again, let Redis drop them
+COMPILED_TTL = 7 * 24 * 60 * 60
+LOCAL_LRU_SIZE = 512
+
+# (site, cache key) -> CompiledScheme, least recently used first
+_local_lru = OrderedDict()
+
+
+def _cache_key(name, modified, tree_version):
+    return f"{COMPILED_KEY_PREFIX}{name}:{modified}:{tree_version}"
+
+
+def _lru_get(key):
+    scheme = _local_lru.get(key)
+    if scheme is not None:
+        _local_lru.move_to_end(key)
+    return scheme
+
+
+def _lru_put(key, scheme):
+    _local_lru[key] = scheme
+    _local_lru.move_to_end(key)
+    while len(_local_lru) > LOCAL_LRU_SIZE:
+        _local_lru.popitem(last=False)
+
+
+def get_compiled_schemes(rows):
+    """
+    CompiledScheme for every row ({name, modified}), in the same order.
+    Per-process LRU first, then one Redis MGET, then a bulk load for what's left.
+    """
+    site = frappe.local.site
+    tree_version = get_item_group_tree_version()
+
+    found = {}
+    missing = []
+    for row in rows:
+        key = _cache_key(row.name, row.modified, tree_version)
+        scheme = _lru_get((site, key))
+        if scheme is None:
+            missing.append((row.name, key))
+        else:
+            found[row.name] = scheme
+
+    if missing:
+        cache = frappe.cache()
+        to_compile = []
+        for (name, key), value in zip(missing, cache.mget([cache.make_key(key) for _, key in missing]), strict=True):
+            try:
+                scheme = CompiledScheme.from_cache(pickle.loads(value)) if value else None
+            except Exception:
+                # written by an older release, recompile
+                scheme = None
+            if scheme is None:
+                to_compile.append(name)
+                continue
+            found[name] = scheme
+            _lru_put((site, key), scheme)
+
+        for scheme_doc in load_schemes(to_compile):
+            try:
+                scheme = CompiledScheme(scheme_doc)
+            except Exception:
+                # skip invalid scheme docs
+                continue
+            # keyed by the modified we just loaded, the row may be older
+            key = _cache_key(scheme.name, scheme.modified, tree_version)
+            cache.set_value(key, scheme.to_cache(), expires_in_sec=COMPILED_TTL)
+            found[scheme.name] = scheme
+            _lru_put((site, key), scheme)
+
+    return [found[row.name] for row in rows if row.name in found]
+
+
+def invalidate_compiled_scheme(name):
+    """
+    Drop every cached version of a scheme (Redis and this process). Other
+    processes' LRUs never see the new modified, so they miss by themselves.
+    """
+    prefix = f"{COMPILED_KEY_PREFIX}{name}:"
+    frappe.cache().delete_keys(prefix)
+    for key in [k for k in _local_lru if k[1].startswith(prefix)]:
+        del _local_lru[key]
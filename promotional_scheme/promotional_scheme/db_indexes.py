@@ -0,0 +1,230 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Composite indexes for the app's hot queries, and an EXPLAIN check of them.
+
+The report aggregates submitted invoices by docstatus + posting_date (+ the
+party), joins the item rows on parent and filters them by item_code, or
+joins Item for item_group; schemes are looked up by party side and validity
+window. None of the standard indexes cover these combinations, so on big
+sites MariaDB scans whole invoice tables. ensure_indexes (after_migrate)
+creates what HOT_INDEXES lists, skipping columns an existing index already
+leads with, and drops indexes this app created earlier that are no longer
+listed (INDEX_PREFIX, which nothing but this app uses). explain_hot_queries runs the report's queries for a
+window under EXPLAIN and flags full scans of large tables
+(`bench --site x promotional-scheme-explain`).
+"""
+
+import re
+from contextlib import contextmanager
+
+import frappe
+from frappe.utils import add_days, getdate, nowdate
+
+INDEX_PREFIX = "promotional_scheme_idx_"
+# earlier releases named them "promo_<columns>", a prefix a custom field's
+# search index can share: only those exact names are taken over
+LEGACY_INDEX_PREFIX = "promo_"
+
+# (doctype, columns): equality columns first, then the range column, then
+# columns the query only reads (so the index covers them)
+HOT_INDEXES = (
+    # report / cube: submitted invoices in a date window, grouped by party
+    ("Sales Invoice", ("docstatus", "posting_date", "customer")),
+    ("Purchase Invoice", ("docstatus", "posting_date", "supplier")),
+    # report filtered to one party (party_name filter, explicit scheme parties)
+    ("Sales Invoice", ("customer", "docstatus", "posting_date")),
+    ("Purchase Invoice", ("supplier", "docstatus", "posting_date")),
+    # item rows of those invoices, filtered by item_code
+    ("Sales Invoice Item", ("parent", "item_code")),
+    ("Purchase Invoice Item", ("parent", "item_code")),
+    # Item Group schemes: i.item_group IN (...) (the primary key rides along)
+    ("Item", ("item_group",)),
+    # members of the customer / supplier groups a scheme lists (party_scope.py)
+    ("Customer", ("customer_group",)),
+    ("Customer", ("territory",)),
+    ("Supplier", ("supplier_group",)),
+    # active schemes of a party side / schemes overlapping the report window
+    ("Custom Promotional Scheme", ("select_the_party", "valid_from", "valid_to")),
+)
+
+# EXPLAIN row estimate from which a full scan is reported
+FULL_SCAN_ROWS = 10000
+
+
+def _index_name(columns, prefix=INDEX_PREFIX):
+    # MariaDB allows 64 characters
+    return (prefix + "_".join(columns))[:64]
+
+
+def _existing_indexes(doctype):
+    """{index name: [columns in order]} of doctype's table."""
+    table = f"tab{doctype}"
+    indexes = {}
+    if frappe.db.db_type == "postgres":
+        for name, definition in frappe.db.sql(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", (table,)
+        ):
+            columns = re.search(r"\((.*)\)", definition)
+            indexes[name] = [c.strip().strip('"') for c in columns.group(1).split(",")] if columns else []
+        return indexes
+
+    for row in frappe.db.sql(f"SHOW INDEX FROM `{table}`", as_dict=True):
+        indexes.setdefault(row.Key_name, []).append((row.Seq_in_index, row.Column_name))
+    return {name: [c for _, c in sorted(columns)] for name, columns in indexes.items()}
+
+
+def _drop_index(doctype, index_name):
+    if frappe.db.db_type == "postgres":
+        frappe.db.sql_ddl(f'DROP INDEX IF EXISTS "{index_name}"')
+    else:
+        frappe.db.sql_ddl(f"ALTER TABLE `tab{doctype}` DROP INDEX `{index_name}`")
+
+
+def ensure_indexes(log=None):
+    """
+    Create the missing HOT_INDEXES, drop obsolete ones of this app.
+    Hooked to after_migrate; safe to run any number of times.
+    """
+    log = log or (lambda msg: None)
+    wanted = {}
+    for doctype, columns in HOT_INDEXES:
+        wanted.setdefault(doctype, []).append(list(columns))
+
+    created, dropped = [], []
+    for doctype, column_sets in wanted.items():
+        if not frappe.db.table_exists(doctype):
+            continue
+        existing = _existing_indexes(doctype)
+        wanted_names = {_index_name(columns) for columns in column_sets}
+        legacy_names = {_index_name(columns, LEGACY_INDEX_PREFIX) for columns in column_sets}
+
+        for name in list(existing):
+            if (name.startswith(INDEX_PREFIX) and name not in wanted_names) or name in legacy_names:
+                # a legacy index is recreated under the new name below
+                del existing[name]
+                _drop_index(doctype, name)
+                dropped.append((doctype, name))
+                log(f"dropped {doctype}.{name}")
+
+        for columns in column_sets:
+            name = _index_name(columns)
+            # any index starting with the same columns serves the same lookups
+            if any(cols[: len(columns)] == columns for cols in existing.values()):
+                continue
+            frappe.db.add_index(doctype, columns, name)
+            created.append((doctype, name))
+            log(f"created {doctype}.{name} ({', '.join(columns)})")
+
+    return {"created": created, "dropped": dropped}
+
+
+# -------------------------
+# EXPLAIN
+# -------------------------
+@contextmanager
+def _recorded_queries():
+    """Record every SELECT frappe.db.sql runs inside the block (they still run)."""
+    queries = []
+    sql = frappe.db.sql
+
+    def recording_sql(query, values=(), *args, **kwargs):
+        if str(query).lstrip().upper().startswith("SELECT"):
+            queries.append((str(query), values))
+        return sql(query, values, *args, **kwargs)
+
+    frappe.db.sql = recording_sql
+    try:
+        yield queries
+    finally:
+        frappe.db.sql = sql
+
+
+def _run_hot_queries(from_date, to_date):
+    """The queries the report generates for the window, one of each shape."""
+    from promotional_scheme.promotional_scheme.engine import PARTY_DIMENSIONS
+    from promotional_scheme.promotional_scheme.loader import load_schemes
+    from promotional_scheme.promotional_scheme.report.custom_promotional_scheme_report import (
+        custom_promotional_scheme_report as report,
+    )
+
+    filters = frappe._dict(from_date=str(from_date), to_date=str(to_date))
+    plan = report._plan_report_filters(filters)
+
+    # the full report, whichever totals path it takes
+    report.execute(filters)
+
+    # per-scheme totals, one scheme per party side and apply_on
+    samples = {}
+    for row in frappe.get_all("Custom Promotional Scheme", fields=["name", "select_the_party", "apply_on"]):
+        samples.setdefault((row.select_the_party, row.apply_on), row.name)
+    for scheme_doc in load_schemes(list(samples.values())):
+        ctx = report._prepare_scheme(scheme_doc, filters, plan)
+        if ctx:
+            report._get_totals_for_scheme(
+                ctx.scheme_doc, ctx.party_side, ctx.parties,
+                item_codes=ctx.item_codes, item_groups=ctx.item_groups,
+                report_from=filters.from_date, report_to=filters.to_date, party_scope=ctx.party_scope,
+            )
+
+    # batched aggregation per party side, with the party master joined for group schemes
+    for party_side in ("Selling", "Buying"):
+        report._get_totals_cube(party_side, from_date, to_date)
+        report._get_totals_cube(
+            party_side, from_date, to_date, group_fields=[field for field, _ in PARTY_DIMENSIONS[party_side][1:]]
+        )
+
+
+def _explain(query, values):
+    """[{table, access, key, rows}] for one query."""
+    if frappe.db.db_type == "postgres":
+        steps = []
+        for (line,) in frappe.db.sql("EXPLAIN " + query, values):
+            scan = re.search(r"(Seq Scan|Index Only Scan|Index Scan|Bitmap Heap Scan) on \"?(\w[\w ]*)\"?", line)
+            if scan:
+                rows = re.search(r"rows=(\d+)", line)
+                steps.append(
+                    {
+                        "table": scan.group(2),
+                        "access": "ALL" if scan.group(1) == "Seq Scan" else scan.group(1),
+                        "key": None,
+                        "rows": int(rows.group(1)) if rows else 0,
+                    }
+                )
+        return steps
+
+    return [
+        {"table": row.table, "access": row.type, "key": row.key, "rows": int(row.rows or 0)}
+        for row in frappe.db.sql("EXPLAIN " + query, values, as_dict=True)
+    ]
+
+
+def explain_hot_queries(from_date=None, to_date=None, min_rows=FULL_SCAN_ROWS):
+    """
+    Run the report's queries for [from_date, to_date] (default: the last 90
+    days) and EXPLAIN each distinct one. Returns one entry per query with its
+    plan; full_scans lists the steps that read a whole table of at least
+    min_rows (estimated) rows.
+    """
+    to_date = getdate(to_date or nowdate())
+    from_date = getdate(from_date or add_days(to_date, -90))
+
+    with _recorded_queries() as queries:
+        _run_hot_queries(from_date, to_date)
+
+    results, seen = [], set()
+    for query, values in queries:
+        key = " ".join(query.split())
+        if key in seen:
+            continue
+        seen.add(key)
+        plan = _explain(query, values)
+        results.append(
+            {
+                "query": key,
+                "plan": plan,
+                "full_scans": [step for step in plan if step["access"] == "ALL" and step["rows"] >= min_rows],
+            }
+        )
+    return results
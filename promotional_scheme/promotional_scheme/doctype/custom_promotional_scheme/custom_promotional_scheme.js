@@ -116,16 +116,13 @@ function render_eligible_schemes(frm) {
 
     container.html("<div class='text-muted small'>Searching...</div>");
 
+    // answered from the cached validity calendar, no query per change
     frappe.call({
-        method: "frappe.client.get_list",
+        method: "promotional_scheme.promotional_scheme.api.get_overlapping_schemes",
         args: {
-            doctype: "Custom Promotional Scheme",
-            fields: ["name", "scheme_name", "valid_from", "valid_to"],
-            filters: [
-                ["valid_from", "<=", frm.doc.valid_to],
-                ["valid_to", ">=", frm.doc.valid_from]
-            ],
-            limit_page_length: 50
+            valid_from: frm.doc.valid_from,
+            valid_to: frm.doc.valid_to,
+            limit: 50
         },
         callback(r) {
             if (!r.message || r.message.length === 0) {
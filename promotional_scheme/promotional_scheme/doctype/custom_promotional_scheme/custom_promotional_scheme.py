@@ -3,7 +3,42 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import nowdate, flt, getdate
+from frappe.utils import flt, getdate, nowdate
+
+from promotional_scheme.promotional_scheme.accruals import (
+    delete_scheme_accruals,
+    enqueue_accrual_rebuild,
+    rename_scheme_accruals,
+)
+from promotional_scheme.promotional_scheme.compiled_cache import invalidate_compiled_scheme
+from promotional_scheme.promotional_scheme.doctype.promotional_scheme_settings.promotional_scheme_settings import (
+    get_stacking_policy,
+)
+from promotional_scheme.promotional_scheme.engine import (
+    AMOUNT_OFF,
+    DISCOUNT_PERCENTAGE,
+    PARTY_DIMENSIONS,
+    AdjustmentPlan,
+    Invoice,
+    InvoiceLine,
+    evaluate_candidates,
+    party_matches,
+)
+from promotional_scheme.promotional_scheme.extraction import (
+    extract_item_codes,
+    extract_item_groups,
+    extract_party_values,
+)
+from promotional_scheme.promotional_scheme.item_groups import expand_item_groups
+from promotional_scheme.promotional_scheme.policy import resolve
+from promotional_scheme.promotional_scheme.reevaluation import delete_scheme_proposals, enqueue_reevaluation
+from promotional_scheme.promotional_scheme.scheme_index import (
+    CompiledScheme,
+    get_active_scheme_index,
+    invalidate_scheme_index,
+)
+from promotional_scheme.promotional_scheme.tracing import start_trace
+from promotional_scheme.promotional_scheme.validity_calendar import CALENDAR_FIELDS, get_active_schemes
 
 
 class CustomPromotionalScheme(Document):
@@ -12,6 +47,27 @@ class CustomPromotionalScheme(Document):
         self.validate_condition_fields()
         self.validate_apply_on_exclusivity()
 
+    def on_update(self):
+        invalidate_compiled_scheme(self.name)
+        invalidate_scheme_index()
+        enqueue_accrual_rebuild(self.name, self.modified)
+        # edits that change no rule (name, labels) leave every invoice's outcome as it was
+        scheme = CompiledScheme(self)
+        before = self.get_doc_before_save()
+        if before is None or CompiledScheme(before).rules_stamp != scheme.rules_stamp:
+            enqueue_reevaluation(scheme)
+
+    def on_trash(self):
+        invalidate_compiled_scheme(self.name)
+        invalidate_scheme_index()
+        delete_scheme_accruals(self.name)
+        delete_scheme_proposals(self.name)
+
+    def after_rename(self, old_name, new_name, merge=False):
+        invalidate_compiled_scheme(old_name)
+        invalidate_scheme_index()
+        rename_scheme_accruals(old_name, new_name)
+
     def validate_apply_on_exclusivity(self):
         if self.apply_on == "Item Code" and self.promotional_scheme_on_item_group:
             frappe.throw("You selected 'Item Code' but added rows in 'Promotional scheme on item group'. Please clear them.")
@@ -58,111 +114,57 @@ class CustomPromotionalScheme(Document):
 
 
     @staticmethod
-    def get_active_schemes_for_party(party_type):
-        """Return list of active scheme names for party_type (Selling/Buying)."""
-        today = getdate(nowdate())
-        return frappe.get_all(
-            "Custom Promotional Scheme",
-            filters={
-                "select_the_party": party_type,
-                "valid_from": ["<=", today],
-                "valid_to": [">=", today]
-            },
-            pluck="name"
-        )
+    def get_active_schemes_for_party(party_type, on_date=None, fields=None):
+        """
+        Return list of active scheme names for party_type (Selling/Buying) on on_date (default today).
+        With fields, return those fields per scheme instead of plain names.
+        Answered from the validity calendar (validity_calendar.py); only fields
+        the calendar doesn't hold are read from the database.
+        """
+        rows = get_active_schemes(party_type, getdate(on_date or nowdate()))
+        if not fields:
+            return [row.name for row in rows]
+        if set(fields) <= set(CALENDAR_FIELDS):
+            return [frappe._dict({f: row.get(f) for f in fields}) for row in rows]
+        if not rows:
+            return []
+        names = [row.name for row in rows]
+        found = {
+            row.name: row
+            for row in frappe.get_all(
+                "Custom Promotional Scheme",
+                filters={"name": ["in", names]},
+                fields=list(dict.fromkeys(["name", *fields])),
+            )
+        }
+        return [found[name] for name in names if name in found]
 
 
 # -------------------------
 # Utility helpers
 # -------------------------
-def _extract_values_from_child_rows(doc, fieldname, possible_keys=None):
+def _extract_item_codes_from_scheme(scheme_doc):
     """
-    Generic extractor for child table fields / multiselect child rows.
-    - doc: frappe.get_doc(...) for the scheme
-    - fieldname: the child table fieldname on scheme doc (e.g. 'customer', 'customer_group', 'promotional_scheme_on_item_code')
-    - possible_keys: list of keys to attempt per row (e.g. ['customer', 'item', 'item_code'])
-    Returns a set of string values (empty set if none).
+    Item codes explicitly listed on the scheme (promotional_scheme_on_item_code).
+    Item groups are not expanded into items any more, see _extract_item_groups_from_scheme.
     """
-    vals = set()
-    possible_keys = possible_keys or []
-    rows = doc.get(fieldname) or []
-    # If it's a plain list of strings (some multiselect styles), handle that:
-    if isinstance(rows, list) and rows and isinstance(rows[0], str):
-        for v in rows:
-            vals.add(str(v))
-        return vals
-
-    # Otherwise expect rows are dict-like child rows
-    for row in rows:
-        # row might be a Document or dict
-        row_dict = row.as_dict() if hasattr(row, "as_dict") else dict(row)
-        # try the provided keys
-        for k in possible_keys:
-            if k in row_dict and row_dict.get(k):
-                vals.add(str(row_dict.get(k)))
-                break
-        # fallback: if only one field present (like Table MultiSelect using 'item'), pick it
-        else:
-            # take first textual field that looks useful
-            for k2, v2 in row_dict.items():
-                if k2 in ("idx", "name", "parent", "parentfield", "parenttype", "doctype"):
-                    continue
-                if v2:
-                    vals.add(str(v2))
-                    break
-    return vals
+    return extract_item_codes(scheme_doc)
 
 
-def _extract_item_codes_from_scheme(scheme_doc):
+def _extract_item_groups_from_scheme(scheme_doc):
     """
-    Extract item codes that scheme applies on.
-    It will inspect expected fields on scheme doc:
-      - promotional_scheme_on_item_code (child rows) -> look for 'item_code' or 'item'
-      - promotional_scheme_on_item_group (child rows) -> look for 'item_group' or 'group'
-    Returns a set of item codes (strings). If item_group rows found, expands to actual Items by querying Item doctype.
+    Item groups the scheme applies on (promotional_scheme_on_item_group), including
+    all nested groups (lft/rgt), so an invoice line matches when its item_group is in the set.
     """
-    item_codes = set()
-
-    # item_code child rows (likely child doctype like Pricing Rule Item Code)
-    item_code_vals = _extract_values_from_child_rows(
-        scheme_doc,
-        "promotional_scheme_on_item_code",
-        possible_keys=["item_code", "item"]
-    )
-    item_codes.update(item_code_vals)
-
-    # item groups -> find items with those groups
-    item_group_vals = _extract_values_from_child_rows(
-        scheme_doc,
-        "promotional_scheme_on_item_group",
-        possible_keys=["item_group", "group"]
-    )
-    if item_group_vals:
-        # Query Item by item_group
-        items = frappe.get_all("Item", filters={"item_group": ["in", list(item_group_vals)]}, pluck="name")
-        item_codes.update(items or [])
-
-    return item_codes
+    return set(expand_item_groups(extract_item_groups(scheme_doc)))
 
 
 def _extract_party_values_from_scheme(scheme_doc):
     """
-    Extract party lists from scheme_doc in a robust way.
+    Party lists of the scheme.
     Returns dict with keys: customers, customer_groups, territories, suppliers, supplier_groups (each is a set).
     """
-    customers = _extract_values_from_child_rows(scheme_doc, "customer", possible_keys=["customer", "item", "value"])
-    customer_groups = _extract_values_from_child_rows(scheme_doc, "customer_group", possible_keys=["customer_group", "item", "value", "group"])
-    territories = _extract_values_from_child_rows(scheme_doc, "territory", possible_keys=["territory", "item", "value"])
-    suppliers = _extract_values_from_child_rows(scheme_doc, "supplier", possible_keys=["supplier", "item", "value"])
-    supplier_groups = _extract_values_from_child_rows(scheme_doc, "supplier_group", possible_keys=["supplier_group", "item", "value", "group"])
-
-    return {
-        "customers": customers,
-        "customer_groups": customer_groups,
-        "territories": territories,
-        "suppliers": suppliers,
-        "supplier_groups": supplier_groups,
-    }
+    return extract_party_values(scheme_doc)
 
 
 # -------------------------
@@ -172,212 +174,117 @@ def apply_promotional_schemes(doc, method):
     """
     Hook to be called on_submit of Sales Invoice and Purchase Invoice.
     Checks all active schemes and applies matching ones (party + item).
+    Sampled invoices log an evaluation trace, see tracing.py.
     """
     if doc.doctype not in ("Sales Invoice", "Purchase Invoice"):
         return
 
+    trace = start_trace(doc)
+    try:
+        _apply_promotional_schemes(doc, trace)
+    finally:
+        trace.finish()
+
+
+def _apply_promotional_schemes(doc, trace):
     party_side = "Selling" if doc.doctype == "Sales Invoice" else "Buying"
-    active_scheme_names = CustomPromotionalScheme.get_active_schemes_for_party(party_side)
-    if not active_scheme_names:
+    # schemes valid on the posting date (back-dated invoices too), compiled
+    # once per site / party side / validity segment, see scheme_index.py
+    with trace.phase("scheme_fetch"):
+        scheme_index = get_active_scheme_index(party_side, getattr(doc, "posting_date", None))
+    if not scheme_index.schemes:
         return
 
-    # For each scheme, load full doc and evaluate
-    for scheme_name in active_scheme_names:
-        try:
-            scheme_doc = frappe.get_doc("Custom Promotional Scheme", scheme_name)
-        except Exception:
-            # skip invalid scheme docs
-            continue
-
-        # 1) Party match: if scheme has any party selectors, invoice must match at least one
-        parties = _extract_party_values_from_scheme(scheme_doc)
-        if not _invoice_party_matches(doc, parties):
-            # scheme isn't meant for this invoice party
-            continue
-
-        # 2) Item match: determine item codes the scheme concerns
-        item_codes = _extract_item_codes_from_scheme(scheme_doc)
-        # If scheme has no items specified (empty), interpret as "all items" (apply to any items)
-        if item_codes:
-            matching_items = [it for it in doc.items if getattr(it, "item_code", None) in item_codes]
-        else:
-            # no item restrictions -> all invoice items considered
-            matching_items = list(doc.items)
-
-        if not matching_items:
-            # no items from invoice match scheme
-            continue
-
-        # 3) Apply validation logic (amount or quantity)
-        if scheme_doc.type_of_promo_validation == "Based on Minimum Amount":
-            total_without_gst = flt(
-                sum(getattr(it, "base_net_amount", 0) or 0 for it in matching_items)
+    invoice = _invoice_from_doc(doc, party_side)
+
+    # 1) + 2) Party and item match through the inverted index: only schemes whose
+    # party restrictions accept this invoice and which cover at least one line
+    matches = scheme_index.match_invoice(invoice.parties, invoice.lines, trace=trace)
+
+    # 3) Slabs -> adjustments (engine.py, no document access)
+    evaluated = evaluate_candidates(matches, trace=trace)
+
+    # 4) Exclusive schemes / priority / best for customer (policy.py), free
+    # quantities are left out: only discounts and amounts off are applied
+    adjustments = resolve(invoice, evaluated, *get_stacking_policy())
+
+    with trace.phase("mutation"):
+        apply_adjustments_to_invoice(doc, adjustments)
+
+
+def _invoice_from_doc(doc, party_side):
+    """engine.Invoice for an invoice document; lines keep their position in doc.items."""
+    return Invoice(
+        party_side=party_side,
+        parties={f: getattr(doc, f, None) for f, _ in PARTY_DIMENSIONS.get(party_side, ())},
+        lines=[
+            InvoiceLine(
+                idx=i,
+                item_code=getattr(it, "item_code", None),
+                # left empty when the row has none, the index looks it up only if needed
+                item_group=getattr(it, "item_group", None),
+                qty=flt(getattr(it, "qty", 0)),
+                rate=flt(getattr(it, "rate", 0)),
+                base_net_amount=flt(getattr(it, "base_net_amount", 0)),
             )
-
-            applicable_slabs = [
-                row for row in scheme_doc.amount_discount_slabs
-                if flt(row.minimum_amount) <= total_without_gst
-            ]
-
-            if not applicable_slabs:
-                continue
-
-            # Pick best slab (highest minimum_amount)
-            slab = max(applicable_slabs, key=lambda r: flt(r.minimum_amount))
-            discount_pct = flt(slab.discount_percentage or 0)
-
-            if discount_pct > 0:
-                apply_discount_to_invoice(
-                    doc,
-                    matching_items,
-                    discount_pct,
-                    scheme_doc.name
-                )
-
-        elif scheme_doc.type_of_promo_validation == "Based on Minimum Quantity":
-            total_qty = flt(sum((it.qty or 0) for it in matching_items))
-
-            for slab in scheme_doc.quantity_discount_slabs:
-                if total_qty >= flt(slab.minimum_quantity or 0):
-                    free_qty = flt(slab.free_quantity or 0)
-
-                    # CASE 1: free specific product
-                    # if slab.free_product:
-                    #     add_free_items_to_invoice(
-                    #         doc, matching_items, free_qty, scheme_doc.name,
-                    #         free_product=slab.free_product, per_item=False
-                    #     )
-
-                    # CASE 2: same product free
-                    # else:
-                    #     add_free_items_to_invoice(
-                    #         doc, matching_items, free_qty, scheme_doc.name,
-                    #         free_product=None, per_item=True
-                    #     )
-
-        elif scheme_doc.type_of_promo_validation == "Based on Minimum Quantity & Amount":
-            total_qty = flt(sum((it.qty or 0) for it in matching_items))
-            total_without_gst = flt(sum((it.base_net_amount or 0) for it in matching_items))
-
-            for row in scheme_doc.free_qty_with_amount_off:
-                min_qty = flt(row.min_qty or 0)
-                free_qty = flt(row.free_qty or 0)
-                amount_off = flt(row.amount_off or 0)
-
-                if total_qty >= min_qty and amount_off > 0:
-                    # Apply amount discount across matched items (same ratio)
-                    discount_per_item = amount_off / len(matching_items)
-
-                    for it in matching_items:
-                        it.rate = flt((it.rate or 0) - discount_per_item)
-                        it.amount = it.qty * it.rate
-                        it.base_amount = it.amount
-                        try:
-                            it.promotional_scheme_applied = scheme_doc.name
-                        except:
-                            pass
-
-                    # Optionally add free qty also
-                    # if free_qty > 0:
-                    #     add_free_items_to_invoice(
-                    #         doc, matching_items, free_qty, scheme_doc.name,
-                    #         free_product=None, per_item=True
-                    #     )
-
-                    frappe.msgprint(f"Promotional Scheme '{scheme_doc.name}' applied: Amount Off {amount_off}.")
-
+            for i, it in enumerate(doc.items)
+        ],
+    )
 
 
-# -------------------------
-# Helpers used above
-# -------------------------
-def _invoice_party_matches(doc, parties_dict):
+def apply_adjustments_to_invoice(doc, adjustments):
     """
-    Given invoice `doc` and `parties_dict` returned by _extract_party_values_from_scheme,
-    determine if invoice party matches scheme criteria.
-    If the scheme defines no parties at all (all sets empty), treat as match (applies to all).
-    """
-    # if scheme contains no party limitations -> treat as global (match)
-    has_any_party_limit = any(len(v) > 0 for v in parties_dict.values())
-    if not has_any_party_limit:
-        return True
-
-    # Sales Invoice checks
-    if doc.doctype == "Sales Invoice":
-        # If customers set defined and invoice.customer not in it -> fail
-        if parties_dict["customers"] and (not getattr(doc, "customer", None) or str(doc.customer) not in parties_dict["customers"]):
-            return False
-        if parties_dict["customer_groups"] and (not getattr(doc, "customer_group", None) or str(doc.customer_group) not in parties_dict["customer_groups"]):
-            return False
-        if parties_dict["territories"] and (not getattr(doc, "territory", None) or str(doc.territory) not in parties_dict["territories"]):
-            return False
-
-    # Purchase Invoice checks
-    if doc.doctype == "Purchase Invoice":
-        if parties_dict["suppliers"] and (not getattr(doc, "supplier", None) or str(doc.supplier) not in parties_dict["suppliers"]):
-            return False
-        if parties_dict["supplier_groups"] and (not getattr(doc, "supplier_group", None) or str(doc.supplier_group) not in parties_dict["supplier_groups"]):
-            return False
-
-    return True
-
-
-def apply_discount_to_invoice(doc, matching_items, discount_pct, scheme_name):
+    Two phases: fold every scheme's adjustments per line into one plan
+    (engine.AdjustmentPlan, percent discounts then amounts off, independent of
+    scheme order), then write each changed line (rate, amounts) once.
     """
-    Apply discount_pct to matching_items by reducing item.rate and marking item row.
-    Note: calling code runs during on_submit; changes will be saved in the same document.
-    """
-    for it in matching_items:
-        original_rate = flt(getattr(it, "rate", 0))
-        discount_value = original_rate * (discount_pct / 100.0)
-        it.rate = flt(original_rate - discount_value)
+    if not adjustments:
+        return
+
+    plan = AdjustmentPlan.from_adjustments(len(doc.items), adjustments)
+    changed = plan.lines()
+    for i in changed:
+        it = doc.items[i]
+        it.rate = flt(plan.rate(i, it.rate))
         # set discount fields if available
         try:
-            it.discount_percentage = discount_pct
-        except Exception:
-            pass
-        try:
-            it.promotional_scheme_applied = scheme_name
+            if plan.factor[i] != 1.0:
+                it.discount_percentage = flt(plan.discount_percentage(i))
+            it.promotional_scheme_applied = plan.schemes[i]
         except Exception:
             pass
 
-    frappe.msgprint(f"✅ Promotional Scheme '{scheme_name}' applied: {discount_pct}% discount.")
+    _update_line_amounts(doc, changed)
 
+    for adj in adjustments:
+        if adj.kind == DISCOUNT_PERCENTAGE:
+            frappe.msgprint(f"✅ Promotional Scheme '{adj.scheme}' applied: {adj.value}% discount.")
+        elif adj.kind == AMOUNT_OFF:
+            frappe.msgprint(f"Promotional Scheme '{adj.scheme}' applied: Amount Off {adj.value}.")
 
-def add_free_items_to_invoice(doc, matching_items, free_qty, scheme_name, free_product=None, per_item=True):
+
+def _update_line_amounts(doc, changed):
     """
-    Add free items to invoice.
-    - If free_product is given & per_item=False → one free row for that item.
-    - If per_item=True → free_qty for each matched item.
+    Amounts of the changed lines. Invoice totals are left alone: the hook runs
+    on_submit, after the invoice and its GL entries were saved, so recomputed
+    totals would never be stored, only sent back to the client.
     """
+    for i in changed:
+        it = doc.items[i]
+        it.amount = flt(it.qty) * it.rate
+        it.base_amount = it.amount
 
-    # CASE 1: Free product (single line)
-    if free_product and not per_item:
-        doc.append("items", {
-            "item_code": free_product,
-            "qty": free_qty,
-            "rate": 0,
-            "amount": 0,
-            "base_rate": 0,
-            "base_amount": 0,
-            "is_free_item": 1,
-            "promotional_scheme_applied": scheme_name
-        })
-        frappe.msgprint(f"Free Product '{free_product}' Qty {free_qty} added for scheme '{scheme_name}'.")
-        return
 
-    # CASE 2: Free qty for each matching item
-    for it in matching_items:
-        doc.append("items", {
-            "item_code": it.item_code,
-            "item_name": it.item_name,
-            "qty": free_qty,
-            "rate": 0,
-            "amount": 0,
-            "base_rate": 0,
-            "base_amount": 0,
-            "is_free_item": 1,
-            "promotional_scheme_applied": scheme_name
-        })
-
-    frappe.msgprint(f"Free Quantity ({free_qty}) added for scheme '{scheme_name}'.")
+
+# -------------------------
+# Helpers used above
+# -------------------------
+def _invoice_party_matches(doc, parties_dict):
+    """
+    Given invoice `doc` and `parties_dict` returned by _extract_party_values_from_scheme,
+    determine if invoice party matches scheme criteria.
+    If the scheme defines no parties at all (all sets empty), treat as match (applies to all).
+    """
+    party_side = {"Sales Invoice": "Selling", "Purchase Invoice": "Buying"}.get(doc.doctype)
+    parties = {f: getattr(doc, f, None) for f, _ in PARTY_DIMENSIONS.get(party_side, ())}
+    return party_matches(frappe._dict(parties=parties_dict), party_side, parties)
@@ -1,9 +1,255 @@
 # Copyright (c) 2025, aits and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from promotional_scheme.promotional_scheme.engine import (
+	AMOUNT_OFF,
+	DISCOUNT_PERCENTAGE,
+	Adjustment,
+	AdjustmentPlan,
+	Invoice,
+	InvoiceLine,
+	apply_adjustments,
+	evaluate_invoice,
+	evaluate_totals,
+	evaluation_memo_stats,
+)
+from promotional_scheme.promotional_scheme.extraction import extract_child_values, extract_party_values
+from promotional_scheme.promotional_scheme.parallel_report import _chunks
+from promotional_scheme.promotional_scheme.party_scope import PartyScope
+from promotional_scheme.promotional_scheme.policy import BEST_FOR_CUSTOMER, resolve
+from promotional_scheme.promotional_scheme.slabs import SchemeSlabs
+from promotional_scheme.promotional_scheme.validity_calendar import ValidityCalendar
+
+
+def _scheme(validation_type, **tables):
+	return frappe._dict(type_of_promo_validation=validation_type, **tables)
+
+
+def _engine_scheme(name, slabs, item_codes=(), customers=()):
+	# same attributes as scheme_index.CompiledScheme
+	return frappe._dict(
+		name=name,
+		validation_type=slabs.validation_type,
+		parties={"customers": frozenset(customers)},
+		item_codes=frozenset(item_codes),
+		item_groups=frozenset(),
+		slabs=slabs,
+	)
+
 
 class TestCustomPromotionalScheme(FrappeTestCase):
-	pass
+	def test_amount_slab_picks_highest_reached_threshold(self):
+		slabs = SchemeSlabs.from_doc(
+			_scheme(
+				"Based on Minimum Amount",
+				amount_discount_slabs=[
+					frappe._dict(minimum_amount=5000, discount_percentage=10),
+					frappe._dict(minimum_amount=1000, discount_percentage=5),
+					frappe._dict(minimum_amount=10000, discount_percentage=15),
+				],
+			)
+		)
+
+		self.assertIsNone(slabs.applicable(0, 999))
+		self.assertEqual(slabs.applicable(0, 1000), (1000, 5))
+		self.assertEqual(slabs.applicable(0, 9999), (5000, 10))
+		self.assertEqual(slabs.applicable(0, 50000), (10000, 15))
+
+	def test_report_selection_falls_back_to_first_row(self):
+		slabs = SchemeSlabs.from_doc(
+			_scheme(
+				"Based on Minimum Quantity",
+				quantity_discount_slabs=[
+					frappe._dict(minimum_quantity=10, free_quantity=1, free_product=None),
+					frappe._dict(minimum_quantity=20, free_quantity=3, free_product="FREE-ITEM"),
+				],
+			)
+		)
+
+		self.assertEqual(slabs.select(5, 0)["minimum_quantity"], 10)
+		self.assertEqual(slabs.select(25, 0)["free_product"], "FREE-ITEM")
+
+	def test_quantity_and_amount_slab_needs_both_bounds(self):
+		slabs = SchemeSlabs.from_doc(
+			_scheme(
+				"Based on Minimum Quantity & Amount",
+				free_qty_with_amount_off=[
+					frappe._dict(min_qty=5, free_qty=0, amount_off=100),
+					frappe._dict(min_qty=10, free_qty=1, amount_off=1000),
+				],
+			)
+		)
+
+		# qty reaches the 10 slab but the amount only covers the first one
+		self.assertEqual(slabs.applicable(12, 500), (5, 0, 100))
+		self.assertEqual(slabs.applicable(12, 1000), (10, 1, 1000))
+		self.assertIsNone(slabs.applicable(12, 50))
+		self.assertEqual(slabs.table.upto(12), ((5, 0, 100), (10, 1, 1000)))
+
+	def test_child_values_read_the_link_field_only(self):
+		scheme = frappe._dict(
+			customer=[
+				frappe._dict(doctype="Customer Item", customer="CUST-1", owner="Administrator"),
+				frappe._dict(doctype="Customer Item", customer=None, owner="Administrator"),
+			],
+			territory=["North", ""],
+		)
+
+		parties = extract_party_values(scheme)
+		self.assertEqual(parties["customers"], {"CUST-1"})
+		self.assertEqual(parties["territories"], {"North"})
+		self.assertEqual(parties["suppliers"], set())
+		# rows without a doctype are probed key by key
+		self.assertEqual(
+			extract_child_values(frappe._dict(rows=[{"item": "X"}]), "rows", ("item_code", "item")), {"X"}
+		)
+
+	def test_slabs_survive_the_shared_cache_form(self):
+		slabs = SchemeSlabs.from_doc(
+			_scheme(
+				"Based on Minimum Quantity & Amount",
+				free_qty_with_amount_off=[
+					frappe._dict(min_qty=10, free_qty=1, amount_off=1000),
+					frappe._dict(min_qty=5, free_qty=0, amount_off=100),
+				],
+			)
+		)
+		cached = SchemeSlabs.from_cache(slabs.to_cache())
+
+		self.assertEqual(cached.applicable(12, 500), slabs.applicable(12, 500))
+		self.assertEqual(cached.select(1, 0), slabs.select(1, 0))
+		self.assertEqual(cached.table.upto(12), slabs.table.upto(12))
+
+	def test_engine_returns_adjustments_for_matching_lines(self):
+		amount_scheme = _engine_scheme(
+			"AMOUNT",
+			SchemeSlabs.from_doc(
+				_scheme(
+					"Based on Minimum Amount",
+					amount_discount_slabs=[frappe._dict(minimum_amount=1000, discount_percentage=10)],
+				)
+			),
+			item_codes=("A",),
+		)
+		amount_off_scheme = _engine_scheme(
+			"AMOUNT-OFF",
+			SchemeSlabs.from_doc(
+				_scheme(
+					"Based on Minimum Quantity & Amount",
+					free_qty_with_amount_off=[frappe._dict(min_qty=5, free_qty=0, amount_off=100)],
+				)
+			),
+			customers=("CUST-2",),
+		)
+		invoice = Invoice(
+			party_side="Selling",
+			parties={"customer": "CUST-1"},
+			lines=[
+				InvoiceLine(idx=0, item_code="A", qty=10, rate=100, base_net_amount=1000),
+				InvoiceLine(idx=1, item_code="B", qty=10, rate=50, base_net_amount=500),
+			],
+		)
+
+		adjustments = evaluate_invoice(invoice, [amount_scheme, amount_off_scheme])
+		# CUST-1 is not on the second scheme
+		self.assertEqual([(a.scheme, a.kind, a.lines, a.value) for a in adjustments], [("AMOUNT", DISCOUNT_PERCENTAGE, (0,), 10)])
+
+		invoice.parties["customer"] = "CUST-2"
+		adjustments = evaluate_invoice(invoice, [amount_scheme, amount_off_scheme])
+		self.assertEqual([a.kind for a in adjustments], [DISCOUNT_PERCENTAGE, AMOUNT_OFF])
+
+		apply_adjustments(invoice, adjustments)
+		self.assertEqual([line.rate for line in invoice.lines], [40, 0])
+
+	def test_adjustment_plan_does_not_depend_on_scheme_order(self):
+		adjustments = [
+			Adjustment("OFF", AMOUNT_OFF, (0, 1), (5, 0, 20), 20),
+			Adjustment("PCT", DISCOUNT_PERCENTAGE, (0,), (1000, 10), 10),
+		]
+		plan = AdjustmentPlan.from_adjustments(2, adjustments)
+		reversed_plan = AdjustmentPlan.from_adjustments(2, adjustments[::-1])
+
+		# percent discounts first, then the amount off: 100 x 0.9 - 10
+		self.assertAlmostEqual(plan.rate(0, 100), 80)
+		self.assertAlmostEqual(reversed_plan.rate(0, 100), 80)
+		self.assertAlmostEqual(plan.discount_percentage(0), 10)
+		self.assertEqual(plan.lines(), [0, 1])
+
+	def test_exclusive_scheme_does_not_stack(self):
+		invoice = Invoice(party_side="Selling", lines=[InvoiceLine(idx=0, item_code="A", qty=1, rate=100)])
+		small = frappe._dict(name="SMALL", priority=1, is_exclusive=1)
+		big = frappe._dict(name="BIG", priority=0, is_exclusive=0)
+		evaluated = [
+			(small, [Adjustment("SMALL", DISCOUNT_PERCENTAGE, (0,), (), 5)]),
+			(big, [Adjustment("BIG", DISCOUNT_PERCENTAGE, (0,), (), 20)]),
+		]
+
+		# priority: the exclusive scheme comes first and blocks the other one
+		self.assertEqual([a.scheme for a in resolve(invoice, evaluated)], ["SMALL"])
+		# best for customer: 20% beats 5%
+		self.assertEqual([a.scheme for a in resolve(invoice, evaluated, BEST_FOR_CUSTOMER)], ["BIG"])
+
+		big.is_exclusive = small.is_exclusive = 0
+		self.assertEqual([a.scheme for a in resolve(invoice, evaluated)], ["SMALL", "BIG"])
+
+	def test_validity_calendar_answers_by_date(self):
+		calendar = ValidityCalendar(
+			[
+				frappe._dict(name="JAN", select_the_party="Selling", valid_from="2025-01-01", valid_to="2025-01-31"),
+				frappe._dict(name="Q1", select_the_party="Selling", valid_from="2025-01-15", valid_to="2025-03-31"),
+				frappe._dict(name="BUY", select_the_party="Buying", valid_from="2025-01-01", valid_to="2025-12-31"),
+				frappe._dict(name="UNDATED", select_the_party="Selling", valid_from="2025-01-01", valid_to=None),
+			]
+		)
+
+		def names(rows):
+			return [row.name for row in rows]
+
+		# a back-dated invoice gets the schemes of its own date
+		self.assertEqual(names(calendar.active_on("Selling", "2025-01-10")), ["JAN"])
+		self.assertEqual(names(calendar.active_on("Selling", "2025-01-31")), ["JAN", "Q1"])
+		self.assertEqual(names(calendar.active_on("Selling", "2025-02-01")), ["Q1"])
+		self.assertEqual(names(calendar.active_on("Selling", "2024-12-31")), [])
+		self.assertEqual(calendar.segment("Selling", "2025-02-01"), calendar.segment("Selling", "2025-03-31"))
+		self.assertNotEqual(calendar.segment("Selling", "2025-03-31"), calendar.segment("Selling", "2025-04-01"))
+
+		self.assertEqual(names(calendar.overlapping("2025-03-01", "2025-04-30")), ["Q1", "BUY"])
+		self.assertEqual(names(calendar.overlapping("2024-12-01", "2025-01-01", "Selling")), ["JAN"])
+
+	def test_parallel_chunks_keep_scheme_order(self):
+		names = [f"SCH{n}" for n in range(10)]
+		for count in (1, 3, 4, 20):
+			chunks = _chunks(names, count)
+			self.assertLessEqual(len(chunks), count)
+			self.assertTrue(all(chunks))
+			# rows are merged chunk by chunk, so the chunks must concatenate back
+			self.assertEqual([name for chunk in chunks for name in chunk], names)
+		self.assertEqual(_chunks([], 4), [])
+
+	def test_party_scope_joins_groups_instead_of_listing_members(self):
+		scope = PartyScope("Selling", ["C1"], {"territory": {"North"}, "customer_group": set()})
+		join, condition, params = scope.sql("si.customer")
+
+		self.assertIn("`tabCustomer` party_master ON party_master.name = si.customer", join)
+		self.assertEqual(condition, "(si.customer IN (%s) OR party_master.territory IN (%s))")
+		self.assertEqual(params, ["C1", "North"])
+		# no restriction, no join
+		self.assertEqual(PartyScope("Buying").sql("si.supplier"), ("", "", []))
+
+	def test_report_evaluation_is_memoized_per_totals(self):
+		slabs = SchemeSlabs.from_doc(
+			_scheme(
+				"Based on Minimum Amount",
+				amount_discount_slabs=[frappe._dict(minimum_amount=100, discount_percentage=5)],
+			)
+		)
+		evaluation_memo_stats(reset=True)
+
+		first = evaluate_totals(slabs, 0.0, 0.0)
+		self.assertIs(evaluate_totals(slabs, 0.0, 0.0), first)
+		self.assertEqual(evaluate_totals(slabs, 1.0, 150.0)[1], True)
+		self.assertEqual(first[1], False)
+		self.assertEqual(evaluation_memo_stats(), {"hits": 1, "misses": 2, "hit_rate": 0.3333})
@@ -0,0 +1,18 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class PromotionalSchemeAccrual(Document):
+	pass
+
+
+def on_doctype_update():
+	# one row per key, so submit / cancel can upsert (see accruals.py)
+	frappe.db.add_unique(
+		"Promotional Scheme Accrual",
+		["scheme", "party", "item_or_group", "posting_date"],
+		constraint_name="unique_scheme_party_item_date",
+	)
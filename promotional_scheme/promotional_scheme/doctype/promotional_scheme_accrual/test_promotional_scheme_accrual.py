@@ -0,0 +1,48 @@
+# Copyright (c) 2026, aits and Contributors
+# See license.txt
+
+from types import SimpleNamespace
+
+from frappe.tests.utils import FrappeTestCase
+
+from promotional_scheme.promotional_scheme.accruals import AccrualIndex, _accrual_key
+from promotional_scheme.promotional_scheme.party_scope import PartyScope
+
+
+def _scheme(apply_on, item_codes=(), item_groups=()):
+	return SimpleNamespace(apply_on=apply_on, item_codes=frozenset(item_codes), item_groups=frozenset(item_groups))
+
+
+class TestPromotionalSchemeAccrual(FrappeTestCase):
+	def test_item_code_scheme_accrues_listed_codes(self):
+		scheme = _scheme("Item Code", item_codes=["ITEM-1"])
+		self.assertEqual(_accrual_key(scheme, "ITEM-1", "Products"), "ITEM-1")
+		self.assertIsNone(_accrual_key(scheme, "ITEM-2", "Products"))
+
+	def test_item_group_scheme_accrues_under_line_group(self):
+		scheme = _scheme("Item Group", item_groups=["Products", "Sub Products"])
+		self.assertEqual(_accrual_key(scheme, "ITEM-1", "Sub Products"), "Sub Products")
+		self.assertIsNone(_accrual_key(scheme, "ITEM-1", "Services"))
+		# lines without an item group never count in Item Group mode
+		self.assertIsNone(_accrual_key(_scheme("Item Group"), "ITEM-1", None))
+
+	def test_index_matches_on_the_field_the_key_reads(self):
+		index = AccrualIndex(
+			[
+				_scheme("Item Code", item_codes=["ITEM-1"], item_groups=["Products"]),
+				# codes are ignored in Item Group mode: every grouped line counts
+				_scheme("Item Group", item_codes=["ITEM-1"]),
+				_scheme("Item Code", item_groups=["Products"]),
+			]
+		)
+		self.assertEqual(index.match("ITEM-1", "Services"), {0, 1})
+		self.assertEqual(index.match("ITEM-2", "Products"), {1, 2})
+
+	def test_scheme_with_customer_and_territory_reads_both(self):
+		# rows are accrued for every party, the report keeps the listed
+		# customer and the territory's members (not just the customer)
+		scope = PartyScope("Selling", ["CUST-1"], {"territory": ["North"]})
+		join, condition, params = scope.sql("a.party")
+		self.assertEqual(join, "LEFT JOIN `tabCustomer` party_master ON party_master.name = a.party")
+		self.assertEqual(condition, "(a.party IN (%s) OR party_master.territory IN (%s))")
+		self.assertEqual(params, ["CUST-1", "North"])
@@ -0,0 +1,40 @@
+# Copyright (c) 2026, aits and Contributors
+# See license.txt
+
+from frappe.tests.utils import FrappeTestCase
+
+from promotional_scheme.promotional_scheme.engine import (
+	AMOUNT_OFF,
+	FREE_QUANTITY,
+	Adjustment,
+	Invoice,
+	InvoiceLine,
+)
+from promotional_scheme.promotional_scheme.reevaluation import _proposal
+
+
+def _invoice():
+	return Invoice(
+		party_side="Selling",
+		lines=[
+			InvoiceLine(idx=0, item_code="A", qty=2, rate=100),
+			InvoiceLine(idx=1, item_code="B", qty=4, rate=50),
+			InvoiceLine(idx=2, item_code="C", qty=1, rate=10),
+		],
+	)
+
+
+class TestPromotionalSchemeProposal(FrappeTestCase):
+	def test_amount_off_becomes_discount_on_matched_lines(self):
+		adjustments = [Adjustment("S", AMOUNT_OFF, (0, 1), (5, 0, 20), 20)]
+		matched, discount, free_qty, free_product = _proposal(_invoice(), adjustments)
+
+		# 10 off the rate of both lines: 2 x 10 + 4 x 10
+		self.assertEqual((matched, discount, free_qty, free_product), (2, 60, 0, None))
+
+	def test_free_quantity_is_per_line_without_free_product(self):
+		adjustments = [Adjustment("S", FREE_QUANTITY, (0, 1), (5, 2, None), 2)]
+		self.assertEqual(_proposal(_invoice(), adjustments)[2], 4)
+
+		adjustments = [Adjustment("S", FREE_QUANTITY, (0, 1), (5, 2, "FREE"), 2, free_product="FREE")]
+		self.assertEqual(_proposal(_invoice(), adjustments)[2:], (2, "FREE"))
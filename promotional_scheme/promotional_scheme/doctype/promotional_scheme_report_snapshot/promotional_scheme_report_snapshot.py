@@ -0,0 +1,14 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class PromotionalSchemeReportSnapshot(Document):
+	pass
+
+
+def on_doctype_update():
+	# rows are replaced per scheme / per scheme + party, see snapshots.py
+	frappe.db.add_index("Promotional Scheme Report Snapshot", ["scheme", "party_name"])
@@ -0,0 +1,23 @@
+# Copyright (c) 2026, aits and Contributors
+# See license.txt
+
+from datetime import date
+
+from frappe.tests.utils import FrappeTestCase
+
+from promotional_scheme.promotional_scheme.snapshots import _parties_in_window
+
+
+class TestPromotionalSchemeReportSnapshot(FrappeTestCase):
+	def test_only_invoices_inside_the_validity_touch_a_scheme(self):
+		changes = [
+			("EARLY", date(2025, 1, 31)),
+			("IN", date(2025, 2, 1)),
+			("IN", date(2025, 5, 1)),
+			("LAST", date(2025, 3, 31)),
+		]
+
+		self.assertEqual(_parties_in_window(changes, "2025-02-01", "2025-03-31"), {"IN", "LAST"})
+		# open ended validity
+		self.assertEqual(_parties_in_window(changes, None, "2025-01-31"), {"EARLY"})
+		self.assertEqual(_parties_in_window(changes, None, None), {"EARLY", "IN", "LAST"})
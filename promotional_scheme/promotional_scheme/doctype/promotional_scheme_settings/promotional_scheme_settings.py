@@ -0,0 +1,20 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+from promotional_scheme.promotional_scheme.policy import DEFAULT_MAX_CANDIDATES, POLICIES, PRIORITY
+
+SETTINGS_DOCTYPE = "Promotional Scheme Settings"
+
+
+class PromotionalSchemeSettings(Document):
+	pass
+
+
+def get_stacking_policy():
+	"""(policy, max_candidates) for policy.resolve."""
+	policy = frappe.db.get_single_value(SETTINGS_DOCTYPE, "stacking_policy", cache=True) or PRIORITY
+	max_candidates = frappe.db.get_single_value(SETTINGS_DOCTYPE, "max_search_candidates", cache=True)
+	return (policy if policy in POLICIES else PRIORITY), int(max_candidates or DEFAULT_MAX_CANDIDATES)
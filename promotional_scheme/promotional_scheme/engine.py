@@ -0,0 +1,319 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Scheme evaluation without frappe.
+
+Takes plain invoice structures (Invoice / InvoiceLine) and compiled schemes
+(scheme_index.CompiledScheme, or anything with the same attributes) and
+returns the adjustments the schemes call for. Nothing here touches a document
+or the database: the on_submit hook converts the invoice, evaluates, and then
+applies the Adjustments to the document; the report asks for slab + eligibility
+on its aggregated totals. Both are adapters around this module, which can be
+unit tested, profiled and run over thousands of invoices without a site.
+"""
+
+from array import array
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+
+from promotional_scheme.promotional_scheme.slabs import AMOUNT, QUANTITY, QUANTITY_AND_AMOUNT
+
+# invoice field -> key in CompiledScheme.parties, per party side
+PARTY_DIMENSIONS = {
+    "Selling": (
+        ("customer", "customers"),
+        ("customer_group", "customer_groups"),
+        ("territory", "territories"),
+    ),
+    "Buying": (
+        ("supplier", "suppliers"),
+        ("supplier_group", "supplier_groups"),
+    ),
+}
+
+# Adjustment.kind
+DISCOUNT_PERCENTAGE = "discount_percentage"  # value = percent off the rate of each line
+AMOUNT_OFF = "amount_off"  # value = amount off, split evenly over the lines
+FREE_QUANTITY = "free_quantity"  # value = free qty (free_product or the same item)
+
+
+@dataclass(slots=True)
+class InvoiceLine:
+    idx: int  # position in the invoice's items
+    item_code: str = None
+    item_group: str = None
+    qty: float = 0.0
+    rate: float = 0.0
+    base_net_amount: float = 0.0
+
+
+@dataclass(slots=True)
+class Invoice:
+    party_side: str  # "Selling" / "Buying"
+    parties: dict = field(default_factory=dict)  # invoice field -> value, see PARTY_DIMENSIONS
+    lines: list = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class Adjustment:
+    scheme: str
+    kind: str
+    lines: tuple  # InvoiceLine.idx of the lines it applies to
+    slab: tuple
+    value: float
+    free_product: str = None
+
+
+class _NoTrace:
+    # stand-in for tracing.SchemeTrace when the caller doesn't trace
+    __slots__ = ("evaluated",)
+
+    def __init__(self):
+        self.evaluated = 0
+
+    def phase(self, name):
+        return nullcontext()
+
+    def scheme(self, scheme_name, slab, applied):
+        pass
+
+
+def _flt(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# -------------------------
+# Matching
+# -------------------------
+def party_matches(scheme, party_side, parties):
+    """True when every party restriction of scheme (for party_side) accepts parties."""
+    for invoice_field, key in PARTY_DIMENSIONS.get(party_side, ()):
+        allowed = scheme.parties.get(key)
+        if allowed:
+            value = parties.get(invoice_field)
+            if not value or str(value) not in allowed:
+                return False
+    return True
+
+
+def line_matches(scheme, line):
+    if not (scheme.item_codes or scheme.item_groups):
+        return True
+    return line.item_code in scheme.item_codes or line.item_group in scheme.item_groups
+
+
+def match_schemes(schemes, invoice):
+    """
+    [(scheme, matching_lines)] by checking every scheme against every line.
+    Same result as ActiveSchemeIndex.match_invoice, which is what the hook uses;
+    this one needs no index (batch jobs, tests).
+    """
+    result = []
+    for scheme in schemes:
+        if not party_matches(scheme, invoice.party_side, invoice.parties):
+            continue
+        lines = [line for line in invoice.lines if line_matches(scheme, line)]
+        if lines:
+            result.append((scheme, lines))
+    return result
+
+
+# -------------------------
+# Slabs
+# -------------------------
+def evaluate_scheme(scheme, lines, trace=None):
+    """Adjustments one scheme calls for on its matching lines (may be empty)."""
+    trace = trace or _NoTrace()
+    validation_type = scheme.validation_type
+    line_ids = tuple(line.idx for line in lines)
+
+    if validation_type == AMOUNT:
+        with trace.phase("slab_selection"):
+            total_amount = sum(_flt(line.base_net_amount) for line in lines)
+            # best slab: highest minimum_amount <= total
+            slab = scheme.slabs.applicable(0, total_amount)
+        if not slab:
+            trace.scheme(scheme.name, None, False)
+            return []
+        discount_pct = slab[1]
+        trace.scheme(scheme.name, slab, discount_pct > 0)
+        if discount_pct > 0:
+            return [Adjustment(scheme.name, DISCOUNT_PERCENTAGE, line_ids, slab, discount_pct)]
+        return []
+
+    if validation_type == QUANTITY:
+        with trace.phase("slab_selection"):
+            total_qty = sum(_flt(line.qty) for line in lines)
+            slab = scheme.slabs.applicable(total_qty, 0)
+        # free items are not added to the invoice yet, so never "applied"
+        trace.scheme(scheme.name, slab, False)
+        if not slab:
+            return []
+        free_qty, free_product = slab[1], slab[2]
+        return [Adjustment(scheme.name, FREE_QUANTITY, line_ids, slab, free_qty, free_product=free_product)]
+
+    if validation_type == QUANTITY_AND_AMOUNT:
+        with trace.phase("slab_selection"):
+            total_qty = sum(_flt(line.qty) for line in lines)
+            # every slab with min_qty <= total_qty applies (prefix of the sorted table)
+            reached = scheme.slabs.table.upto(total_qty)
+        if not reached:
+            trace.scheme(scheme.name, None, False)
+        adjustments = []
+        for slab in reached:
+            amount_off = slab[2]
+            trace.scheme(scheme.name, slab, amount_off > 0)
+            if amount_off > 0:
+                adjustments.append(Adjustment(scheme.name, AMOUNT_OFF, line_ids, slab, amount_off))
+        return adjustments
+
+    trace.scheme(scheme.name, None, False)
+    return []
+
+
+def evaluate_candidates(matches, trace=None):
+    """[(scheme, adjustments)] for [(scheme, matching_lines)], in scheme order (input of policy.resolve)."""
+    trace = trace or _NoTrace()
+    evaluated = []
+    for scheme, lines in matches:
+        trace.evaluated += 1
+        evaluated.append((scheme, evaluate_scheme(scheme, lines, trace)))
+    return evaluated
+
+
+def evaluate_matches(matches, trace=None):
+    """Adjustments for [(scheme, matching_lines)], in scheme order, every scheme stacked."""
+    return [adj for _, adjustments in evaluate_candidates(matches, trace) for adj in adjustments]
+
+
+def evaluate_invoice(invoice, schemes):
+    """Match and evaluate schemes against invoice without an index."""
+    return evaluate_matches(match_schemes(schemes, invoice))
+
+
+# -------------------------
+# Applying
+# -------------------------
+class AdjustmentPlan:
+    """
+    All adjustments of an invoice folded per line, applied in one pass.
+    Per line (by InvoiceLine.idx): the product of the percent discount factors
+    and the sum of the amount-off shares. The new rate is
+    rate * factor - amount_off, whatever order the schemes came in.
+    """
+
+    __slots__ = ("amount_off", "factor", "schemes", "touched")
+
+    def __init__(self, size):
+        self.factor = array("d", [1.0]) * size
+        self.amount_off = array("d", [0.0]) * size
+        self.schemes = [None] * size  # last scheme that adjusted the line
+        self.touched = bytearray(size)
+
+    @classmethod
+    def from_adjustments(cls, size, adjustments):
+        plan = cls(size)
+        for adj in adjustments:
+            plan.add(adj)
+        return plan
+
+    def add(self, adj):
+        if adj.kind == DISCOUNT_PERCENTAGE:
+            factor = 1.0 - adj.value / 100.0
+            for i in adj.lines:
+                self.factor[i] *= factor
+                self.schemes[i] = adj.scheme
+                self.touched[i] = 1
+        elif adj.kind == AMOUNT_OFF and adj.lines:
+            share = adj.value / len(adj.lines)
+            for i in adj.lines:
+                self.amount_off[i] += share
+                self.schemes[i] = adj.scheme
+                self.touched[i] = 1
+        # free quantities don't change existing lines
+
+    def lines(self):
+        """idx of the lines that change, ascending."""
+        return [i for i, t in enumerate(self.touched) if t]
+
+    def rate(self, i, rate):
+        return _flt(rate) * self.factor[i] - self.amount_off[i]
+
+    def discount_percentage(self, i):
+        """Combined percent discount of line i (0 when only amounts were taken off)."""
+        return (1.0 - self.factor[i]) * 100.0
+
+
+def plan_adjustments(invoice, adjustments):
+    size = max((line.idx for line in invoice.lines), default=-1) + 1
+    return AdjustmentPlan.from_adjustments(size, adjustments)
+
+
+def apply_adjustments(invoice, adjustments):
+    """Apply adjustments to the plain invoice lines, the way the hook changes the document."""
+    plan = plan_adjustments(invoice, adjustments)
+    for line in invoice.lines:
+        if plan.touched[line.idx]:
+            line.rate = plan.rate(line.idx, line.rate)
+    return invoice
+
+
+# -------------------------
+# Report
+# -------------------------
+def is_eligible(validation_type, slab_vals, total_qty, total_amount):
+    """Eligibility of aggregated totals for the slab the report picked (slabs.SchemeSlabs.select)."""
+    if validation_type == AMOUNT:
+        return slab_vals.get("minimum_amount", 0) > 0 and total_amount >= _flt(slab_vals["minimum_amount"])
+
+    if validation_type == QUANTITY:
+        return slab_vals.get("minimum_quantity", 0) > 0 and total_qty >= _flt(slab_vals["minimum_quantity"])
+
+    if validation_type == QUANTITY_AND_AMOUNT:
+        return (
+            slab_vals.get("minimum_quantity", 0) > 0
+            and total_qty >= _flt(slab_vals["minimum_quantity"])
+            and slab_vals.get("amount_off", 0) > 0
+        )
+
+    return False
+
+
+# Report rows repeat the same totals over and over (zero totals above all), so
+# evaluate_totals keeps its result per (qty, amount) in the SchemeSlabs memo.
+# SchemeSlabs are compiled per scheme version, so a changed scheme starts a
+# new memo; a memo holding EVALUATION_MEMO_SIZE entries is cleared.
+EVALUATION_MEMO_SIZE = 4096
+
+# per process, see evaluation_memo_stats
+_memo_counters = {"hits": 0, "misses": 0}
+
+
+def evaluate_totals(scheme_slabs, total_qty, total_amount):
+    """(slab dict, eligible) for one report row's totals. The dict is shared, don't modify it."""
+    memo = scheme_slabs.memo
+    key = (total_qty, total_amount)
+    result = memo.get(key)
+    if result is not None:
+        _memo_counters["hits"] += 1
+        return result
+
+    _memo_counters["misses"] += 1
+    slab_vals = scheme_slabs.select(total_qty, total_amount)
+    result = (slab_vals, is_eligible(scheme_slabs.validation_type, slab_vals, total_qty, total_amount))
+    if len(memo) >= EVALUATION_MEMO_SIZE:
+        memo.clear()
+    memo[key] = result
+    return result
+
+
+def evaluation_memo_stats(reset=False):
+    """{"hits", "misses", "hit_rate"} of evaluate_totals in this process (since the last reset)."""
+    hits, misses = _memo_counters["hits"], _memo_counters["misses"]
+    if reset:
+        _memo_counters["hits"] = _memo_counters["misses"] = 0
+    return {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0}
@@ -0,0 +1,115 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Reading values out of a scheme's child tables / Table MultiSelects.
+
+The old extractor (duplicated in the doctype and the report) called
+row.as_dict() on every child row and then probed a list of candidate keys,
+falling back to the first non-empty field. Every child doctype holds exactly
+one useful link (Customer Item -> customer, Pricing Rule Item Code ->
+item_code, ...), so we resolve that field once per child doctype from its
+meta and read it straight off each row.
+"""
+
+import frappe
+from frappe.model import no_value_fields
+
+# (result key, scheme fieldname, candidate keys in order)
+PARTY_TABLES = (
+    ("customers", "customer", ("customer", "item", "value")),
+    ("customer_groups", "customer_group", ("customer_group", "item", "value", "group")),
+    ("territories", "territory", ("territory", "item", "value")),
+    ("suppliers", "supplier", ("supplier", "item", "value")),
+    ("supplier_groups", "supplier_group", ("supplier_group", "item", "value", "group")),
+)
+ITEM_CODE_TABLE = ("promotional_scheme_on_item_code", ("item_code", "item"))
+ITEM_GROUP_TABLE = ("promotional_scheme_on_item_group", ("item_group", "group"))
+
+_ROW_META_KEYS = frozenset(("idx", "name", "parent", "parentfield", "parenttype", "doctype"))
+
+# (child doctype, candidate keys) -> fieldname, per process
+_value_field_cache = {}
+
+
+def resolve_value_field(child_doctype, possible_keys=()):
+    """Fieldname holding the value on child_doctype: first candidate key it has, else its first Link field."""
+    key = (child_doctype, tuple(possible_keys))
+    if key in _value_field_cache:
+        return _value_field_cache[key]
+
+    field = None
+    try:
+        meta = frappe.get_meta(child_doctype)
+    except Exception:
+        meta = None
+
+    if meta is not None:
+        field = next((k for k in possible_keys if meta.has_field(k)), None)
+        if field is None:
+            value_fields = [df for df in meta.fields if df.fieldtype not in no_value_fields]
+            df = next((df for df in value_fields if df.fieldtype == "Link"), None)
+            if df is None and value_fields:
+                df = value_fields[0]
+            field = df.fieldname if df else None
+
+    _value_field_cache[key] = field
+    return field
+
+
+def _scan_rows(rows, possible_keys):
+    # rows without a doctype (plain dicts): probe the keys row by row
+    vals = set()
+    for row in rows:
+        row_dict = dict(row)
+        for k in possible_keys:
+            if row_dict.get(k):
+                vals.add(str(row_dict[k]))
+                break
+        else:
+            for k2, v2 in row_dict.items():
+                if k2 not in _ROW_META_KEYS and v2:
+                    vals.add(str(v2))
+                    break
+    return vals
+
+
+def extract_child_values(doc, fieldname, possible_keys=()):
+    """Set of non-empty values (as strings) in doc's child table / multiselect `fieldname`."""
+    rows = doc.get(fieldname) or []
+    if not rows:
+        return set()
+
+    # plain list of strings (some multiselect styles)
+    if isinstance(rows[0], str):
+        return {str(v) for v in rows if v}
+
+    first = rows[0]
+    child_doctype = first.get("doctype") if isinstance(first, dict) else getattr(first, "doctype", None)
+    field = resolve_value_field(child_doctype, possible_keys) if child_doctype else None
+    if not field:
+        return _scan_rows(rows, possible_keys)
+
+    vals = set()
+    for row in rows:
+        value = row.get(field)
+        if value:
+            vals.add(str(value))
+    return vals
+
+
+def extract_party_values(scheme_doc):
+    """customers / customer_groups / territories / suppliers / supplier_groups listed on the scheme (sets)."""
+    return {
+        key: extract_child_values(scheme_doc, fieldname, possible_keys)
+        for key, fieldname, possible_keys in PARTY_TABLES
+    }
+
+
+def extract_item_codes(scheme_doc):
+    return extract_child_values(scheme_doc, *ITEM_CODE_TABLE)
+
+
+def extract_item_groups(scheme_doc):
+    """Item groups as listed on the scheme, nested groups not expanded."""
+    return extract_child_values(scheme_doc, *ITEM_GROUP_TABLE)
@@ -0,0 +1,153 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Shared Item Group membership cache.
+
+Schemes used to expand their item groups into every Item of those groups
+(frappe.get_all("Item", filters={"item_group": ["in", ...]})) on every call.
+Instead we keep the Item Group tree (name, lft, rgt) once per site and expand
+a group into itself + all its descendant groups. Invoice lines / SQL rows are
+then matched on their item_group, no item codes are materialized.
+
+Invalidated from doc_events on Item Group (tree) and Item (item -> group map),
+which also tell the accrual ledger when its rows went stale.
+"""
+
+from bisect import bisect_left, bisect_right
+
+import frappe
+
+ITEM_GROUP_TREE_VERSION_KEY = "promotional_scheme:item_group_tree_version"
+ITEM_GROUP_OF_KEY = "promotional_scheme:item_group_of"
+
+# site -> (version, ItemGroupTree), per process
+_tree_cache = {}
+
+
+class ItemGroupTree:
+    """Item Groups ordered by lft; descendants of a group are one contiguous lft range."""
+
+    __slots__ = ("bounds", "lfts", "names")
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda r: r[1])
+        self.names = [r[0] for r in rows]
+        self.lfts = [r[1] for r in rows]
+        self.bounds = {r[0]: (r[1], r[2]) for r in rows}
+
+    def descendants(self, group):
+        """The group itself and every group nested below it."""
+        bounds = self.bounds.get(group)
+        if not bounds:
+            # unknown group (deleted / not synced yet), match it literally
+            return frozenset([group]) if group else frozenset()
+        lo = bisect_left(self.lfts, bounds[0])
+        hi = bisect_right(self.lfts, bounds[1])
+        return frozenset(self.names[lo:hi])
+
+    def expand(self, groups):
+        expanded = set()
+        for g in groups or ():
+            expanded.update(self.descendants(g))
+        return frozenset(expanded)
+
+    def rollup_map(self, groups):
+        """descendant group -> tuple of the given groups it belongs to."""
+        rollup = {}
+        for g in sorted(groups or ()):
+            for d in self.descendants(g):
+                rollup.setdefault(d, []).append(g)
+        return {d: tuple(parents) for d, parents in rollup.items()}
+
+
+def _load_tree_rows():
+    rows = frappe.get_all("Item Group", fields=["name", "lft", "rgt"], order_by="lft asc")
+    return [(r.name, r.lft or 0, r.rgt or 0) for r in rows]
+
+
+def get_item_group_tree_version():
+    """Stamp that changes whenever an Item Group is saved, renamed or deleted."""
+    version = frappe.cache().get_value(ITEM_GROUP_TREE_VERSION_KEY)
+    if not version:
+        version = frappe.generate_hash(length=12)
+        frappe.cache().set_value(ITEM_GROUP_TREE_VERSION_KEY, version)
+    return version
+
+
+def get_item_group_tree():
+    """Tree for the current site, loaded once per process and tree version."""
+    version = get_item_group_tree_version()
+
+    site = frappe.local.site
+    cached = _tree_cache.get(site)
+    if cached is None or cached[0] != version:
+        cached = (version, ItemGroupTree(_load_tree_rows()))
+        _tree_cache[site] = cached
+    return cached[1]
+
+
+def expand_item_groups(groups):
+    """Return a frozenset of the given groups plus all their descendant groups."""
+    if not groups:
+        return frozenset()
+    return get_item_group_tree().expand(groups)
+
+
+def get_item_group_of(item_code):
+    """item_group of an Item, through a small site-wide hash."""
+    if not item_code:
+        return None
+    cache = frappe.cache()
+    item_group = cache.hget(ITEM_GROUP_OF_KEY, item_code)
+    if item_group is None:
+        item_group = frappe.db.get_value("Item", item_code, "item_group") or ""
+        cache.hset(ITEM_GROUP_OF_KEY, item_code, item_group)
+    return item_group or None
+
+
+# -------------------------
+# doc_events
+# -------------------------
+def _changed(doc, fieldname):
+    # saved before (not an insert) with a different value
+    before = doc.get_doc_before_save()
+    return before is not None and before.get(fieldname) != doc.get(fieldname)
+
+
+def _accruals_stale():
+    # local import: accruals imports this module
+    from promotional_scheme.promotional_scheme.accruals import item_groups_changed
+
+    item_groups_changed()
+
+
+def invalidate_item_group_cache(doc=None, method=None, *args, **kwargs):
+    """
+    Item Group changed: drop the tree and recompile schemes (their group sets
+    are expanded); moved or renamed groups also make the accrual ledger stale.
+    """
+    from promotional_scheme.promotional_scheme.scheme_index import invalidate_scheme_index
+
+    frappe.cache().delete_value(ITEM_GROUP_TREE_VERSION_KEY)
+    invalidate_scheme_index()
+    if method == "after_rename" or (method == "on_update" and _changed(doc, "parent_item_group")):
+        _accruals_stale()
+
+
+def invalidate_item_cache(doc=None, method=None, *args, **kwargs):
+    """
+    Item changed / renamed / deleted: forget its cached item_group. Moving it
+    to another group or renaming it makes the accrual ledger stale.
+    """
+    cache = frappe.cache()
+    if doc is None:
+        cache.delete_value(ITEM_GROUP_OF_KEY)
+        return
+    cache.hdel(ITEM_GROUP_OF_KEY, doc.name)
+    # after_rename passes (doc, method, old, new, merge)
+    for old_name in args[:1]:
+        if old_name:
+            cache.hdel(ITEM_GROUP_OF_KEY, old_name)
+    if method == "after_rename" or (method == "on_update" and _changed(doc, "item_group")):
+        _accruals_stale()
@@ -0,0 +1,57 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Bulk loading of Custom Promotional Schemes.
+
+frappe.get_doc loads one scheme with one query per child table (two item
+tables, five party multiselects, three slab tables). load_schemes fetches N
+schemes with one query for the parents plus one per child table
+(parent IN (...)) and returns plain frappe._dict schemes: same fieldnames and
+child lists as the document, but no controller / meta attached.
+"""
+
+import frappe
+
+SCHEME_DOCTYPE = "Custom Promotional Scheme"
+
+# names per IN (...) list
+LOAD_BATCH_SIZE = 1000
+
+
+def _batches(names):
+    for start in range(0, len(names), LOAD_BATCH_SIZE):
+        yield names[start : start + LOAD_BATCH_SIZE]
+
+
+def load_schemes(names):
+    """Schemes for names, in the same order; names that don't exist are left out."""
+    names = list(dict.fromkeys(n for n in names or () if n))
+    if not names:
+        return []
+
+    schemes = {}
+    for batch in _batches(names):
+        for row in frappe.get_all(SCHEME_DOCTYPE, filters={"name": ["in", batch]}, fields=["*"]):
+            row.doctype = SCHEME_DOCTYPE
+            schemes[row.name] = row
+
+    table_fields = frappe.get_meta(SCHEME_DOCTYPE).get_table_fields()
+    for scheme in schemes.values():
+        for df in table_fields:
+            scheme[df.fieldname] = []
+
+    found = list(schemes)
+    for df in table_fields:
+        for batch in _batches(found):
+            child_rows = frappe.get_all(
+                df.options,
+                filters={"parent": ["in", batch], "parenttype": SCHEME_DOCTYPE, "parentfield": df.fieldname},
+                fields=["*"],
+                order_by="idx asc",
+            )
+            for row in child_rows:
+                row.doctype = df.options
+                schemes[row.parent][df.fieldname].append(row)
+
+    return [schemes[name] for name in names if name in schemes]
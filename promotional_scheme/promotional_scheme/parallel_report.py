@@ -0,0 +1,87 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Custom Promotional Scheme Report computed over several processes.
+
+The totals stay in the calling process: compute_totals runs the usual one
+aggregation per party side (plus ledger / single-scheme reads) once for the
+whole run. What is spread is the CPU-heavy part, expanding every scheme's
+grid and picking its slabs: the schemes are cut into contiguous chunks
+(CHUNKS_PER_WORKER per worker, for balance), each chunk is sent with its
+schemes' totals to a pool of spawned processes (each with its own frappe
+site and DB connection), and the chunk results come back in scheme order,
+so the rows are exactly those of a serial run.
+
+The pool lives for one run only and is shut down with it, so idle web
+workers keep no extra processes or DB connections; starting it costs about
+a second per worker, hence PARALLEL_MIN_SCHEMES. Enabled with
+"promotional_scheme_report_workers" in site_config.json (> 1). If the pool
+breaks the rows are built in-process from the same totals.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import frappe
+from frappe.utils import cint
+
+WORKERS_CONF = "promotional_scheme_report_workers"
+# below this many schemes, starting the pool isn't worth it
+PARALLEL_MIN_SCHEMES = 20
+CHUNKS_PER_WORKER = 4
+
+
+def report_workers():
+    """Worker processes for report runs (0 / 1: in-process)."""
+    return cint(frappe.conf.get(WORKERS_CONF))
+
+
+def _init_worker(site, sites_path):
+    frappe.init(site=site, sites_path=sites_path)
+    frappe.connect()
+
+
+def _report_module():
+    # local import: the report module imports this one
+    from promotional_scheme.promotional_scheme.report.custom_promotional_scheme_report import (
+        custom_promotional_scheme_report,
+    )
+
+    return custom_promotional_scheme_report
+
+
+def _compute_chunk(filters, scheme_names, totals):
+    # new transaction: don't read through the snapshot of the previous task
+    frappe.db.rollback()
+    return _report_module().compute_rows(frappe._dict(filters), scheme_names, totals)
+
+
+def _chunks(names, count):
+    """names cut into at most count contiguous, near-equal chunks, in order."""
+    size = max(1, -(-len(names) // max(count, 1)))
+    return [names[start:start + size] for start in range(0, len(names), size)]
+
+
+def compute_rows_parallel(filters, scheme_names, workers):
+    """compute_rows(filters, scheme_names) with the rows built by workers processes, in the same order."""
+    report = _report_module()
+    totals = report.compute_totals(filters, scheme_names)
+    names = list(totals)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            # fork would share the parent's DB connection and redis sockets
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(frappe.local.site, frappe.local.sites_path),
+        ) as pool:
+            futures = [
+                pool.submit(_compute_chunk, dict(filters), chunk, {name: totals[name] for name in chunk})
+                for chunk in _chunks(names, workers * CHUNKS_PER_WORKER)
+            ]
+            return [row for future in futures for row in future.result()]
+    except BrokenProcessPool:
+        frappe.log_error(title="Promotional scheme report: worker pool broke, building rows in-process")
+        return report.compute_rows(filters, names, totals)
@@ -0,0 +1,98 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+The parties a scheme covers in the report, resolved by the database.
+
+A scheme lists customers / suppliers and groups of them (customer_group and
+territory on the Selling side, supplier_group on the Buying side). The report
+used to expand every group into its member names with get_all and feed them
+back to the totals query as an IN (...) list: one placeholder per customer of
+a 40k customer territory. PartyScope keeps what the scheme lists and renders
+a join on the party master instead (explicit party OR master.group IN the
+listed groups), so members are only fetched when rows must be shown for
+parties without any invoice.
+
+Groups match the party's own group as listed, without descending the
+lft/rgt tree: on submit the invoice's customer_group / territory /
+supplier_group is compared the same way, and the report has to agree with it.
+"""
+
+import frappe
+
+from promotional_scheme.promotional_scheme.engine import PARTY_DIMENSIONS
+from promotional_scheme.promotional_scheme.extraction import extract_party_values
+
+PARTY_TYPES = {"Selling": "Customer", "Buying": "Supplier"}
+
+
+class PartyScope:
+    """
+    parties: explicit party names; groups: {party master field: names},
+    fields from PARTY_DIMENSIONS. Neither given: every party of the side.
+    """
+
+    __slots__ = ("groups", "parties", "party_side", "party_type")
+
+    def __init__(self, party_side, parties=(), groups=None):
+        self.party_side = party_side
+        self.party_type = PARTY_TYPES[party_side]
+        self.parties = frozenset(p for p in parties if p)
+        self.groups = {field: frozenset(values) for field, values in (groups or {}).items() if values}
+
+    @classmethod
+    def from_scheme(cls, scheme_doc, party_side):
+        listed = extract_party_values(scheme_doc)
+        # the party field's own key holds the explicit names, the others are groups
+        _, party_key = PARTY_DIMENSIONS[party_side][0]
+        groups = {field: listed[key] for field, key in PARTY_DIMENSIONS[party_side][1:]}
+        return cls(party_side, listed[party_key], groups)
+
+    @property
+    def restricts(self):
+        return bool(self.parties or self.groups)
+
+    def sql(self, party_col, alias="party_master"):
+        """
+        (join, condition, params) keeping the rows whose party_col is in scope;
+        ("", "", []) when every party is. The join goes first in FROM, the
+        condition into WHERE.
+        """
+        if not self.restricts:
+            return "", "", []
+        alternatives, params = [], []
+        if self.parties:
+            alternatives.append(f"{party_col} IN ({', '.join(['%s'] * len(self.parties))})")
+            params.extend(sorted(self.parties))
+        join = ""
+        if self.groups:
+            # one row per party (name is the key), explicit parties don't need one
+            join = f"LEFT JOIN `tab{self.party_type}` {alias} ON {alias}.name = {party_col}"
+            group_condition, group_params = self._group_condition(alias)
+            alternatives.append(group_condition)
+            params.extend(group_params)
+        return join, f"({' OR '.join(alternatives)})", params
+
+    def _group_condition(self, alias):
+        conditions, params = [], []
+        for field, values in sorted(self.groups.items()):
+            conditions.append(f"{alias}.{field} IN ({', '.join(['%s'] * len(values))})")
+            params.extend(sorted(values))
+        return " OR ".join(conditions), params
+
+    def members(self, names=None):
+        """Sorted names of the parties in scope (of names only, if given): explicit + group members."""
+        found = set(self.parties if names is None else self.parties.intersection(names))
+        if self.groups and (names is None or names):
+            condition, params = self._group_condition("p")
+            if names is not None:
+                condition = f"({condition}) AND p.name IN ({', '.join(['%s'] * len(names))})"
+                params.extend(sorted(names))
+            found.update(frappe.db.sql_list(f"SELECT p.name FROM `tab{self.party_type}` p WHERE {condition}", params))
+        return sorted(found)
+
+    def has_group_members(self):
+        if not self.groups:
+            return False
+        condition, params = self._group_condition("p")
+        return bool(frappe.db.sql(f"SELECT 1 FROM `tab{self.party_type}` p WHERE {condition} LIMIT 1", params))
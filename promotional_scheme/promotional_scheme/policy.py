@@ -0,0 +1,138 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Stacking policy: which of the matching schemes actually apply to an invoice.
+
+Works on the engine's output (per scheme, the adjustments it calls for), no
+frappe. Two schemes conflict when they adjust a common line and at least one
+of them is exclusive (Custom Promotional Scheme.is_exclusive); non-exclusive
+schemes always stack. Only the kinds the submit hook writes to invoice lines
+(APPLIED_KINDS) take part: free quantities are left to the user, so they
+neither win nor block a conflict. Policies (Promotional Scheme Settings):
+
+  - Priority: highest priority first (ties: scheme order), every scheme that
+    doesn't conflict with one already taken. With no priorities / exclusive
+    schemes this is "apply everything", the old behaviour.
+  - Best for Customer: the non-conflicting set with the largest total
+    benefit. Only schemes involved in a conflict are searched (branch and
+    bound, at most max_candidates of them and SEARCH_NODE_LIMIT nodes,
+    starting from the Priority answer), everything else is always taken.
+"""
+
+from promotional_scheme.promotional_scheme.engine import AMOUNT_OFF, DISCOUNT_PERCENTAGE, plan_adjustments
+
+PRIORITY = "Priority"
+BEST_FOR_CUSTOMER = "Best for Customer"
+POLICIES = (PRIORITY, BEST_FOR_CUSTOMER)
+
+DEFAULT_MAX_CANDIDATES = 16
+SEARCH_NODE_LIMIT = 20000
+
+# what apply_adjustments_to_invoice writes to the lines
+APPLIED_KINDS = frozenset((DISCOUNT_PERCENTAGE, AMOUNT_OFF))
+
+
+class Candidate:
+    """One scheme's adjustments on one invoice."""
+
+    __slots__ = ("adjustments", "benefit", "exclusive", "lines", "order", "priority", "scheme")
+
+    def __init__(self, order, scheme, adjustments):
+        self.order = order
+        self.scheme = scheme.name
+        self.priority = int(getattr(scheme, "priority", 0) or 0)
+        self.exclusive = bool(getattr(scheme, "is_exclusive", False))
+        self.lines = frozenset(i for adj in adjustments for i in adj.lines)
+        self.adjustments = adjustments
+        self.benefit = 0.0
+
+    def conflicts(self, other):
+        return (self.exclusive or other.exclusive) and not self.lines.isdisjoint(other.lines)
+
+
+def benefit(invoice, adjustments):
+    """What adjustments are worth to the customer on invoice: rate reduction x qty over the changed lines."""
+    if not adjustments:
+        return 0.0
+    plan = plan_adjustments(invoice, adjustments)
+    total = 0.0
+    for line in invoice.lines:
+        if plan.touched[line.idx]:
+            total += (line.rate - plan.rate(line.idx, line.rate)) * line.qty
+    return total
+
+
+def _by_priority(candidates):
+    return sorted(candidates, key=lambda c: (-c.priority, c.order))
+
+
+def _greedy(candidates, taken=()):
+    chosen = list(taken)
+    for candidate in _by_priority(candidates):
+        if not any(candidate.conflicts(other) for other in chosen):
+            chosen.append(candidate)
+    return chosen
+
+
+def _best_for_customer(invoice, candidates, max_candidates):
+    for candidate in candidates:
+        candidate.benefit = benefit(invoice, candidate.adjustments)
+
+    contested = [c for c in candidates if any(c.conflicts(o) for o in candidates if o is not c)]
+    fixed = [c for c in candidates if c not in contested]
+    # the most valuable contested schemes are searched, the rest fill in by priority
+    contested.sort(key=lambda c: (-c.benefit, -c.priority, c.order))
+    searched, rest = contested[:max_candidates], contested[max_candidates:]
+
+    def value(chosen):
+        return benefit(invoice, [adj for c in fixed + chosen for adj in c.adjustments])
+
+    best = [c for c in _greedy(searched) if c in searched]
+    best_value = value(best)
+    # remaining[k]: upper bound on what searched[k:] can still add
+    remaining = [0.0] * (len(searched) + 1)
+    for k in range(len(searched) - 1, -1, -1):
+        remaining[k] = remaining[k + 1] + max(searched[k].benefit, 0.0)
+
+    nodes = 0
+    stack = [(0, [], value([]))]
+    while stack and nodes < SEARCH_NODE_LIMIT:
+        k, chosen, chosen_value = stack.pop()
+        nodes += 1
+        if chosen_value > best_value + 1e-9:
+            best, best_value = chosen, chosen_value
+        if k == len(searched) or chosen_value + remaining[k] <= best_value + 1e-9:
+            continue
+        candidate = searched[k]
+        stack.append((k + 1, chosen, chosen_value))
+        # pushed last = explored first: with the candidate
+        if not any(candidate.conflicts(other) for other in chosen):
+            taken = [*chosen, candidate]
+            stack.append((k + 1, taken, value(taken)))
+
+    return _greedy(rest, taken=fixed + best)
+
+
+def resolve(invoice, evaluated, policy=PRIORITY, max_candidates=DEFAULT_MAX_CANDIDATES):
+    """
+    evaluated: [(scheme, adjustments)] in scheme order (engine.evaluate_candidates).
+    Returns the adjustments of the schemes that apply, in scheme order, kinds
+    outside APPLIED_KINDS dropped.
+    """
+    candidates = []
+    for order, (scheme, adjustments) in enumerate(evaluated):
+        applied = [adj for adj in adjustments if adj.kind in APPLIED_KINDS]
+        if applied:
+            candidates.append(Candidate(order, scheme, applied))
+    if len(candidates) > 1 and any(c.exclusive for c in candidates):
+        if policy == BEST_FOR_CUSTOMER:
+            chosen = _best_for_customer(invoice, candidates, max(int(max_candidates or 0), 1))
+        else:
+            chosen = _greedy(candidates)
+    else:
+        # nothing can conflict
+        chosen = candidates
+
+    chosen.sort(key=lambda c: c.order)
+    return [adj for c in chosen for adj in c.adjustments]
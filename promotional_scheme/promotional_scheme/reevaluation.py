@@ -0,0 +1,417 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Re-evaluation of submitted invoices when a scheme changes.
+
+Schemes only act on submit, so a scheme created late (or with corrected
+slabs) never reaches the invoices already submitted in its validity. Here
+those invoices are streamed (keyset on name, one query for the names and one
+for their lines per chunk), run through engine.py like on submit, and every
+invoice the scheme gives something on gets a Promotional Scheme Proposal
+(discount amount / free qty) for accounts to turn into a credit note. The
+scheme competes with the other schemes live on the invoice's posting date
+exactly as on submit (scheme index + stacking policy), so an exclusive or
+higher priority scheme that already won the invoice keeps it.
+
+The invoice range is split into `workers` partitions, each a background job
+on the long queue. A partition commits its proposals together with its
+checkpoint (last invoice name) per chunk, so a killed job resumes where it
+stopped; a change to the scheme's rules (CompiledScheme.rules_stamp)
+restarts from scratch, other edits leave the run alone. Workers default to
+"promotional_scheme_reevaluation_workers" in site_config.json (else 1).
+"""
+
+import json
+from itertools import pairwise
+
+import frappe
+from frappe.utils import flt, getdate, now, nowdate
+
+from promotional_scheme.promotional_scheme.accruals import INVOICE_TABLES
+from promotional_scheme.promotional_scheme.doctype.promotional_scheme_settings.promotional_scheme_settings import (
+    get_stacking_policy,
+)
+from promotional_scheme.promotional_scheme.engine import (
+    FREE_QUANTITY,
+    PARTY_DIMENSIONS,
+    Invoice,
+    InvoiceLine,
+    apply_adjustments,
+    evaluate_candidates,
+)
+from promotional_scheme.promotional_scheme.loader import load_schemes
+from promotional_scheme.promotional_scheme.policy import resolve
+from promotional_scheme.promotional_scheme.scheme_index import CompiledScheme, get_active_scheme_index
+
+PROPOSAL_DOCTYPE = "Promotional Scheme Proposal"
+# global default per scheme + partition, see _checkpoint
+CHECKPOINT_KEY_PREFIX = "promotional_scheme_reevaluation:"
+WORKERS_CONF = "promotional_scheme_reevaluation_workers"
+PROGRESS_EVENT = "promotional_scheme_reevaluation_progress"
+
+DEFAULT_CHUNK_SIZE = 1000
+# below this many invoices per worker, extra partitions aren't worth a job
+MIN_INVOICES_PER_WORKER = 5000
+
+PROPOSAL_FIELDS = [
+    "name", "creation", "modified", "owner", "modified_by",
+    "scheme", "invoice_type", "invoice", "posting_date", "party_type", "party", "status",
+    "validation_type", "matched_lines", "discount_amount", "free_qty", "free_product",
+]
+
+
+def _get_scheme(scheme_name):
+    docs = load_schemes([scheme_name])
+    return CompiledScheme(docs[0]) if docs else None
+
+
+# -------------------------
+# Checkpoints
+# -------------------------
+def _checkpoint_key(scheme_name, part):
+    return f"{CHECKPOINT_KEY_PREFIX}{scheme_name}:{part}"
+
+
+def _checkpoint(scheme_name, part):
+    value = frappe.db.get_global(_checkpoint_key(scheme_name, part))
+    return frappe._dict(json.loads(value)) if value else None
+
+
+def _save_checkpoint(scheme_name, part, checkpoint):
+    frappe.db.set_global(_checkpoint_key(scheme_name, part), json.dumps(checkpoint, default=str))
+
+
+def _checkpoints(scheme_name):
+    first = _checkpoint(scheme_name, 0)
+    if not first:
+        return []
+    checkpoints = [first] + [_checkpoint(scheme_name, part) for part in range(1, first.parts)]
+    return [c for c in checkpoints if c]
+
+
+def _clear_checkpoints(scheme_name):
+    first = _checkpoint(scheme_name, 0)
+    for part in range(first.parts if first else 0):
+        frappe.db.set_global(_checkpoint_key(scheme_name, part), "")
+
+
+# -------------------------
+# Invoice stream
+# -------------------------
+def _party_columns(party_side):
+    """[(invoice field, SQL expression)] the hook would read off the invoice."""
+    doctype = INVOICE_TABLES[party_side][0]
+    meta = frappe.get_meta(doctype)
+    return [
+        (field, f"si.{field}" if meta.has_field(field) else "NULL")
+        for field, _ in PARTY_DIMENSIONS[party_side]
+    ]
+
+
+def _invoice_conditions(scheme, party_side):
+    """WHERE clauses + params for submitted invoices the scheme can apply to."""
+    clauses, params = ["si.docstatus = 1"], []
+    if scheme.valid_from:
+        clauses.append("si.posting_date >= %s")
+        params.append(str(scheme.valid_from))
+    if scheme.valid_to:
+        clauses.append("si.posting_date <= %s")
+        params.append(str(scheme.valid_to))
+    # party restrictions narrow the scan already in SQL
+    for field, column in _party_columns(party_side):
+        values = scheme.parties.get(dict(PARTY_DIMENSIONS[party_side])[field])
+        if values and column != "NULL":
+            clauses.append(f"{column} IN ({', '.join(['%s'] * len(values))})")
+            params.extend(sorted(values))
+    return clauses, params
+
+
+def _partitions(scheme, party_side, workers):
+    """[(lo, hi)] name ranges (lo inclusive, hi exclusive, None = open) of about equal size."""
+    header = INVOICE_TABLES[party_side][1]
+    clauses, params = _invoice_conditions(scheme, party_side)
+    where = " AND ".join(clauses)
+    total = frappe.db.sql(f"SELECT COUNT(*) FROM {header} si WHERE {where}", tuple(params))[0][0] or 0
+
+    workers = max(1, min(int(workers or 1), total // MIN_INVOICES_PER_WORKER or 1))
+    bounds = [None]
+    for k in range(1, workers):
+        name = frappe.db.sql(
+            f"SELECT si.name FROM {header} si WHERE {where} ORDER BY si.name LIMIT 1 OFFSET %s",
+            (*params, k * total // workers),
+        )
+        if name and name[0][0] != bounds[-1]:
+            bounds.append(name[0][0])
+    bounds.append(None)
+    return total, list(pairwise(bounds))
+
+
+def _next_names(scheme, party_side, checkpoint, chunk_size):
+    header = INVOICE_TABLES[party_side][1]
+    clauses, params = _invoice_conditions(scheme, party_side)
+    if checkpoint.last:
+        clauses.append("si.name > %s")
+        params.append(checkpoint.last)
+    elif checkpoint.lo:
+        clauses.append("si.name >= %s")
+        params.append(checkpoint.lo)
+    if checkpoint.hi:
+        clauses.append("si.name < %s")
+        params.append(checkpoint.hi)
+
+    return frappe.db.sql_list(
+        f"SELECT si.name FROM {header} si WHERE {' AND '.join(clauses)} ORDER BY si.name LIMIT %s",
+        (*params, chunk_size),
+    )
+
+
+def _load_invoices(party_side, names):
+    """engine.Invoice per invoice name (with name / posting_date / party alongside), in name order."""
+    doctype, header, item_table, party_field, _ = INVOICE_TABLES[party_side]
+    party_columns = _party_columns(party_side)
+    placeholders = ", ".join(["%s"] * len(names))
+    rows = frappe.db.sql(
+        f"""
+        SELECT
+            si.name AS invoice,
+            si.posting_date AS posting_date,
+            {", ".join(f"{column} AS {field}" for field, column in party_columns)},
+            sii.item_code AS item_code,
+            COALESCE(NULLIF(sii.item_group, ''), i.item_group) AS item_group,
+            sii.qty AS qty,
+            sii.rate AS rate,
+            sii.base_net_amount AS base_net_amount
+        FROM {header} si
+        JOIN {item_table} sii ON sii.parent = si.name AND sii.parenttype = %s
+        LEFT JOIN `tabItem` i ON i.name = sii.item_code
+        WHERE si.name IN ({placeholders})
+        ORDER BY si.name, sii.idx
+        """,
+        (doctype, *names),
+        as_dict=True,
+    )
+
+    invoices = {}
+    for row in rows:
+        entry = invoices.get(row.invoice)
+        if entry is None:
+            invoice = Invoice(party_side=party_side, parties={field: row.get(field) for field, _ in party_columns})
+            entry = invoices[row.invoice] = (row.invoice, getdate(row.posting_date), row.get(party_field), invoice)
+        lines = entry[3].lines
+        lines.append(
+            InvoiceLine(
+                idx=len(lines),
+                item_code=row.item_code,
+                item_group=row.item_group,
+                qty=flt(row.qty),
+                rate=flt(row.rate),
+                base_net_amount=flt(row.base_net_amount),
+            )
+        )
+    return list(invoices.values())
+
+
+# -------------------------
+# Evaluation
+# -------------------------
+def _proposal(invoice, adjustments):
+    """(matched_lines, discount_amount, free_qty, free_product) for one invoice's adjustments."""
+    lines = {line.idx: line for line in invoice.lines}
+    matched = {i for adj in adjustments for i in adj.lines}
+    before = {i: lines[i].rate for i in matched}
+    apply_adjustments(invoice, adjustments)
+    discount = sum((before[i] - lines[i].rate) * lines[i].qty for i in matched)
+
+    free_qty, free_product = 0.0, None
+    for adj in adjustments:
+        if adj.kind == FREE_QUANTITY:
+            # one free row for free_product, else the free qty per matched line
+            free_qty += adj.value if adj.free_product else adj.value * len(adj.lines)
+            free_product = adj.free_product or free_product
+    return len(matched), discount, free_qty, free_product
+
+
+def _closed_invoices(scheme_name, names):
+    # invoices already credited / rejected for this scheme get no new proposal
+    return set(
+        frappe.get_all(
+            PROPOSAL_DOCTYPE,
+            filters={"scheme": scheme_name, "invoice": ["in", names], "status": ["!=", "Open"]},
+            pluck="invoice",
+        )
+    )
+
+
+def evaluate_chunk(scheme, party_side, names):
+    """Proposal rows (PROPOSAL_FIELDS order) for the invoices in names."""
+    doctype, _, _, _, party_type = INVOICE_TABLES[party_side]
+    closed = _closed_invoices(scheme.name, names)
+    stacking_policy = get_stacking_policy()
+    timestamp, user = now(), frappe.session.user
+
+    rows = []
+    for invoice_name, posting_date, party, invoice in _load_invoices(party_side, names):
+        if invoice_name in closed:
+            continue
+        # same steps as the submit hook, against every scheme live on the date
+        matches = get_active_scheme_index(party_side, posting_date).match_invoice(invoice.parties, invoice.lines)
+        evaluated = evaluate_candidates(matches)
+        adjustments = [
+            adj for adj in resolve(invoice, evaluated, *stacking_policy)
+            if adj.scheme == scheme.name
+        ]
+        # free quantities aren't applied on submit (nor stacked), they're proposed as the scheme has them
+        adjustments += [
+            adj for matched, scheme_adjustments in evaluated if matched.name == scheme.name
+            for adj in scheme_adjustments if adj.kind == FREE_QUANTITY
+        ]
+        if not adjustments:
+            continue
+        matched_lines, discount, free_qty, free_product = _proposal(invoice, adjustments)
+        if discount <= 0 and free_qty <= 0:
+            continue
+        rows.append((
+            frappe.generate_hash(length=10), timestamp, timestamp, user, user,
+            scheme.name, doctype, invoice_name, posting_date, party_type, party, "Open",
+            scheme.validation_type, matched_lines, discount, free_qty, free_product,
+        ))
+    return rows
+
+
+def run_partition(scheme_name, part, chunk_size=DEFAULT_CHUNK_SIZE, log=None):
+    """Work through one partition from its checkpoint, committing proposals + checkpoint per chunk."""
+    checkpoint = _checkpoint(scheme_name, part)
+    scheme = _get_scheme(scheme_name)
+    if not checkpoint or checkpoint.done or not scheme:
+        return
+    if checkpoint.rules != scheme.rules_stamp:
+        # rules changed since this run was planned, the newer run takes over
+        return
+
+    party_side = checkpoint.party_side
+    chunk_size = max(int(chunk_size or DEFAULT_CHUNK_SIZE), 1)
+    while True:
+        names = _next_names(scheme, party_side, checkpoint, chunk_size)
+        if not names:
+            break
+
+        stored = _checkpoint(scheme_name, part)
+        if not stored or stored.rules != checkpoint.rules:
+            # restarted meanwhile (scheme saved again / --restart)
+            return
+
+        rows = evaluate_chunk(scheme, party_side, names)
+        if rows:
+            frappe.db.bulk_insert(PROPOSAL_DOCTYPE, PROPOSAL_FIELDS, rows)
+
+        checkpoint.last = names[-1]
+        checkpoint.processed += len(names)
+        checkpoint.proposals += len(rows)
+        _save_checkpoint(scheme_name, part, checkpoint)
+        frappe.db.commit()
+        _publish_progress(scheme_name, log)
+
+    checkpoint.done = 1
+    _save_checkpoint(scheme_name, part, checkpoint)
+    frappe.db.commit()
+    _publish_progress(scheme_name, log)
+
+
+# -------------------------
+# Entry points
+# -------------------------
+def get_reevaluation_progress(scheme_name):
+    checkpoints = _checkpoints(scheme_name)
+    return {
+        "scheme": scheme_name,
+        "total": checkpoints[0].total if checkpoints else 0,
+        "processed": sum(c.processed for c in checkpoints),
+        "proposals": sum(c.proposals for c in checkpoints),
+        "parts": len(checkpoints),
+        "done": bool(checkpoints) and all(c.done for c in checkpoints),
+    }
+
+
+def _publish_progress(scheme_name, log=None):
+    progress = get_reevaluation_progress(scheme_name)
+    frappe.publish_realtime(PROGRESS_EVENT, progress)
+    if log:
+        log(f"{scheme_name}: {progress['processed']} / {progress['total']} invoices, {progress['proposals']} proposals")
+
+
+def reevaluate_scheme(scheme_name, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, restart=False, enqueue=True, log=None):
+    """
+    Plan (or resume) the re-evaluation of scheme_name's invoices and run it:
+    one long-queue job per partition, or in this process with enqueue=False.
+    """
+    scheme = _get_scheme(scheme_name)
+    if not scheme:
+        return
+    # schemes apply on submit only with an explicit party side
+    party_side = scheme.select_the_party if scheme.select_the_party in PARTY_DIMENSIONS else None
+
+    checkpoints = _checkpoints(scheme_name)
+    resume = (
+        not restart
+        and checkpoints
+        and len(checkpoints) == checkpoints[0].parts
+        and all(c.rules == scheme.rules_stamp for c in checkpoints)
+    )
+    if not resume:
+        _clear_checkpoints(scheme_name)
+        frappe.db.delete(PROPOSAL_DOCTYPE, {"scheme": scheme_name, "status": "Open"})
+        if not party_side:
+            frappe.db.commit()
+            return
+
+        total, ranges = _partitions(scheme, party_side, workers or frappe.conf.get(WORKERS_CONF) or 1)
+        checkpoints = []
+        for part, (lo, hi) in enumerate(ranges):
+            checkpoint = frappe._dict(
+                rules=scheme.rules_stamp, party_side=party_side, parts=len(ranges), total=total,
+                lo=lo, hi=hi, last=None, processed=0, proposals=0, done=0,
+            )
+            _save_checkpoint(scheme_name, part, checkpoint)
+            checkpoints.append(checkpoint)
+        frappe.db.commit()
+
+    for part, checkpoint in enumerate(checkpoints):
+        if checkpoint.done:
+            continue
+        if enqueue:
+            frappe.enqueue(
+                "promotional_scheme.promotional_scheme.reevaluation.run_partition",
+                queue="long",
+                timeout=4 * 3600,
+                # per rules version: a queued / running job of an older
+                # version must not swallow this one
+                job_id=f"promotional_scheme_reevaluation::{scheme_name}::{checkpoint.rules}::{part}",
+                deduplicate=True,
+                scheme_name=scheme_name,
+                part=part,
+                chunk_size=chunk_size,
+            )
+        else:
+            run_partition(scheme_name, part, chunk_size=chunk_size, log=log)
+
+
+def enqueue_reevaluation(scheme):
+    """Scheme (CompiledScheme) rules saved: re-evaluate its already submitted invoices in the background."""
+    if scheme.valid_from and scheme.valid_from > getdate(nowdate()):
+        # nothing submitted in the window yet
+        return
+    frappe.enqueue(
+        "promotional_scheme.promotional_scheme.reevaluation.reevaluate_scheme",
+        queue="long",
+        job_id=f"promotional_scheme_reevaluation::{scheme.name}::{scheme.rules_stamp}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        scheme_name=scheme.name,
+    )
+
+
+def delete_scheme_proposals(scheme_name):
+    # credited / rejected proposals stay as the record of what was done
+    frappe.db.delete(PROPOSAL_DOCTYPE, {"scheme": scheme_name, "status": "Open"})
+    _clear_checkpoints(scheme_name)
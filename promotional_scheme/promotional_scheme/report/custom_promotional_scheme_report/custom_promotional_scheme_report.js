@@ -1,6 +1,16 @@
 // Copyright (c) 2025, aits and contributors
 // For license information, please see license.txt
 
+// back to the first page (clearing the cursor refreshes the report itself)
+function restart_paging() {
+    const report = frappe.query_report;
+    if (report.get_filter_value("after")) {
+        report.set_filter_value("after", "");
+    } else {
+        report.refresh();
+    }
+}
+
 frappe.query_reports["Custom Promotional Scheme Report"] = {
     "filters": [
         {
@@ -124,10 +134,77 @@ frappe.query_reports["Custom Promotional Scheme Report"] = {
             "label": __("Show Only Eligible"),
             "fieldtype": "Check",
             "default": 1
+        },
+        {
+            // off: precomputed rows (hourly), used when no date window is set
+            "fieldname": "live",
+            "label": __("Live"),
+            "fieldtype": "Check",
+            "default": 0
+        },
+        // paging: rows come in (scheme, party, item) order, page_length at a time (0 = all)
+        {
+            "fieldname": "page_length",
+            "label": __("Page Size"),
+            "fieldtype": "Int",
+            "default": 0,
+            on_change: restart_paging
+        },
+        {
+            "fieldname": "sort_order",
+            "label": __("Sort Order"),
+            "fieldtype": "Select",
+            "options": ["Ascending", "Descending"],
+            "default": "Ascending",
+            on_change: restart_paging
+        },
+        {
+            // cursor of the current page, set by the Next Page button
+            "fieldname": "after",
+            "label": __("After"),
+            "fieldtype": "Data",
+            "hidden": 1
         }
     ],
 
     onload: function (report) {
+        report.page.add_inner_button(__("First Page"), function () {
+            report.set_filter_value("after", "");
+        }, __("Pages"));
+
+        report.page.add_inner_button(__("Next Page"), function () {
+            const data = report.data || [];
+            const last = data[data.length - 1];
+            if (!last || !last.next_page) {
+                frappe.show_alert({ message: __("No more rows"), indicator: "orange" });
+                return;
+            }
+            report.set_filter_value("after", last.next_page);
+        }, __("Pages"));
+
+        ["CSV", "XLSX"].forEach(file_format => {
+            report.page.add_inner_button(file_format, function () {
+                // rows are written by a background job as they are produced,
+                // in the paged view's order (scheme, party, item + Sort Order)
+                frappe.call({
+                    method: "promotional_scheme.promotional_scheme.report_export.export_report",
+                    args: { filters: report.get_filter_values(), file_format: file_format },
+                    callback() {
+                        frappe.show_alert({
+                            message: __("Export started: rows by scheme, party and item in the chosen Sort Order. The file opens when it is ready."),
+                            indicator: "blue"
+                        });
+                    }
+                });
+            }, __("Streamed Export"));
+        });
+
+        frappe.realtime.off("promotional_scheme_report_export");
+        frappe.realtime.on("promotional_scheme_report_export", function (data) {
+            frappe.show_alert({ message: __("{0} rows exported", [data.rows]), indicator: "green" });
+            window.open(data.file_url);
+        });
+
         report.page.on("report-rendered", function () {
             const data = report.data || [];
             const partySet = new Set();
@@ -1,10 +1,55 @@
 # File: promotional_scheme/report/custom_promotional_scheme_report/custom_promotional_scheme_report.py
+import hashlib
+from bisect import bisect_left, bisect_right
+
 import frappe
-from frappe.utils import nowdate, flt, getdate
+from frappe.utils import cint, flt, getdate, nowdate
+
+try:
+    import numpy as np
+except ImportError:  # columnar evaluation is optional, rows are built one by one without it
+    np = None
+
+from promotional_scheme.promotional_scheme.accruals import get_accrued_totals, ledger_covers
+from promotional_scheme.promotional_scheme.engine import evaluate_totals
+from promotional_scheme.promotional_scheme.extraction import (
+    extract_item_codes,
+    extract_item_groups,
+)
+from promotional_scheme.promotional_scheme.item_groups import expand_item_groups, get_item_group_tree
+from promotional_scheme.promotional_scheme.loader import load_schemes
+from promotional_scheme.promotional_scheme.parallel_report import (
+    PARALLEL_MIN_SCHEMES,
+    compute_rows_parallel,
+    report_workers,
+)
+from promotional_scheme.promotional_scheme.party_scope import PARTY_TYPES, PartyScope
+from promotional_scheme.promotional_scheme.slabs import (
+    AMOUNT,
+    QUANTITY,
+    QUANTITY_AND_AMOUNT,
+    get_scheme_slabs,
+)
+
 
 def execute(filters=None):
     filters = filters or {}
     columns = get_columns()
+    if cint(filters.get("page_length")) > 0:
+        # paged mode: one page of the keyset-ordered stream, see iter_report_rows
+        return columns, get_page(filters)
+
+    # precomputed rows unless "Live" is ticked (local import: snapshots.py builds on this module)
+    from promotional_scheme.promotional_scheme.snapshots import (
+        get_snapshot_rows,
+        snapshot_answers,
+        snapshot_watermark,
+    )
+
+    if snapshot_answers(filters):
+        message = frappe._("Snapshot as of {0}. Tick Live for current figures.").format(snapshot_watermark())
+        return columns, get_snapshot_rows(filters), message
+
     data = get_data(filters)
     return columns, data
 
@@ -32,232 +77,256 @@ def get_columns():
 
 # -------------------------
 # Helpers: extract values from scheme doc
-# (self-contained so report doesn't rely on other modules)
+# (child rows are read through the shared extraction module)
 # -------------------------
-def _extract_values_from_child_rows(doc, fieldname, possible_keys=None):
-    vals = set()
-    possible_keys = possible_keys or []
-    rows = doc.get(fieldname) or []
-    # If rows is a simple list of strings
-    if isinstance(rows, list) and rows and isinstance(rows[0], str):
-        for v in rows:
-            if v:
-                vals.add(str(v))
-        return vals
-
-    for row in rows:
-        # row might be Document or dict
-        row_dict = row.as_dict() if hasattr(row, "as_dict") else dict(row)
-        for k in possible_keys:
-            if k in row_dict and row_dict.get(k):
-                vals.add(str(row_dict.get(k)))
-                break
-        else:
-            # fallback: first non-meta non-empty value
-            for k2, v2 in row_dict.items():
-                if k2 in ("idx", "name", "parent", "parentfield", "parenttype", "doctype"):
-                    continue
-                if v2:
-                    vals.add(str(v2))
-                    break
-    return vals
-
 def _extract_items_and_groups(scheme_doc):
     """
-    Return two sets:
+    Return three sets:
       - item_codes: concrete item codes explicitly listed in the scheme
       - item_groups: concrete item groups explicitly listed in the scheme
-    Note: For 'Item Group' schemes we will use item_groups for display and use
-    item_codes internally (expanded from groups) for SQL filtering if needed.
+      - expanded_item_groups: item_groups plus all their nested groups (lft/rgt)
+    Note: For 'Item Group' schemes we use item_groups for display and
+    expanded_item_groups for SQL filtering; item codes are never materialized
+    from groups.
     """
-    item_codes = set()
-    item_groups = set()
-
-    # explicit item codes child table
-    try:
-        item_code_vals = _extract_values_from_child_rows(
-            scheme_doc, "promotional_scheme_on_item_code", possible_keys=["item_code", "item"]
-        )
-        item_codes.update(item_code_vals or [])
-    except Exception:
-        pass
-
-    # explicit item groups child table
-    try:
-        item_group_vals = _extract_values_from_child_rows(
-            scheme_doc, "promotional_scheme_on_item_group", possible_keys=["item_group", "group"]
-        )
-        item_groups.update(item_group_vals or [])
-    except Exception:
-        pass
-
-    # If groups exist, expand to item codes (for SQL filtering / totals)
-    expanded_codes_from_groups = set()
-    if item_groups:
-        try:
-            expanded_codes_from_groups = set(
-                frappe.get_all("Item", filters={"item_group": ["in", list(item_groups)]}, pluck="name") or []
-            )
-        except Exception:
-            expanded_codes_from_groups = set()
-
-    # final sets (normalize)
-    final_item_codes = set([str(i) for i in (item_codes | expanded_codes_from_groups) if i])
-    final_item_groups = set([str(g) for g in item_groups if g])
+    # explicit item codes / item groups child tables
+    final_item_codes = extract_item_codes(scheme_doc)
+    final_item_groups = extract_item_groups(scheme_doc)
 
     return {
         "item_codes": final_item_codes,
-        "item_groups": final_item_groups
+        "item_groups": final_item_groups,
+        "expanded_item_groups": set(expand_item_groups(final_item_groups)),
     }
 
-def _extract_party_values_from_scheme(scheme_doc):
-    customers = _extract_values_from_child_rows(scheme_doc, "customer", possible_keys=["customer", "value"])
-    customer_groups = _extract_values_from_child_rows(scheme_doc, "customer_group", possible_keys=["customer_group", "group"])
-    territories = _extract_values_from_child_rows(scheme_doc, "territory", possible_keys=["territory", "value"])
-    suppliers = _extract_values_from_child_rows(scheme_doc, "supplier", possible_keys=["supplier", "value"])
-    supplier_groups = _extract_values_from_child_rows(scheme_doc, "supplier_group", possible_keys=["supplier_group", "group"])
+def _rollup_group_totals(totals_map, item_groups):
+    """
+    Totals come back per actual Item.item_group; add nested groups' totals
+    into the scheme's listed group(s) they belong to.
+    """
+    rollup = get_item_group_tree().rollup_map(item_groups)
+    rolled = {}
+    for (party, group), totals in totals_map.items():
+        for listed_group in rollup.get(group, ()):
+            acc = rolled.setdefault((party, listed_group), {"total_amount": 0.0, "total_qty": 0.0})
+            acc["total_amount"] += totals["total_amount"]
+            acc["total_qty"] += totals["total_qty"]
+    return rolled
 
-    # Expand customer groups -> customers
-    if customer_groups:
-        cg_customers = frappe.get_all("Customer", filters={"customer_group": ["in", list(customer_groups)]}, pluck="name") or []
-        customers.update([str(c) for c in cg_customers if c])
+# -------------------------
+# Report filter planning
+# -------------------------
+# Filters that can go into SQL are pushed down by _plan_report_filters:
+#   - scheme_name / apply_on / party_type / from_date / to_date -> scheme selection query
+#   - party_name -> WHERE on the invoice party in _get_totals_for_scheme
+#   - item_or_group -> narrows the scheme's explicit items / groups before SQL
+#   - min_invoice_amount / min_invoice_qty (> 0) and show_only_eligible -> HAVING
+#   - slab filters (discount / free qty / amount off / free product) -> skip schemes
+#     none of whose slabs can satisfy them
+# Everything is still checked once more, in a single pass, by _apply_report_filters.
+SLAB_FILTERS = (
+    ("discount_min", "discount_percentage", ">="),
+    ("discount_max", "discount_percentage", "<="),
+    ("min_free_qty", "free_quantity", ">="),
+    ("max_free_qty", "free_quantity", "<="),
+    ("min_amount_off", "amount_off", ">="),
+    ("max_amount_off", "amount_off", "<="),
+)
+
+def _is_checked(value):
+    return value in (1, "1", True, "True", "true")
+
+def _plan_report_filters(filters):
+    """Split report filters into SQL pushdowns; see the comment block above."""
+    plan = frappe._dict(scheme_where=["1=1"], scheme_params={})
 
-    # Expand territories -> customers
-    if territories:
-        t_customers = frappe.get_all("Customer", filters={"territory": ["in", list(territories)]}, pluck="name") or []
-        customers.update([str(c) for c in t_customers if c])
+    if filters.get("scheme_name"):
+        plan.scheme_where.append("name = %(scheme_name)s")
+        plan.scheme_params["scheme_name"] = filters.get("scheme_name")
 
-    # Expand supplier groups -> suppliers
-    if supplier_groups:
-        sg_suppliers = frappe.get_all("Supplier", filters={"supplier_group": ["in", list(supplier_groups)]}, pluck="name") or []
-        suppliers.update([str(s) for s in sg_suppliers if s])
+    if filters.get("apply_on"):
+        plan.scheme_where.append("apply_on = %(apply_on)s")
+        plan.scheme_params["apply_on"] = filters.get("apply_on")
+
+    # rows of Buying schemes are "Supplier", everything else is reported as "Customer"
+    if filters.get("party_type") == "Customer":
+        plan.scheme_where.append("IFNULL(select_the_party, '') != 'Buying'")
+    elif filters.get("party_type") == "Supplier":
+        plan.scheme_where.append("select_the_party = 'Buying'")
+    elif filters.get("party_type"):
+        plan.scheme_where.append("1=0")
+
+    # scheme validity must intersect the requested window
+    if filters.get("from_date"):
+        plan.scheme_where.append("(valid_to IS NULL OR valid_to >= %(from_date)s)")
+        plan.scheme_params["from_date"] = str(getdate(filters.get("from_date")))
+    if filters.get("to_date"):
+        plan.scheme_where.append("(valid_from IS NULL OR valid_from <= %(to_date)s)")
+        plan.scheme_params["to_date"] = str(getdate(filters.get("to_date")))
+
+    plan.party_name = filters.get("party_name") or None
+    plan.item_term = str(filters.get("item_or_group") or "").strip().lower() or None
+
+    # HAVING is only safe for positive minimums: rows without totals default to 0
+    # and are dropped by the same filter afterwards
+    plan.min_amount = flt(filters.get("min_invoice_amount")) if filters.get("min_invoice_amount") is not None else 0.0
+    plan.min_qty = flt(filters.get("min_invoice_qty")) if filters.get("min_invoice_qty") is not None else 0.0
+    plan.only_eligible = _is_checked(filters.get("show_only_eligible"))
+
+    plan.slab_filters = [
+        (fieldname, column, op, flt(filters.get(fieldname)))
+        for fieldname, column, op in SLAB_FILTERS
+        if filters.get(fieldname) is not None
+    ]
+    plan.free_product = filters.get("free_product") or None
+    return plan
+
+def _scheme_can_match(scheme_slabs, plan):
+    """False when no slab of the scheme (fallback row included) can pass the slab filters."""
+    if not plan.slab_filters and not plan.free_product:
+        return True
+
+    candidates = [scheme_slabs.as_dict(v) for v in scheme_slabs.table.values]
+    candidates.append(scheme_slabs.as_dict(scheme_slabs.table.first))
+    for slab_vals in candidates:
+        if plan.free_product and (slab_vals["free_product"] or "") != plan.free_product:
+            continue
+        if all(
+            (slab_vals[column] >= value) if op == ">=" else (slab_vals[column] <= value)
+            for _, column, op, value in plan.slab_filters
+        ):
+            return True
+    return False
+
+def _totals_having(scheme_slabs, plan):
+    """
+    Lower bounds for SUM(amount) / SUM(qty) per (party, item_key) that rows must
+    reach to survive the filters. Returns None when the scheme cannot produce an
+    eligible row at all and only eligible rows are requested.
+    """
+    min_amount, min_qty = plan.min_amount, plan.min_qty
+
+    if plan.only_eligible:
+        # eligibility needs the chosen slab's (positive) minimum to be reached,
+        # so totals below the smallest positive threshold can never be eligible
+        positive = [t for t in scheme_slabs.table.thresholds if t > 0]
+        if scheme_slabs.validation_type not in (AMOUNT, QUANTITY, QUANTITY_AND_AMOUNT) or not positive:
+            return None
+        if scheme_slabs.validation_type == AMOUNT:
+            min_amount = max(min_amount, min(positive))
+        else:
+            min_qty = max(min_qty, min(positive))
 
-    return {
-        "customers": set([str(c) for c in customers if c]),
-        "customer_groups": set([str(cg) for cg in customer_groups if cg]),
-        "territories": set([str(t) for t in territories if t]),
-        "suppliers": set([str(s) for s in suppliers if s]),
-        "supplier_groups": set([str(sg) for sg in supplier_groups if sg]),
-    }
+    return {"total_amount": min_amount, "total_qty": min_qty}
+
+def _filter_keys_by_term(keys, term):
+    if not term:
+        return keys
+    return {k for k in keys if str(k).lower().find(term) != -1}
 
 # -------------------------
 # Apply report filters to result_rows (call this before returning)
 # -------------------------
-def _apply_report_filters(result_rows, filters):
-    rows = result_rows
+def _report_predicates(filters):
+    """One predicate per active report filter, for rows built by _make_row."""
+    predicates = []
 
     # simple equality filters
     if filters.get("scheme_name"):
-        rows = [r for r in rows if (r.get("scheme_name") or "").strip() == filters.get("scheme_name")]
+        scheme_name = filters.get("scheme_name")
+        predicates.append(lambda r: (r.get("scheme_name") or "").strip() == scheme_name)
 
     if filters.get("party_type"):
-        rows = [r for r in rows if (r.get("party_type") or "").strip() == filters.get("party_type")]
+        party_type = filters.get("party_type")
+        predicates.append(lambda r: (r.get("party_type") or "").strip() == party_type)
 
     if filters.get("party_name"):
-        rows = [r for r in rows if r.get("party_name") == filters.get("party_name")]
+        party_name = filters.get("party_name")
+        predicates.append(lambda r: r.get("party_name") == party_name)
 
     if filters.get("apply_on"):
-        rows = [r for r in rows if (r.get("apply_on") or "") == filters.get("apply_on")]
+        apply_on = filters.get("apply_on")
+        predicates.append(lambda r: (r.get("apply_on") or "") == apply_on)
 
     # partial-match for item_or_group (user may type part of item code / group)
     if filters.get("item_or_group"):
         term = str(filters.get("item_or_group")).strip().lower()
-        rows = [r for r in rows if (r.get("item_or_group") or "").lower().find(term) != -1]
+        predicates.append(lambda r: (r.get("item_or_group") or "").lower().find(term) != -1)
 
     # Date filters (these refer to scheme validity window columns already present in row)
     # If user supplied from_date/to_date filter, ensure scheme validity intersects requested window
-    from_date = filters.get("from_date")
-    to_date = filters.get("to_date")
-    if from_date:
-        from_date = getdate(from_date)
-        rows = [r for r in rows if not r.get("valid_to") or getdate(r.get("valid_to")) >= from_date]
-    if to_date:
-        to_date = getdate(to_date)
-        rows = [r for r in rows if not r.get("valid_from") or getdate(r.get("valid_from")) <= to_date]
-
-    # Numeric ranges on invoice totals
-    if filters.get("min_invoice_amount") is not None:
-        rows = [r for r in rows if flt(r.get("invoice_amount") or 0) >= flt(filters.get("min_invoice_amount"))]
-    if filters.get("max_invoice_amount") is not None:
-        rows = [r for r in rows if flt(r.get("invoice_amount") or 0) <= flt(filters.get("max_invoice_amount"))]
-
-    if filters.get("min_invoice_qty") is not None:
-        rows = [r for r in rows if flt(r.get("invoice_qty") or 0) >= flt(filters.get("min_invoice_qty"))]
-    if filters.get("max_invoice_qty") is not None:
-        rows = [r for r in rows if flt(r.get("invoice_qty") or 0) <= flt(filters.get("max_invoice_qty"))]
-
-    # Discount percentage ranges (based on scheme field discount_percentage)
-    if filters.get("discount_min") is not None:
-        rows = [r for r in rows if flt(r.get("discount_percentage") or 0) >= flt(filters.get("discount_min"))]
-    if filters.get("discount_max") is not None:
-        rows = [r for r in rows if flt(r.get("discount_percentage") or 0) <= flt(filters.get("discount_max"))]
-
-    if filters.get("min_free_qty") is not None:
-        rows = [
-            r for r in rows
-            if flt(r.get("free_quantity") or 0) >= flt(filters.get("min_free_qty"))
-        ]
-
-    if filters.get("max_free_qty") is not None:
-        rows = [
-            r for r in rows
-            if flt(r.get("free_quantity") or 0) <= flt(filters.get("max_free_qty"))
-        ]
-
-    # -------------------------
-    # Amount off filters
-    # -------------------------
-    if filters.get("min_amount_off") is not None:
-        rows = [
-            r for r in rows
-            if flt(r.get("amount_off") or 0) >= flt(filters.get("min_amount_off"))
-        ]
-
-    if filters.get("max_amount_off") is not None:
-        rows = [
-            r for r in rows
-            if flt(r.get("amount_off") or 0) <= flt(filters.get("max_amount_off"))
-        ]
-
-    # -------------------------
+    if filters.get("from_date"):
+        from_date = getdate(filters.get("from_date"))
+        predicates.append(lambda r: not r.get("valid_to") or getdate(r.get("valid_to")) >= from_date)
+    if filters.get("to_date"):
+        to_date = getdate(filters.get("to_date"))
+        predicates.append(lambda r: not r.get("valid_from") or getdate(r.get("valid_from")) <= to_date)
+
+    # Numeric ranges on invoice totals, slab values (discount / free qty / amount off)
+    ranges = (
+        ("min_invoice_amount", "invoice_amount", ">="),
+        ("max_invoice_amount", "invoice_amount", "<="),
+        ("min_invoice_qty", "invoice_qty", ">="),
+        ("max_invoice_qty", "invoice_qty", "<="),
+        *SLAB_FILTERS,
+    )
+    for fieldname, column, op in ranges:
+        if filters.get(fieldname) is None:
+            continue
+        bound = flt(filters.get(fieldname))
+        if op == ">=":
+            predicates.append(lambda r, column=column, bound=bound: flt(r.get(column) or 0) >= bound)
+        else:
+            predicates.append(lambda r, column=column, bound=bound: flt(r.get(column) or 0) <= bound)
+
     # Free product filter
-    # -------------------------
     if filters.get("free_product"):
-        rows = [
-            r for r in rows
-            if (r.get("free_product") or "") == filters.get("free_product")
-        ]
+        free_product = filters.get("free_product")
+        predicates.append(lambda r: (r.get("free_product") or "") == free_product)
 
     # show_only_eligible toggle (JS default is 1)
-    if filters.get("show_only_eligible") in (1, "1", True, "True", "true"):
-        rows = [r for r in rows if (r.get("eligibility_status") or "").lower() == "eligible"]
+    if _is_checked(filters.get("show_only_eligible")):
+        predicates.append(lambda r: (r.get("eligibility_status") or "").lower() == "eligible")
 
-    return rows
+    return predicates
 
-def _get_totals_for_scheme(scheme_doc, party_side, parties, item_codes=None, item_groups=None, report_from=None, report_to=None):
+def _apply_report_filters(result_rows, filters):
+    """All report filters fused into one pass over the rows."""
+    predicates = _report_predicates(filters)
+    if not predicates:
+        return result_rows
+    return [r for r in result_rows if all(p(r) for p in predicates)]
+
+def _scheme_window(scheme_doc, report_from=None, report_to=None):
+    """Posting date window for a scheme's totals: report dates win over scheme validity."""
+    if report_from:
+        from_date = getdate(report_from)
+    else:
+        from_date = getdate(getattr(scheme_doc, "valid_from", None)) if getattr(scheme_doc, "valid_from", None) else None
+
+    if report_to:
+        to_date = getdate(report_to)
+    else:
+        to_date = getdate(getattr(scheme_doc, "valid_to", None)) if getattr(scheme_doc, "valid_to", None) else None
+
+    return from_date, to_date
+
+def _get_totals_for_scheme(scheme_doc, party_side, parties, item_codes=None, item_groups=None, report_from=None, report_to=None, party_name=None, having=None, party_scope=None):
     """
     Returns dict keyed by (party_name or None, item_key or None) -> { total_amount, total_qty }
     - If scheme.apply_on == "Item Group" we group SQL results by Item.item_group and the returned key is (party, item_group).
     - If scheme.apply_on == "Item Code" we group by Sales/Purchase Invoice Item.item_code and return keys (party, item_code).
     - If item_codes provided (concrete item codes), we filter by them; if item_groups provided (concrete groups) we filter by those groups.
     - parties: list of (party_type, party_name) where party_name may be None to indicate All (we handle that in SQL).
+    - party_scope: PartyScope to restrict by instead of parties (groups are joined, not listed).
+    - party_name: single party pushed down from the report filters.
+    - having: {"total_amount": x, "total_qty": y} lower bounds applied as HAVING (0 = no bound).
     """
     item_codes = set(item_codes or [])
     item_groups = set(item_groups or [])
 
     # Normalize date range
-    if report_from:
-        from_date = getdate(report_from)
-    else:
-        from_date = getdate(getattr(scheme_doc, "valid_from", None)) if getattr(scheme_doc, "valid_from", None) else None
-
-    if report_to:
-        to_date = getdate(report_to)
-    else:
-        to_date = getdate(getattr(scheme_doc, "valid_to", None)) if getattr(scheme_doc, "valid_to", None) else None
-
-    # Concrete parties (list of names) for SQL where needed
-    concrete_parties = [pname for (ptype, pname) in parties if pname]
+    from_date, to_date = _scheme_window(scheme_doc, report_from, report_to)
 
     params = []
     where_clauses = ["si.docstatus = 1"]
@@ -283,11 +352,29 @@ def _get_totals_for_scheme(scheme_doc, party_side, parties, item_codes=None, ite
         item_table = "`tabPurchase Invoice Item`"
         party_col = "si.supplier"
 
-    # party filter (only if concrete parties provided)
-    if concrete_parties:
-        placeholders = ", ".join(["%s"] * len(concrete_parties))
-        where_clauses.append(f"{party_col} IN ({placeholders})")
-        params.extend(concrete_parties)
+    # party filter: explicit parties, or members of the listed groups via the party master
+    if party_scope is None:
+        party_scope = PartyScope(party_side, [pname for (ptype, pname) in parties if pname])
+    party_join, party_condition, party_params = party_scope.sql(party_col)
+    if party_condition:
+        where_clauses.append(party_condition)
+        params.extend(party_params)
+
+    # single party from the report filter
+    if party_name:
+        where_clauses.append(f"{party_col} = %s")
+        params.append(party_name)
+
+    # lower bounds on the aggregates
+    having_clauses = []
+    having_params = []
+    if having and flt(having.get("total_amount")) > 0:
+        having_clauses.append("SUM(COALESCE(sii.base_net_amount, sii.base_amount, sii.amount, 0)) >= %s")
+        having_params.append(flt(having.get("total_amount")))
+    if having and flt(having.get("total_qty")) > 0:
+        having_clauses.append("SUM(COALESCE(sii.qty, 0)) >= %s")
+        having_params.append(flt(having.get("total_qty")))
+    having_sql = f"HAVING {' AND '.join(having_clauses)}" if having_clauses else ""
 
     # Determine grouping mode from scheme
     apply_on = (getattr(scheme_doc, "apply_on", "") or "").strip()
@@ -321,9 +408,11 @@ def _get_totals_for_scheme(scheme_doc, party_side, parties, item_codes=None, ite
             FROM {header} si
             JOIN {item_table} sii ON sii.parent = si.name
             JOIN `tabItem` i ON i.name = sii.item_code
+            {party_join}
             WHERE {where_sql}
             {item_filter_clause}
             GROUP BY {party_col}, i.item_group
+            {having_sql}
         """
 
     else:
@@ -348,12 +437,15 @@ def _get_totals_for_scheme(scheme_doc, party_side, parties, item_codes=None, ite
                 SUM(COALESCE(sii.qty, 0)) AS total_qty
             FROM {header} si
             JOIN {item_table} sii ON sii.parent = si.name
+            {party_join}
             WHERE {where_sql}
             {item_filter_clause}
             GROUP BY {party_col}, sii.item_code
+            {having_sql}
         """
 
     # Execute
+    final_params.extend(having_params)
     rows = frappe.db.sql(sql, tuple(final_params), as_dict=True) or []
 
     # Map results into dictionary keyed by (party_name or None, item_key or None)
@@ -368,308 +460,653 @@ def _get_totals_for_scheme(scheme_doc, party_side, parties, item_codes=None, ite
 
     return totals_map
 
-def _resolve_scheme_rule_values(scheme_doc):
+# -------------------------
+# Row building: one scheme's parties x display_keys
+# -------------------------
+SLAB_COLUMNS = ("minimum_amount", "discount_percentage", "minimum_quantity", "free_quantity", "free_product", "amount_off")
+
+def _scheme_columns(scheme_doc):
+    """Row values that only depend on the scheme."""
+    return {
+        "scheme_name": scheme_doc.scheme_name or scheme_doc.name,
+        "apply_on": scheme_doc.apply_on or "-",
+        "valid_from": getattr(scheme_doc, "valid_from", None),
+        "valid_to": getattr(scheme_doc, "valid_to", None),
+    }
+
+def _make_row(scheme_cols, party_type, party_name, key, slab_vals, total_amount, total_qty, eligible):
+    return {
+        "scheme_name": scheme_cols["scheme_name"],
+        "party_type": party_type,
+        "party_name": party_name or "All",
+        "apply_on": scheme_cols["apply_on"],
+        "item_or_group": key if key else "-",
+        "minimum_amount": slab_vals["minimum_amount"],
+        "discount_percentage": slab_vals["discount_percentage"],
+        "minimum_quantity": slab_vals["minimum_quantity"],
+        "free_quantity": slab_vals["free_quantity"],
+        "free_product": slab_vals["free_product"],
+        "amount_off": slab_vals["amount_off"],
+
+        "valid_from": scheme_cols["valid_from"],
+        "valid_to": scheme_cols["valid_to"],
+        "invoice_amount": total_amount,
+        "invoice_qty": total_qty,
+        "eligibility_status": "Eligible" if eligible else "Not Eligible",
+    }
+
+def _build_rows(scheme_doc, scheme_slabs, parties, display_keys, totals_map):
+    """Row-at-a-time evaluation (used when numpy is not available)."""
+    rows = []
+    scheme_cols = _scheme_columns(scheme_doc)
+
+    for party_type, party_name in parties:
+        for key in display_keys:
+            totals = totals_map.get((party_name, key), {"total_amount": 0.0, "total_qty": 0.0})
+            total_amount = flt(totals.get("total_amount") or 0.0)
+            total_qty = flt(totals.get("total_qty") or 0.0)
+
+            # slab pick + eligibility rules live in engine.py (memoized per distinct totals)
+            slab_vals, eligible = evaluate_totals(scheme_slabs, total_qty, total_amount)
+            rows.append(_make_row(scheme_cols, party_type, party_name, key, slab_vals, total_amount, total_qty, eligible))
+
+    return rows
+
+def _columnar_evaluate(scheme_slabs, qty, amount):
     """
-    Returns normalized rule values regardless of where they are stored.
-    Compatible with old single-field logic and new child-table slabs.
+    (slab value columns, eligible mask) per row. Every distinct (qty, amount)
+    pair goes through engine.evaluate_totals once, like a row of _build_rows
+    (same memo), and the results are spread back over the rows.
     """
-
-    result = {
-        "minimum_quantity": 0.0,
-        "minimum_amount": 0.0,
-        "free_quantity": 0.0,
-        "discount_percentage": 0.0,
-        "free_product": None,
-        "amount_off": 0.0,
+    pairs, inverse = np.unique(np.column_stack((qty, amount)), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    evaluated = [evaluate_totals(scheme_slabs, float(q), float(a)) for q, a in pairs]
+    picked = {
+        col: np.array(
+            [slab_vals[col] for slab_vals, _ in evaluated], dtype=object if col == "free_product" else float
+        )[inverse]
+        for col in SLAB_COLUMNS
     }
+    eligible = np.array([ok for _, ok in evaluated], dtype=bool)[inverse]
+    return picked, eligible
 
-    validation_type = (scheme_doc.type_of_promo_validation or "").strip()
-
-    # -------------------------------------------------------
-    # Based on Minimum Quantity
-    # -------------------------------------------------------
-    if validation_type == "Based on Minimum Quantity":
-        rows = scheme_doc.get("quantity_discount_slabs") or []
-        if rows:
-            row = rows[0]  # first slab for now
-            result["minimum_quantity"] = flt(row.minimum_quantity)
-            result["free_quantity"] = flt(row.free_quantity)
-            result["free_product"] = row.free_product
-
-    # -------------------------------------------------------
-    # Based on Minimum Quantity & Amount
-    # -------------------------------------------------------
-    elif validation_type == "Based on Minimum Quantity & Amount":
-        rows = scheme_doc.get("free_qty_with_amount_off") or []
-        if rows:
-            row = rows[0]
-            result["minimum_quantity"] = flt(row.min_qty)
-            result["free_quantity"] = flt(row.free_qty)
-            result["amount_off"] = flt(row.amount_off)
-
-    # -------------------------------------------------------
-    # Based on Minimum Amount
-    # -------------------------------------------------------
-    elif validation_type == "Based on Minimum Amount":
-        rows = scheme_doc.get("amount_discount_slabs") or []
-        if rows:
-            row = rows[0]
-            result["minimum_amount"] = flt(row.minimum_amount)
-            result["discount_percentage"] = flt(row.discount_percentage)
-
-    # -------------------------------------------------------
-    # Old / fallback logic (backward compatible)
-    # -------------------------------------------------------
-    else:
-        result["minimum_quantity"] = flt(getattr(scheme_doc, "minimum_quantity", 0))
-        result["minimum_amount"] = flt(getattr(scheme_doc, "minimum_amount", 0))
-        result["free_quantity"] = flt(getattr(scheme_doc, "free_quantity", 0))
-        result["discount_percentage"] = flt(getattr(scheme_doc, "discount_percentage", 0))
+def _columnar_filter_mask(filters, parties, display_keys, amount, qty, picked, eligible):
+    """Report filters that depend on party / item / totals / slab, as one boolean mask."""
+    n_parties, n_keys = len(parties), len(display_keys)
+    mask = np.ones(n_parties * n_keys, dtype=bool)
+
+    if filters.get("party_name"):
+        party_mask = np.array([p == filters.get("party_name") for (_, p) in parties], dtype=bool)
+        mask &= np.repeat(party_mask, n_keys)
 
-    return result
+    if filters.get("item_or_group"):
+        term = str(filters.get("item_or_group")).strip().lower()
+        key_mask = np.array([(k if k else "-").lower().find(term) != -1 for k in display_keys], dtype=bool)
+        mask &= np.tile(key_mask, n_parties)
+
+    ranges = (
+        ("min_invoice_amount", amount, np.greater_equal),
+        ("max_invoice_amount", amount, np.less_equal),
+        ("min_invoice_qty", qty, np.greater_equal),
+        ("max_invoice_qty", qty, np.less_equal),
+        ("discount_min", picked["discount_percentage"], np.greater_equal),
+        ("discount_max", picked["discount_percentage"], np.less_equal),
+        ("min_free_qty", picked["free_quantity"], np.greater_equal),
+        ("max_free_qty", picked["free_quantity"], np.less_equal),
+        ("min_amount_off", picked["amount_off"], np.greater_equal),
+        ("max_amount_off", picked["amount_off"], np.less_equal),
+    )
+    for fieldname, values, op in ranges:
+        if filters.get(fieldname) is not None:
+            mask &= op(values, flt(filters.get(fieldname)))
 
-def _select_applicable_slab(scheme_doc, total_qty, total_amount):
+    if filters.get("free_product"):
+        mask &= picked["free_product"] == filters.get("free_product")
+
+    if filters.get("show_only_eligible") in (1, "1", True, "True", "true"):
+        mask &= eligible
+
+    return mask
+
+def _build_rows_columnar(scheme_doc, scheme_slabs, parties, display_keys, totals_map, filters):
     """
-    Selects the best matching slab row based on totals.
-    Returns a dict with normalized values.
+    Columnar variant of _build_rows: totals go into flat numpy arrays
+    (parties x display_keys, row-major), slabs and eligibility are evaluated
+    once per distinct totals, the row-level report filters are boolean masks,
+    and row dicts are only built for rows that survive the mask.
     """
+    n_keys = len(display_keys)
+    n = len(parties) * n_keys
+    if not n:
+        return []
+
+    party_pos = {party_name: i for i, (_, party_name) in enumerate(parties)}
+    key_pos = {key: j for j, key in enumerate(display_keys)}
+    amount = np.zeros(n)
+    qty = np.zeros(n)
+    for (party_name, key), totals in totals_map.items():
+        i = party_pos.get(party_name)
+        j = key_pos.get(key)
+        if i is None or j is None:
+            continue
+        amount[i * n_keys + j] = flt(totals.get("total_amount") or 0.0)
+        qty[i * n_keys + j] = flt(totals.get("total_qty") or 0.0)
 
-    result = {
-        "minimum_quantity": 0.0,
-        "minimum_amount": 0.0,
-        "free_quantity": 0.0,
-        "discount_percentage": 0.0,
-        "free_product": None,
-        "amount_off": 0.0,
-    }
+    picked, eligible = _columnar_evaluate(scheme_slabs, qty, amount)
 
-    validation_type = (scheme_doc.type_of_promo_validation or "").strip()
+    mask = _columnar_filter_mask(filters or {}, parties, display_keys, amount, qty, picked, eligible)
 
-    # =====================================================
-    # BASED ON MINIMUM QUANTITY
-    # =====================================================
-    if validation_type == "Based on Minimum Quantity":
-        rows = scheme_doc.get("quantity_discount_slabs") or []
+    rows = []
+    scheme_cols = _scheme_columns(scheme_doc)
+    for flat in np.flatnonzero(mask):
+        i, j = divmod(int(flat), n_keys)
+        party_type, party_name = parties[i]
+        slab_vals = {
+            col: (picked[col][flat] if col == "free_product" else float(picked[col][flat]))
+            for col in SLAB_COLUMNS
+        }
+        rows.append(_make_row(
+            scheme_cols, party_type, party_name, display_keys[j], slab_vals,
+            float(amount[flat]), float(qty[flat]), bool(eligible[flat])
+        ))
+    return rows
 
-        applicable = [
-            r for r in rows
-            if flt(r.minimum_quantity) <= flt(total_qty)
-        ]
+# -------------------------
+# Batched aggregation: one query per party side for all schemes
+# -------------------------
+# With many schemes over overlapping windows, one GROUP BY per scheme scans the
+# same invoice lines again and again. Instead we aggregate party x item_code x
+# item_group x posting_date once for the union window and derive each scheme's
+# totals from that cube in memory.
+BATCH_AGGREGATION_MIN_SCHEMES = 2
+
+class _TotalsCube:
+    """Aggregated invoice lines for one party side, ordered by posting_date."""
+
+    __slots__ = ("amounts", "dates", "item_codes", "item_groups", "parties", "party_groups", "qtys")
+
+    def __init__(self, rows, group_fields=()):
+        self.dates = [getdate(r.posting_date) for r in rows]
+        self.parties = [r.party_name for r in rows]
+        # party master field -> value per row, for schemes listing party groups
+        self.party_groups = {field: [r.get(field) for r in rows] for field in group_fields}
+        self.item_codes = [r.item_code for r in rows]
+        self.item_groups = [r.item_group for r in rows]
+        self.amounts = [flt(r.total_amount) for r in rows]
+        self.qtys = [flt(r.total_qty) for r in rows]
+
+    def totals_for(self, from_date, to_date, group_by_item_group, party_scope=None, item_codes=None, item_groups=None, having=None):
+        """
+        Same result as _get_totals_for_scheme for a scheme window / PartyScope /
+        item filter, computed from the cube.
+        """
+        lo = bisect_left(self.dates, from_date) if from_date else 0
+        hi = bisect_right(self.dates, to_date) if to_date else len(self.dates)
+
+        restricted = party_scope is not None and party_scope.restricts
+        if restricted:
+            parties = party_scope.parties
+            group_columns = [(self.party_groups[field], values) for field, values in party_scope.groups.items()]
+
+        totals_map = {}
+        for pos in range(lo, hi):
+            party = self.parties[pos]
+            if restricted and party not in parties and not any(column[pos] in values for column, values in group_columns):
+                continue
+
+            item_group = self.item_groups[pos]
+            if group_by_item_group:
+                # Item Group mode joins Item, lines without an Item drop out
+                if item_group is None or (item_groups and item_group not in item_groups):
+                    continue
+                key = item_group
+            else:
+                if item_codes:
+                    if self.item_codes[pos] not in item_codes:
+                        continue
+                elif item_groups and item_group not in item_groups:
+                    continue
+                key = self.item_codes[pos]
+
+            acc = totals_map.get((party or None, key or None))
+            if acc is None:
+                acc = totals_map[(party or None, key or None)] = {"total_amount": 0.0, "total_qty": 0.0}
+            acc["total_amount"] += self.amounts[pos]
+            acc["total_qty"] += self.qtys[pos]
+
+        if having:
+            min_amount = flt(having.get("total_amount"))
+            min_qty = flt(having.get("total_qty"))
+            totals_map = {
+                key: totals for key, totals in totals_map.items()
+                if (min_amount <= 0 or totals["total_amount"] >= min_amount)
+                and (min_qty <= 0 or totals["total_qty"] >= min_qty)
+            }
+        return totals_map
+
+def _get_totals_cube(party_side, from_date=None, to_date=None, party_name=None, group_fields=()):
+    """
+    One GROUP BY over the union window of all schemes of a party side.
+    group_fields: party master fields (customer_group, ...) to carry per row.
+    """
+    if party_side == "Selling":
+        header, item_table, party_col = "`tabSales Invoice`", "`tabSales Invoice Item`", "si.customer"
+    else:
+        header, item_table, party_col = "`tabPurchase Invoice`", "`tabPurchase Invoice Item`", "si.supplier"
 
-        if applicable:
-            row = max(applicable, key=lambda r: flt(r.minimum_quantity))
-        elif rows:
-            # Fallback to first slab
-            row = rows[0]
-        else:
-            row = None
-
-        if row:
-            result["minimum_quantity"] = flt(row.minimum_quantity)
-            result["free_quantity"] = flt(row.free_quantity)
-            result["free_product"] = row.free_product
-
-    # =====================================================
-    # BASED ON MINIMUM QUANTITY AND AMOUNT
-    # =====================================================
-    elif validation_type == "Based on Minimum Quantity & Amount":
-        rows = scheme_doc.get("free_qty_with_amount_off") or []
-
-        applicable = [
-            r for r in rows
-            if flt(r.min_qty) <= flt(total_qty)
-            and flt(r.amount_off) <= flt(total_amount)
-        ]
-
-        if applicable:
-            row = max(applicable, key=lambda r: flt(r.min_qty))
-        elif rows:
-            # Fallback to first slab
-            row = rows[0]
-        else:
-            row = None
-
-        if row:
-            result["minimum_quantity"] = flt(row.min_qty)
-            result["free_quantity"] = flt(row.free_qty)
-            result["amount_off"] = flt(row.amount_off)
-
-    # =====================================================
-    # Amount slabs
-    # =====================================================
-    elif validation_type == "Based on Minimum Amount":
-        rows = scheme_doc.get("amount_discount_slabs") or []
-
-        applicable = [
-            r for r in rows
-            if flt(r.minimum_amount) <= flt(total_amount)
-        ]
-
-        if applicable:
-            row = max(applicable, key=lambda r: flt(r.minimum_amount))
-        elif rows:
-            row = rows[0]
+    group_select = "".join(f"\n            p.{field} AS {field}," for field in group_fields)
+    group_by = "".join(f", p.{field}" for field in group_fields)
+    party_join = f"LEFT JOIN `tab{PARTY_TYPES[party_side]}` p ON p.name = {party_col}" if group_fields else ""
+
+    where_clauses = ["si.docstatus = 1"]
+    params = []
+    if from_date:
+        where_clauses.append("si.posting_date >= %s")
+        params.append(str(from_date))
+    if to_date:
+        where_clauses.append("si.posting_date <= %s")
+        params.append(str(to_date))
+    if party_name:
+        where_clauses.append(f"{party_col} = %s")
+        params.append(party_name)
+
+    rows = frappe.db.sql(f"""
+        SELECT
+            {party_col} AS party_name,{group_select}
+            sii.item_code AS item_code,
+            i.item_group AS item_group,
+            si.posting_date AS posting_date,
+            SUM(COALESCE(sii.base_net_amount, sii.base_amount, sii.amount, 0)) AS total_amount,
+            SUM(COALESCE(sii.qty, 0)) AS total_qty
+        FROM {header} si
+        JOIN {item_table} sii ON sii.parent = si.name
+        LEFT JOIN `tabItem` i ON i.name = sii.item_code
+        {party_join}
+        WHERE {" AND ".join(where_clauses)}
+        GROUP BY {party_col}{group_by}, sii.item_code, i.item_group, si.posting_date
+        ORDER BY si.posting_date
+    """, tuple(params), as_dict=True) or []
+
+    return _TotalsCube(rows, group_fields)
+
+def _union_window(windows):
+    """Smallest window covering all (from, to) windows; None = open on that side."""
+    from_dates = [w[0] for w in windows]
+    to_dates = [w[1] for w in windows]
+    from_date = None if any(d is None for d in from_dates) else min(from_dates)
+    to_date = None if any(d is None for d in to_dates) else max(to_dates)
+    return from_date, to_date
+
+# -------------------------
+# Main data builder
+# -------------------------
+def _prepare_scheme(scheme_doc, filters, plan):
+    """
+    Work out everything needed for one scheme's totals and rows.
+    Returns None when the scheme cannot produce any row surviving the filters.
+    """
+    # compiled once per scheme version, reused for every row below
+    scheme_slabs = get_scheme_slabs(scheme_doc)
+    if not _scheme_can_match(scheme_slabs, plan):
+        return None
+    having = _totals_having(scheme_slabs, plan)
+    if having is None:
+        # only eligible rows requested and this scheme has no reachable slab
+        return None
+
+    # parties: the listed ones plus the members of the listed groups, kept as
+    # a PartyScope so membership is resolved by the totals query
+    party_side = (scheme_doc.select_the_party or "").strip()
+    if party_side in ("Selling", "Buying"):
+        party_scope = PartyScope.from_scheme(scheme_doc, party_side)
+        if party_scope.groups and not party_scope.parties and not party_scope.has_group_members():
+            # nothing listed resolves to a party -> all parties, as an empty list always did
+            party_scope = PartyScope(party_side)
+    else:
+        # default to Selling + all
+        party_side = "Selling"
+        party_scope = PartyScope(party_side)
+
+    if plan.party_name and party_scope.restricts:
+        if not party_scope.members([plan.party_name]):
+            return None
+        party_scope = PartyScope(party_side, [plan.party_name])
+
+    # explicit parties get rows even without invoices; empty -> discovered from the totals
+    party_type = PARTY_TYPES[party_side]
+    parties = [(party_type, p) for p in sorted(party_scope.parties)]
+
+    # Narrowing the SQL to the searched items is only safe when it can't hide
+    # parties that would still show up (listed parties, or zero rows dropped anyway)
+    drops_zero_rows = plan.only_eligible or having["total_amount"] > 0 or having["total_qty"] > 0
+    narrow_items = bool(plan.item_term) and (party_scope.restricts or drops_zero_rows)
+
+    # items / groups
+    items_and_groups = _extract_items_and_groups(scheme_doc)
+    item_codes = items_and_groups.get("item_codes") or set()
+    item_groups = items_and_groups.get("item_groups") or set()
+    expanded_item_groups = items_and_groups.get("expanded_item_groups") or set()
+
+    ctx = frappe._dict(
+        scheme_doc=scheme_doc,
+        scheme_slabs=scheme_slabs,
+        party_side=party_side,
+        parties=parties,
+        party_scope=party_scope,
+        drops_zero_rows=drops_zero_rows,
+        window=_scheme_window(scheme_doc, filters.get("from_date"), filters.get("to_date")),
+    )
+
+    # decide what the totals are filtered / grouped by, depending on scheme.apply_on
+    apply_on = (getattr(scheme_doc, "apply_on", "") or "").strip()
+    if apply_on == "Item Group":
+        shown_groups = _filter_keys_by_term(item_groups, plan.item_term)
+        if item_groups and not shown_groups:
+            return None
+        if narrow_items and shown_groups != item_groups:
+            item_groups = shown_groups
+            expanded_item_groups = expand_item_groups(item_groups)
+
+        ctx.update(
+            group_by_item_group=True,
+            item_codes=None,
+            item_groups=expanded_item_groups,
+            rollup_groups=item_groups,
+            shown_keys=shown_groups,
+            # HAVING works on the un-rolled groups, so it only applies when
+            # there is nothing nested to roll up
+            having=having if set(expanded_item_groups) == set(item_groups) else None,
+        )
+    else:
+        shown_codes = _filter_keys_by_term(item_codes, plan.item_term)
+        if item_codes and not shown_codes:
+            return None
+        if narrow_items:
+            item_codes = shown_codes
+
+        ctx.update(
+            group_by_item_group=False,
+            item_codes=item_codes,
+            item_groups=None if item_codes else expanded_item_groups,
+            rollup_groups=None,
+            shown_keys=shown_codes,
+            having=having,
+        )
+    return ctx
+
+def _scheme_grid(ctx, totals_map, plan):
+    """(totals_map, parties, display_keys) of a prepared scheme; rows are parties x display_keys."""
+    if ctx.group_by_item_group:
+        if ctx.rollup_groups:
+            totals_map = _rollup_group_totals(totals_map, ctx.rollup_groups)
+        display_keys = sorted(ctx.shown_keys) if ctx.rollup_groups else [None]
+    elif ctx.item_codes:
+        display_keys = sorted(ctx.shown_keys)
+    elif ctx.item_groups:
+        # items come from the groups -> show the ones that were invoiced
+        found_keys = {k for (_, k) in totals_map.keys() if k}
+        display_keys = sorted(_filter_keys_by_term(found_keys, plan.item_term)) if found_keys else [None]
+    else:
+        display_keys = [None]
+
+    # If no parties listed in scheme, infer parties from totals_map keys (apply to all found)
+    parties = ctx.parties
+    if not ctx.party_scope.restricts:
+        found_parties = sorted({p for (p, _) in totals_map.keys() if p})
+        party_type = PARTY_TYPES[ctx.party_side]
+        parties = [(party_type, p) for p in found_parties]
+    elif ctx.party_scope.groups:
+        if ctx.drops_zero_rows:
+            # group members without totals would only give rows that get dropped
+            names = ctx.party_scope.parties.union(p for (p, _) in totals_map.keys() if p)
+            names = sorted(names)
         else:
-            row = None
+            names = ctx.party_scope.members()
+        party_type = PARTY_TYPES[ctx.party_side]
+        parties = [(party_type, p) for p in names]
+
+    return totals_map, parties, display_keys
+
+def _grid_rows(ctx, parties, display_keys, totals_map, filters):
+    """Rows for parties x display_keys (cartesian, party-major)."""
+    if np is not None:
+        return _build_rows_columnar(ctx.scheme_doc, ctx.scheme_slabs, parties, display_keys, totals_map, filters)
+    return _build_rows(ctx.scheme_doc, ctx.scheme_slabs, parties, display_keys, totals_map)
 
-        if row:
-            result["minimum_amount"] = flt(row.minimum_amount)
-            result["discount_percentage"] = flt(row.discount_percentage)
+def _rows_for_scheme(ctx, totals_map, filters, plan):
+    """Display keys + parties for a prepared scheme, then its (filtered) rows."""
+    totals_map, parties, display_keys = _scheme_grid(ctx, totals_map, plan)
+    return _grid_rows(ctx, parties, display_keys, totals_map, filters)
 
-    return result
+def _report_scheme_names(plan):
+    """Names of the schemes a run with plan covers, newest first."""
+    schemes = frappe.db.sql(
+        f"""SELECT name FROM `tabCustom Promotional Scheme` WHERE {" AND ".join(plan.scheme_where)} ORDER BY creation DESC""",
+        plan.scheme_params, as_dict=True
+    ) or []
+    return [s.name for s in schemes]
+
+def _prepare_schemes(filters, scheme_names=None):
+    """(plan, prepared schemes) for a report run, over scheme_names (in that order) if given."""
+    plan = _plan_report_filters(filters)
+    if scheme_names is None:
+        scheme_names = _report_scheme_names(plan)
+
+    # all schemes with their child tables in one query per child table
+    scheme_docs = load_schemes(scheme_names)
+    prepared = [ctx for ctx in (_prepare_scheme(doc, filters, plan) for doc in scheme_docs) if ctx]
+    return plan, prepared
+
+def _prepare_report(filters, scheme_names=None):
+    """
+    (plan, prepared schemes, totals cubes per party side) for a report run,
+    over scheme_names (in that order) if given.
+    """
+    plan, prepared = _prepare_schemes(filters, scheme_names)
+
+    # schemes whose accrual ledger covers the window read pre-aggregated rows
+    for ctx in prepared:
+        ctx.use_ledger = ledger_covers(ctx.scheme_doc, *ctx.window)
+
+    # shared cube per party side, for sides with enough schemes to pay off
+    cubes = {}
+    for party_side in ("Selling", "Buying"):
+        side_schemes = [ctx for ctx in prepared if ctx.party_side == party_side and not ctx.use_ledger]
+        if len(side_schemes) >= BATCH_AGGREGATION_MIN_SCHEMES:
+            from_date, to_date = _union_window([ctx.window for ctx in side_schemes])
+            group_fields = sorted({field for ctx in side_schemes for field in ctx.party_scope.groups})
+            cubes[party_side] = _get_totals_cube(
+                party_side, from_date, to_date, party_name=plan.party_name, group_fields=group_fields
+            )
+
+    return plan, prepared, cubes
+
+def _scheme_totals(ctx, cubes, filters, plan):
+    """totals_map of a prepared scheme: accrual ledger, shared cube or its own query."""
+    cube = cubes.get(ctx.party_side)
+    if ctx.use_ledger:
+        return get_accrued_totals(
+            ctx.scheme_doc.name, ctx.window[0], ctx.window[1],
+            party_scope=ctx.party_scope,
+            item_keys=sorted(ctx.item_groups if ctx.group_by_item_group else (ctx.item_codes or ())),
+            party_name=plan.party_name, having=ctx.having,
+        )
+    if cube is not None:
+        return cube.totals_for(
+            ctx.window[0], ctx.window[1], ctx.group_by_item_group,
+            party_scope=ctx.party_scope, item_codes=ctx.item_codes, item_groups=ctx.item_groups,
+            having=ctx.having,
+        )
+    return _get_totals_for_scheme(
+        ctx.scheme_doc, ctx.party_side, ctx.parties,
+        item_codes=ctx.item_codes, item_groups=ctx.item_groups,
+        report_from=filters.get("from_date"), report_to=filters.get("to_date"),
+        party_name=plan.party_name, having=ctx.having, party_scope=ctx.party_scope,
+    )
 
 def get_data(filters):
     """
-    Main data builder: for each scheme expand parties and items/groups, call totals helper,
+    Main data builder: for each scheme expand parties and items/groups, get totals,
     then emit rows either per item_code or per item_group depending on scheme.apply_on.
+    Pushable filters are applied in SQL (see _plan_report_filters), the rest in one pass at the end.
+    Totals come from the accrual ledger when it covers the scheme (see accruals.py),
+    else from one aggregation per party side when there are several schemes
+    (see _TotalsCube), otherwise from one query for the scheme.
+    With "promotional_scheme_report_workers" set, large runs are spread over
+    worker processes (see parallel_report.py).
     """
-    sql_where = ["1=1"]
-    params = {}
+    filters = filters or {}
+    workers = report_workers()
+    if workers > 1:
+        scheme_names = _report_scheme_names(_plan_report_filters(filters))
+        if len(scheme_names) >= PARALLEL_MIN_SCHEMES:
+            return compute_rows_parallel(filters, scheme_names, workers)
 
-    if filters.get("scheme_name"):
-        sql_where.append("name = %(scheme_name)s")
-        params["scheme_name"] = filters.get("scheme_name")
+    return compute_rows(filters)
 
-    if filters.get("apply_on"):
-        sql_where.append("apply_on = %(apply_on)s")
-        params["apply_on"] = filters.get("apply_on")
+def compute_totals(filters, scheme_names=None):
+    """{scheme name: totals_map} of the run's schemes (or of scheme_names) that can give rows, in scheme order."""
+    plan, prepared, cubes = _prepare_report(filters, scheme_names)
+    return {ctx.scheme_doc.name: _scheme_totals(ctx, cubes, filters, plan) for ctx in prepared}
 
-    schemes = frappe.db.sql(
-        f"""SELECT name FROM `tabCustom Promotional Scheme` WHERE {" AND ".join(sql_where)} ORDER BY creation DESC""",
-        params, as_dict=True
-    ) or []
+def compute_rows(filters, scheme_names=None, totals=None):
+    """
+    Filtered report rows of the run's schemes (or of scheme_names), in scheme
+    order. With totals (from compute_totals) nothing is aggregated again, only
+    the schemes found in it give rows.
+    """
+    if totals is None:
+        plan, prepared, cubes = _prepare_report(filters, scheme_names)
+    else:
+        plan, prepared = _prepare_schemes(filters, scheme_names)
 
     result_rows = []
-
-    for s in schemes:
-        try:
-            scheme_doc = frappe.get_doc("Custom Promotional Scheme", s.name)
-        except Exception:
+    for ctx in prepared:
+        if totals is None:
+            totals_map = _scheme_totals(ctx, cubes, filters, plan)
+        elif ctx.scheme_doc.name in totals:
+            totals_map = totals[ctx.scheme_doc.name]
+        else:
             continue
+        result_rows.extend(_rows_for_scheme(ctx, totals_map, filters, plan))
 
-        # parties
-        parties_dict = _extract_party_values_from_scheme(scheme_doc)
-        parties = []
-        party_side = (scheme_doc.select_the_party or "").strip()
+    # remaining predicates, fused into a single pass
+    result_rows = _apply_report_filters(result_rows, filters)
+    return result_rows
 
-        if party_side == "Selling":
-            if parties_dict["customers"]:
-                for c in sorted(parties_dict["customers"]):
-                    parties.append(("Customer", c))
-            else:
-                parties = []  # empty -> treat as all customers (use totals_map to discover)
-        elif party_side == "Buying":
-            if parties_dict["suppliers"]:
-                for sname in sorted(parties_dict["suppliers"]):
-                    parties.append(("Supplier", sname))
-            else:
-                parties = []
-        else:
-            # default to Selling + all
-            party_side = "Selling"
-            parties = []
-
-        # items / groups
-        items_and_groups = _extract_items_and_groups(scheme_doc)
-        item_codes = items_and_groups.get("item_codes") or set()
-        item_groups = items_and_groups.get("item_groups") or set()
-
-        # decide enumerated display keys depending on scheme.apply_on
-        apply_on = (getattr(scheme_doc, "apply_on", "") or "").strip()
-        if apply_on == "Item Group":
-            display_keys = sorted(item_groups) if item_groups else [None]
-            # For totals we must filter by item_groups (we pass groups)
-            totals_map = _get_totals_for_scheme(scheme_doc, party_side, parties, item_codes=None, item_groups=item_groups, report_from=filters.get("from_date"), report_to=filters.get("to_date"))
+# -------------------------
+# Streaming / paging
+# -------------------------
+# get_data holds every row of every scheme at once; a scheme without party
+# limits is all invoiced parties x all display keys. iter_report_rows yields
+# the same rows one at a time in keyset order (scheme name, party, item key):
+# one scheme's totals at a time, its grid evaluated STREAM_CHUNK_CELLS cells
+# at a time, and everything up to a cursor skipped without building rows.
+# Paging (execute with page_length) and the streamed export
+# (promotional_scheme/report_export.py) sit on top of it.
+STREAM_CHUNK_CELLS = 20000
+
+def _row_key(row):
+    """(party, item key) of a row within its scheme, as the keyset compares them."""
+    item_key = row["item_or_group"]
+    return (row["party_name"] or "", "" if item_key == "-" else item_key)
+
+def _iter_scheme_rows(ctx, totals_map, filters, plan, after=None, descending=False):
+    """
+    Rows of one scheme in (party, item key) order (reversed when descending),
+    strictly after the (party, item key) cursor after.
+    """
+    totals_map, parties, display_keys = _scheme_grid(ctx, totals_map, plan)
+    if after:
+        # whole parties before the cursor are never evaluated
+        if descending:
+            parties = [p for p in parties if p[1] <= after[0]]
         else:
-            # Item Code mode: display item codes (explicit or expanded from groups)
-            display_keys = sorted(item_codes) if item_codes else [None]
-            totals_map = _get_totals_for_scheme(scheme_doc, party_side, parties, item_codes=item_codes, item_groups=None, report_from=filters.get("from_date"), report_to=filters.get("to_date"))
-
-        # If no explicit parties listed in scheme, infer parties from totals_map keys (apply to all found)
-        if not parties:
-            found_parties = sorted({p for (p, _) in totals_map.keys() if p})
-            if party_side == "Selling":
-                parties = [("Customer", p) for p in found_parties]
-            else:
-                parties = [("Supplier", p) for p in found_parties]
-
-        # Build rows (cartesian parties × display_keys)
-        for party_type, party_name in parties:
-            for key in display_keys:
-                lookup_key = (party_name, key)
-                totals = totals_map.get(lookup_key, {"total_amount": 0.0, "total_qty": 0.0})
-                total_amount = flt(totals.get("total_amount") or 0.0)
-                total_qty = flt(totals.get("total_qty") or 0.0)
-
-                slab_vals = _select_applicable_slab(
-                    scheme_doc,
-                    total_qty=total_qty,
-                    total_amount=total_amount
-                )
-
-
-                validation_type = (scheme_doc.type_of_promo_validation or "").strip()
-                eligible = False
-
-                # ----------------------------------
-                # ELIGIBILITY RULES (FINAL & CORRECT)
-                # ----------------------------------
-
-                # 1️⃣ Based on Minimum Amount
-                # if validation_type == "Based on Minimum Amount":
-                #     eligible = total_amount >= flt(scheme_doc.minimum_amount or 0)
-                if validation_type == "Based on Minimum Amount":
-                    eligible = (
-                        slab_vals.get("minimum_amount", 0) > 0
-                        and total_amount >= flt(slab_vals["minimum_amount"])
-                    )
-
-                # 2️⃣ Based on Minimum Quantity
-                elif validation_type == "Based on Minimum Quantity":
-                    eligible = (
-                        slab_vals.get("minimum_quantity", 0) > 0
-                        and total_qty >= flt(slab_vals["minimum_quantity"])
-                    )
-
-                # 3️⃣ Based on Minimum Quantity and Amount
-                elif validation_type == "Based on Minimum Quantity & Amount":
-                    eligible = (
-                        slab_vals.get("minimum_quantity", 0) > 0
-                        and total_qty >= flt(slab_vals["minimum_quantity"])
-                        and slab_vals.get("amount_off", 0) > 0
-                    )
-
-                # fallback (should rarely hit)
-                else:
-                    eligible = False
-
-                display_item = key if key else "-"
-                # Extract free product and amount off from scheme rules (first rule only)
-                rule_vals = _resolve_scheme_rule_values(scheme_doc)
-
-                result_rows.append({
-                    "scheme_name": scheme_doc.scheme_name or scheme_doc.name,
-                    "party_type": party_type,
-                    "party_name": party_name or "All",
-                    "apply_on": scheme_doc.apply_on or "-",
-                    "item_or_group": display_item,
-                    # "minimum_amount": flt(getattr(scheme_doc, "minimum_amount", 0) or 0),
-                    # "discount_percentage": flt(getattr(scheme_doc, "discount_percentage", 0) or 0),
-                    # "minimum_quantity": flt(getattr(scheme_doc, "minimum_quantity", 0) or 0),
-                    # "free_quantity": flt(getattr(scheme_doc, "free_quantity", 0) or 0),
-                    "minimum_amount": slab_vals["minimum_amount"],
-                    "discount_percentage": slab_vals["discount_percentage"],
-                    "minimum_quantity": slab_vals["minimum_quantity"],
-                    "free_quantity": slab_vals["free_quantity"],
-                    "free_product": slab_vals["free_product"],
-                    "amount_off": slab_vals["amount_off"],
-
-                    "valid_from": getattr(scheme_doc, "valid_from", None),
-                    "valid_to": getattr(scheme_doc, "valid_to", None),
-                    "invoice_amount": total_amount,
-                    "invoice_qty": total_qty,
-                    "eligibility_status": "Eligible" if eligible else "Not Eligible",
-                })
-
-    result_rows = _apply_report_filters(result_rows, filters or {})
-    return result_rows
+            parties = [p for p in parties if p[1] >= after[0]]
+
+    chunk = max(STREAM_CHUNK_CELLS // max(len(display_keys), 1), 1)
+    starts = range(0, len(parties), chunk)
+    for start in reversed(starts) if descending else starts:
+        chunk_parties = parties[start:start + chunk]
+        chunk_totals = totals_map
+        if np is not None:
+            # the columnar builder scans the whole totals_map, give it the chunk's part
+            chunk_totals = {
+                (p, k): totals_map[(p, k)]
+                for _, p in chunk_parties
+                for k in display_keys
+                if (p, k) in totals_map
+            }
+        rows = _grid_rows(ctx, chunk_parties, display_keys, chunk_totals, filters)
+        if descending:
+            rows.reverse()
+        for row in rows:
+            if after:
+                key = _row_key(row)
+                if (key <= after) if not descending else (key >= after):
+                    continue
+            yield row
+
+def iter_report_rows(filters, after=None, descending=False):
+    """
+    Report rows one at a time, ordered by (scheme, party, item key) (reversed
+    when descending), starting strictly after the cursor after
+    ((scheme, party, item key), as page_cursor returns it). Every row carries
+    the scheme's name in "scheme".
+    """
+    filters = filters or {}
+    plan, prepared, cubes = _prepare_report(filters)
+    predicates = _report_predicates(filters)
+
+    prepared.sort(key=lambda ctx: ctx.scheme_doc.name, reverse=descending)
+    for ctx in prepared:
+        name = ctx.scheme_doc.name
+        scheme_after = None
+        if after:
+            if (name < after[0]) if not descending else (name > after[0]):
+                continue
+            if name == after[0]:
+                scheme_after = tuple(after[1:])
+
+        totals_map = _scheme_totals(ctx, cubes, filters, plan)
+        for row in _iter_scheme_rows(ctx, totals_map, filters, plan, scheme_after, descending):
+            if all(p(row) for p in predicates):
+                row["scheme"] = name
+                yield row
+
+def _cursor_filters_hash(filters):
+    # a cursor is only valid for the filters it was issued with
+    values = {k: v for k, v in filters.items() if k not in ("after", "page_length") and v not in (None, "")}
+    return hashlib.sha1(frappe.as_json(values, indent=None).encode()).hexdigest()[:10]
+
+def page_cursor(row, filters):
+    """Cursor (JSON) continuing after row, for the same filters."""
+    return frappe.as_json([row["scheme"], *_row_key(row), _cursor_filters_hash(filters)], indent=None)
+
+def _parse_cursor(value, filters):
+    try:
+        scheme, party, item_key, filters_hash = frappe.parse_json(value)
+    except Exception:
+        return None
+    if filters_hash != _cursor_filters_hash(filters):
+        # filters changed since the cursor was issued: back to the first page
+        return None
+    return (scheme, party, item_key)
+
+def get_page(filters):
+    """
+    One page (page_length rows) after the after cursor, in the sort_order
+    ("Ascending" / "Descending") of the keyset. The last row carries the
+    cursor of the next page in "next_page" when there may be one.
+    """
+    page_length = cint(filters.get("page_length"))
+    after = _parse_cursor(filters.get("after"), filters) if filters.get("after") else None
+    descending = filters.get("sort_order") == "Descending"
+
+    rows = []
+    for row in iter_report_rows(filters, after=after, descending=descending):
+        if len(rows) == page_length:
+            rows[-1]["next_page"] = page_cursor(rows[-1], filters)
+            break
+        rows.append(row)
+    return rows
@@ -0,0 +1,142 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Streamed CSV / XLSX export of the Custom Promotional Scheme Report.
+
+The standard export builds the whole result in memory first. Here a
+background job pulls rows from the report's iter_report_rows and writes them
+to a private file as they come (csv writer / openpyxl write-only sheet,
+flushed every EXPORT_CHUNK_ROWS rows), so memory stays flat however many
+rows a scheme expands to. The file is attached as a File and the user gets a
+realtime EXPORT_EVENT with its URL.
+"""
+
+import csv
+import os
+
+import frappe
+from frappe.utils import cstr, now_datetime
+
+from promotional_scheme.promotional_scheme.report.custom_promotional_scheme_report.custom_promotional_scheme_report import (
+    get_columns,
+    iter_report_rows,
+)
+
+REPORT_NAME = "Custom Promotional Scheme Report"
+EXPORT_EVENT = "promotional_scheme_report_export"
+EXPORT_FORMATS = ("CSV", "XLSX")
+EXPORT_CHUNK_ROWS = 5000
+
+
+@frappe.whitelist()
+def export_report(filters=None, file_format="CSV"):
+    """Queue a streamed export of the report for filters; the file arrives via EXPORT_EVENT."""
+    if file_format not in EXPORT_FORMATS:
+        frappe.throw(frappe._("Export format must be one of {0}").format(", ".join(EXPORT_FORMATS)))
+    if not frappe.get_doc("Report", REPORT_NAME).is_permitted():
+        frappe.throw(frappe._("Not permitted"), frappe.PermissionError)
+
+    filters = frappe.parse_json(filters) or {}
+    # paging filters don't apply to an export
+    for key in ("page_length", "after"):
+        filters.pop(key, None)
+
+    frappe.enqueue(
+        "promotional_scheme.promotional_scheme.report_export.build_report_export",
+        queue="long",
+        timeout=4 * 3600,
+        filters=filters,
+        file_format=file_format,
+        user=frappe.session.user,
+    )
+
+
+def _cell(value):
+    return value if isinstance(value, (int, float)) else cstr(value)
+
+
+class _CsvWriter:
+    def __init__(self, path):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+
+    def write(self, values):
+        self.writer.writerow(values)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class _XlsxWriter:
+    def __init__(self, path):
+        from openpyxl import Workbook
+
+        self.path = path
+        # write-only: rows go to a temp file instead of staying in memory
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(REPORT_NAME[:31])
+
+    def write(self, values):
+        self.sheet.append(values)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+def write_report(path, filters, file_format="CSV"):
+    """
+    Write every report row for filters to path, in the keyset order of the
+    paged view (scheme, party, item key) and its Sort Order; returns the
+    number of rows.
+    """
+    columns = get_columns()
+    fieldnames = [column["fieldname"] for column in columns]
+
+    writer = _XlsxWriter(path) if file_format == "XLSX" else _CsvWriter(path)
+    count = 0
+    try:
+        writer.write([column["label"] for column in columns])
+        descending = filters.get("sort_order") == "Descending"
+        for row in iter_report_rows(filters, descending=descending):
+            writer.write([_cell(row.get(fieldname)) for fieldname in fieldnames])
+            count += 1
+            if count % EXPORT_CHUNK_ROWS == 0:
+                writer.flush()
+    finally:
+        writer.close()
+    return count
+
+
+def build_report_export(filters, file_format="CSV", user=None):
+    """Background job: write the export, attach it as a private File, tell the user."""
+    file_name = f"{frappe.scrub(REPORT_NAME)}-{now_datetime().strftime('%Y%m%d-%H%M%S')}.{file_format.lower()}"
+    path = frappe.get_site_path("private", "files", file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    count = write_report(path, frappe._dict(filters or {}), file_format)
+
+    file_doc = frappe.get_doc(
+        {
+            "doctype": "File",
+            "file_name": file_name,
+            "file_url": f"/private/files/{file_name}",
+            "is_private": 1,
+        }
+    )
+    file_doc.flags.ignore_permissions = True
+    file_doc.insert()
+    if user:
+        file_doc.db_set("owner", user, update_modified=False)
+    frappe.db.commit()
+
+    frappe.publish_realtime(
+        EXPORT_EVENT, {"file_url": file_doc.file_url, "rows": count, "file_format": file_format}, user=user
+    )
+    return file_doc.file_url
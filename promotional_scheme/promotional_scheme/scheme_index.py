@@ -0,0 +1,293 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Compiled index of active Custom Promotional Schemes.
+
+apply_promotional_schemes used to frappe.get_doc every active scheme on every
+invoice submit and re-derive its parties / items / slabs. Here the active
+schemes are compiled into plain structures (shared between workers through
+compiled_cache.py) and indexed in process memory, once per site + party side
++ validity segment (validity_calendar.py: a stretch of days with the same
+active schemes), so invoices posted on different dates, back-dated ones
+included, each get the schemes of their own date. An index is rebuilt only
+when a scheme changes (CustomPromotionalScheme bumps INDEX_VERSION_KEY).
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from contextlib import nullcontext
+
+import frappe
+from frappe.utils import getdate, nowdate
+
+from promotional_scheme.promotional_scheme.engine import PARTY_DIMENSIONS
+from promotional_scheme.promotional_scheme.item_groups import get_item_group_of
+from promotional_scheme.promotional_scheme.slabs import SchemeSlabs, get_scheme_slabs
+
+INDEX_VERSION_KEY = "promotional_scheme:scheme_index_version"
+
+# (site, party_side, segment) -> ActiveSchemeIndex, per process, least recently used first
+_index_cache = OrderedDict()
+INDEX_CACHE_SIZE = 16
+
+
+class CompiledScheme:
+    """Plain, read-only view of one Custom Promotional Scheme."""
+
+    __slots__ = (
+        "apply_on",
+        "is_exclusive",
+        "item_codes",
+        "item_groups",
+        "modified",
+        "name",
+        "parties",
+        "priority",
+        "scheme_name",
+        "select_the_party",
+        "slabs",
+        "valid_from",
+        "valid_to",
+        "validation_type",
+    )
+
+    def __init__(self, scheme_doc):
+        # local import: the doctype module imports this one for the hook
+        from promotional_scheme.promotional_scheme.doctype.custom_promotional_scheme.custom_promotional_scheme import (
+            _extract_item_codes_from_scheme,
+            _extract_item_groups_from_scheme,
+            _extract_party_values_from_scheme,
+        )
+
+        self.name = scheme_doc.name
+        self.modified = scheme_doc.modified
+        self.scheme_name = scheme_doc.scheme_name or scheme_doc.name
+        self.select_the_party = (scheme_doc.select_the_party or "").strip()
+        self.apply_on = (scheme_doc.apply_on or "").strip()
+        self.validation_type = (scheme_doc.type_of_promo_validation or "").strip()
+        self.valid_from = getdate(scheme_doc.valid_from) if scheme_doc.valid_from else None
+        self.valid_to = getdate(scheme_doc.valid_to) if scheme_doc.valid_to else None
+
+        self.parties = {
+            key: frozenset(values)
+            for key, values in _extract_party_values_from_scheme(scheme_doc).items()
+        }
+        # explicit codes; groups include their nested groups and are matched
+        # against the invoice line's item_group
+        self.item_codes = frozenset(_extract_item_codes_from_scheme(scheme_doc))
+        self.item_groups = frozenset(_extract_item_groups_from_scheme(scheme_doc))
+
+        # slab table for this scheme's validation type (bisect lookups)
+        self.slabs = get_scheme_slabs(scheme_doc)
+
+        # stacking, see policy.py
+        self.priority = int(scheme_doc.get("priority") or 0)
+        self.is_exclusive = bool(scheme_doc.get("is_exclusive"))
+
+    def to_cache(self):
+        """Compact, class-free form for the shared cache (see compiled_cache.py)."""
+        return (
+            self.name,
+            self.modified,
+            self.scheme_name,
+            self.select_the_party,
+            self.apply_on,
+            self.validation_type,
+            self.valid_from,
+            self.valid_to,
+            {key: sorted(values) for key, values in self.parties.items()},
+            sorted(self.item_codes),
+            sorted(self.item_groups),
+            self.slabs.to_cache(),
+            self.priority,
+            self.is_exclusive,
+        )
+
+    @classmethod
+    def from_cache(cls, data):
+        scheme = cls.__new__(cls)
+        (
+            scheme.name,
+            scheme.modified,
+            scheme.scheme_name,
+            scheme.select_the_party,
+            scheme.apply_on,
+            scheme.validation_type,
+            scheme.valid_from,
+            scheme.valid_to,
+            parties,
+            item_codes,
+            item_groups,
+            slabs,
+            scheme.priority,
+            scheme.is_exclusive,
+        ) = data
+        scheme.parties = {key: frozenset(values) for key, values in parties.items()}
+        scheme.item_codes = frozenset(item_codes)
+        scheme.item_groups = frozenset(item_groups)
+        scheme.slabs = SchemeSlabs.from_cache(slabs)
+        return scheme
+
+    @property
+    def rules_stamp(self):
+        """
+        Digest of what decides which invoices the scheme applies to and what
+        it gives (everything but name / modified / scheme_name): equal stamps,
+        same outcome on every invoice.
+        """
+        rules = json.dumps(self.to_cache()[3:], default=str, sort_keys=True)
+        return hashlib.sha1(rules.encode()).hexdigest()[:16]
+
+    @property
+    def has_item_restriction(self):
+        return bool(self.item_codes or self.item_groups)
+
+
+class ActiveSchemeIndex:
+    """
+    Active schemes for one party side on one date, with inverted lookup tables:
+      - party_postings[field][value] -> positions of schemes listing that value
+        (field is customer / customer_group / territory or supplier / supplier_group)
+      - item_postings / item_group_postings: item_code / item_group -> positions
+    A scheme without restriction on a dimension sits in that dimension's wildcard set.
+    Positions keep the original scheme order so results are stable.
+    """
+
+    def __init__(self, party_side, on_date, version, schemes):
+        self.party_side = party_side
+        self.on_date = on_date
+        self.version = version
+        self.schemes = list(schemes)
+        self.party_fields = PARTY_DIMENSIONS.get(party_side, ())
+
+        self.party_postings = {field: {} for field, _ in self.party_fields}
+        self.party_wildcards = {field: set() for field, _ in self.party_fields}
+        self.item_postings = {}
+        self.item_group_postings = {}
+        self.item_wildcards = set()
+
+        for pos, scheme in enumerate(self.schemes):
+            for field, key in self.party_fields:
+                values = scheme.parties.get(key)
+                if values:
+                    for v in values:
+                        self.party_postings[field].setdefault(v, set()).add(pos)
+                else:
+                    self.party_wildcards[field].add(pos)
+
+            if not scheme.has_item_restriction:
+                self.item_wildcards.add(pos)
+            for code in scheme.item_codes:
+                self.item_postings.setdefault(code, set()).add(pos)
+            for group in scheme.item_groups:
+                self.item_group_postings.setdefault(group, set()).add(pos)
+
+    def party_candidates(self, party_values):
+        """
+        Positions of schemes whose party restrictions all accept party_values
+        ({invoice field: value}). Intersects one posting list per dimension.
+        """
+        allowed = None
+        for field, _ in self.party_fields:
+            value = party_values.get(field)
+            hits = set(self.party_wildcards[field])
+            if value:
+                hits.update(self.party_postings[field].get(str(value), ()))
+            allowed = hits if allowed is None else allowed & hits
+            if not allowed:
+                return set()
+        return allowed if allowed is not None else set(range(len(self.schemes)))
+
+    def match_invoice(self, party_values, lines, trace=None):
+        """
+        Return [(CompiledScheme, matching_lines)] for schemes that accept the party
+        and at least one line. One pass over the lines; schemes that cannot match
+        are never touched. trace (tracing.SchemeTrace, optional) gets the pruning counts.
+        """
+        if trace:
+            trace.considered = len(self.schemes)
+        if not self.schemes:
+            return []
+
+        with trace.phase("party_match") if trace else nullcontext():
+            allowed = self.party_candidates(party_values)
+        if trace:
+            trace.pruned_by_party = len(self.schemes) - len(allowed)
+        if not allowed:
+            return []
+
+        with trace.phase("item_match") if trace else nullcontext():
+            matches = {}
+            check_groups = bool(self.item_group_postings)
+            for line in lines:
+                code = getattr(line, "item_code", None)
+                hits = set(self.item_postings.get(code, ()))
+                if check_groups:
+                    hits.update(self.item_group_postings.get(_line_item_group(line), ()))
+                for pos in hits:
+                    if pos in allowed:
+                        matches.setdefault(pos, []).append(line)
+
+            # no item restriction -> every invoice line
+            for pos in self.item_wildcards & allowed:
+                matches[pos] = list(lines)
+
+            result = [(self.schemes[pos], matches[pos]) for pos in sorted(matches) if matches[pos]]
+
+        if trace:
+            trace.pruned_by_item = len(allowed) - len(result)
+        return result
+
+
+def _line_item_group(line):
+    return getattr(line, "item_group", None) or get_item_group_of(getattr(line, "item_code", None))
+
+
+def _current_version():
+    return frappe.cache().get_value(INDEX_VERSION_KEY) or ""
+
+
+def _bump_version():
+    frappe.cache().set_value(INDEX_VERSION_KEY, frappe.generate_hash(length=12))
+
+
+def invalidate_scheme_index(*args, **kwargs):
+    """Force every worker to rebuild its index on the next lookup."""
+    _bump_version()
+    # bump again after commit, a worker may have rebuilt from pre-commit data meanwhile
+    frappe.db.after_commit.add(_bump_version)
+
+
+def build_scheme_index(party_side, on_date, version=""):
+    from promotional_scheme.promotional_scheme.compiled_cache import get_compiled_schemes
+    from promotional_scheme.promotional_scheme.validity_calendar import get_active_schemes
+
+    # active schemes from the validity calendar, compiled schemes from the
+    # shared cache: only misses hit the database
+    rows = get_active_schemes(party_side, on_date)
+    return ActiveSchemeIndex(party_side, on_date, version, get_compiled_schemes(rows))
+
+
+def get_active_scheme_index(party_side, on_date=None):
+    """
+    Return the compiled index for party_side ("Selling"/"Buying") on on_date
+    (default today; the hook passes the invoice's posting date).
+    """
+    from promotional_scheme.promotional_scheme.validity_calendar import get_validity_calendar
+
+    on_date = getdate(on_date or nowdate())
+    version = _current_version()
+    # every date of a segment has the same active schemes, so they share an index
+    key = (frappe.local.site, party_side, get_validity_calendar().segment(party_side, on_date))
+
+    index = _index_cache.get(key)
+    if index is None or index.version != version:
+        index = build_scheme_index(party_side, on_date, version)
+        _index_cache[key] = index
+    _index_cache.move_to_end(key)
+    while len(_index_cache) > INDEX_CACHE_SIZE:
+        _index_cache.popitem(last=False)
+
+    return index
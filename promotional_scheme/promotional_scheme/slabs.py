@@ -0,0 +1,211 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Compiled slab tables for Custom Promotional Scheme.
+
+Slabs are kept as a sorted threshold array plus a parallel value array and
+looked up with bisect, instead of filtering every slab row and taking max().
+Built once per scheme version (name + modified) and shared by the submit hook
+(through CompiledScheme) and the report.
+"""
+
+from bisect import bisect_right
+
+AMOUNT = "Based on Minimum Amount"
+QUANTITY = "Based on Minimum Quantity"
+QUANTITY_AND_AMOUNT = "Based on Minimum Quantity & Amount"
+
+# validation type -> (child table fieldname, threshold field, value fields)
+SLAB_FIELDS = {
+    AMOUNT: ("amount_discount_slabs", "minimum_amount", ("minimum_amount", "discount_percentage")),
+    QUANTITY: (
+        "quantity_discount_slabs",
+        "minimum_quantity",
+        ("minimum_quantity", "free_quantity", "free_product"),
+    ),
+    QUANTITY_AND_AMOUNT: ("free_qty_with_amount_off", "min_qty", ("min_qty", "free_qty", "amount_off")),
+}
+
+# per process: (site, scheme name, modified) -> SchemeSlabs
+_slab_cache = {}
+_SLAB_CACHE_SIZE = 2048
+
+
+def _flt(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _row_get(row, fieldname):
+    return row.get(fieldname) if hasattr(row, "get") else getattr(row, fieldname, None)
+
+
+class SlabTable:
+    """
+    thresholds: ascending; values[i] is the slab tuple for thresholds[i].
+    Equal thresholds are ordered latest-row-first, so the right-most hit is the
+    earliest slab row (same pick as max() over the rows in document order).
+    secondary (optional): a second "<=" bound per slab, e.g. amount_off for
+    "Quantity & Amount" slabs.
+    """
+
+    __slots__ = ("first", "secondary", "secondary_prefix_min", "thresholds", "values")
+
+    def __init__(self, slabs, secondary=None):
+        # slabs: [(threshold, values)] in document order; secondary parallel to it
+        order = sorted(range(len(slabs)), key=lambda i: (slabs[i][0], -i))
+        self._set(
+            tuple(slabs[i][0] for i in order),
+            tuple(slabs[i][1] for i in order),
+            None if secondary is None else tuple(secondary[i] for i in order),
+            slabs[0][1] if slabs else None,
+        )
+
+    def _set(self, thresholds, values, secondary, first):
+        self.thresholds = thresholds
+        self.values = values
+        self.first = first
+        self.secondary = secondary
+        if secondary is None:
+            self.secondary_prefix_min = None
+        else:
+            prefix, current = [], None
+            for v in secondary:
+                current = v if current is None else min(current, v)
+                prefix.append(current)
+            self.secondary_prefix_min = tuple(prefix)
+
+    @classmethod
+    def from_sorted(cls, thresholds, values, secondary, first):
+        """Rebuild from an already sorted table (see SchemeSlabs.to_cache)."""
+        table = cls.__new__(cls)
+        table._set(tuple(thresholds), tuple(tuple(v) for v in values), None if secondary is None else tuple(secondary), first)
+        return table
+
+    def __len__(self):
+        return len(self.thresholds)
+
+    def best(self, value, secondary_value=None):
+        """Values of the slab with the highest threshold <= value (and secondary <= secondary_value)."""
+        k = bisect_right(self.thresholds, value)
+        if not k:
+            return None
+        if self.secondary is None:
+            return self.values[k - 1]
+
+        # nothing below k satisfies the second bound -> no slab
+        if self.secondary_prefix_min[k - 1] > secondary_value:
+            return None
+        for i in range(k - 1, -1, -1):
+            if self.secondary[i] <= secondary_value:
+                return self.values[i]
+        return None
+
+    def upto(self, value):
+        """All slabs with threshold <= value, ascending."""
+        return self.values[: bisect_right(self.thresholds, value)]
+
+
+class SchemeSlabs:
+    """
+    The slab table that matters for one scheme's type_of_promo_validation.
+    memo: (total_qty, total_amount) -> report evaluation, see engine.evaluate_totals.
+    """
+
+    __slots__ = ("memo", "table", "validation_type")
+
+    def __init__(self, validation_type, table):
+        self.validation_type = validation_type
+        self.table = table
+        self.memo = {}
+
+    @classmethod
+    def from_doc(cls, scheme_doc):
+        validation_type = (_row_get(scheme_doc, "type_of_promo_validation") or "").strip()
+        spec = SLAB_FIELDS.get(validation_type)
+        if not spec:
+            return cls(validation_type, SlabTable([]))
+
+        table_field, threshold_field, value_fields = spec
+        slabs = []
+        for row in _row_get(scheme_doc, table_field) or []:
+            values = tuple(
+                (_row_get(row, f) or None) if f == "free_product" else _flt(_row_get(row, f))
+                for f in value_fields
+            )
+            slabs.append((_flt(_row_get(row, threshold_field)), values))
+
+        secondary = None
+        if validation_type == QUANTITY_AND_AMOUNT:
+            secondary = [values[2] for _, values in slabs]
+        return cls(validation_type, SlabTable(slabs, secondary=secondary))
+
+    def to_cache(self):
+        """Plain tuples only, for the shared compiled-scheme cache."""
+        t = self.table
+        return (self.validation_type, t.thresholds, t.values, t.secondary, t.first)
+
+    @classmethod
+    def from_cache(cls, data):
+        validation_type, thresholds, values, secondary, first = data
+        return cls(validation_type, SlabTable.from_sorted(thresholds, values, secondary, first))
+
+    def applicable(self, total_qty, total_amount):
+        """Best applicable slab tuple, or None (no fallback)."""
+        if self.validation_type == AMOUNT:
+            return self.table.best(total_amount)
+        if self.validation_type == QUANTITY:
+            return self.table.best(total_qty)
+        if self.validation_type == QUANTITY_AND_AMOUNT:
+            return self.table.best(total_qty, total_amount)
+        return None
+
+    def select(self, total_qty, total_amount):
+        """
+        Report semantics: best applicable slab, else the first slab row as
+        fallback. Returns the normalized dict used by the report rows.
+        """
+        values = self.applicable(total_qty, total_amount)
+        if values is None:
+            values = self.table.first
+        return self.as_dict(values)
+
+    def as_dict(self, values):
+        result = {
+            "minimum_quantity": 0.0,
+            "minimum_amount": 0.0,
+            "free_quantity": 0.0,
+            "discount_percentage": 0.0,
+            "free_product": None,
+            "amount_off": 0.0,
+        }
+        if values is None:
+            return result
+
+        if self.validation_type == AMOUNT:
+            result["minimum_amount"], result["discount_percentage"] = values
+        elif self.validation_type == QUANTITY:
+            result["minimum_quantity"], result["free_quantity"], result["free_product"] = values
+        elif self.validation_type == QUANTITY_AND_AMOUNT:
+            result["minimum_quantity"], result["free_quantity"], result["amount_off"] = values
+        return result
+
+
+def get_scheme_slabs(scheme_doc):
+    """SchemeSlabs for scheme_doc, compiled once per scheme version (name + modified)."""
+    import frappe
+
+    key = (
+        getattr(frappe.local, "site", None),
+        _row_get(scheme_doc, "name"),
+        str(_row_get(scheme_doc, "modified") or ""),
+    )
+    slabs = _slab_cache.get(key)
+    if slabs is None:
+        if len(_slab_cache) >= _SLAB_CACHE_SIZE:
+            _slab_cache.clear()
+        slabs = _slab_cache[key] = SchemeSlabs.from_doc(scheme_doc)
+    return slabs
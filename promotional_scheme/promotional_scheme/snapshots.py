@@ -0,0 +1,252 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Precomputed rows of the Custom Promotional Scheme Report.
+
+Opening the report recomputes every scheme / party / item row from the
+invoices. Here the unfiltered rows (eligibility included) are kept in
+Promotional Scheme Report Snapshot and refreshed by an hourly job:
+  - a scheme that is new or was saved since its rows were written is
+    recomputed entirely; rows of deleted schemes are removed;
+  - otherwise only the parties with invoices submitted / cancelled since the
+    watermark (invoice modified, re-read with WATERMARK_OVERLAP_MINUTES of
+    overlap for transactions committing late) are recomputed, and only in
+    schemes whose validity contains those invoices' posting dates. Schemes
+    whose item keys come from the invoices themselves (item groups shown per
+    item code) are recomputed entirely, a new item changes every party's rows.
+
+The report reads the snapshot unless "Live" is ticked, a date window is
+given (snapshot totals are over the full validity) or the report is paged.
+`bench --site x refresh-scheme-report-snapshot [--full]` runs the refresh by hand.
+"""
+
+import json
+
+import frappe
+from frappe.utils import add_to_date, get_datetime, getdate, now
+
+from promotional_scheme.promotional_scheme.accruals import INVOICE_TABLES, ledger_covers
+from promotional_scheme.promotional_scheme.extraction import extract_item_codes, extract_item_groups
+from promotional_scheme.promotional_scheme.loader import load_schemes
+from promotional_scheme.promotional_scheme.party_scope import PartyScope
+from promotional_scheme.promotional_scheme.report.custom_promotional_scheme_report import (
+    custom_promotional_scheme_report as report,
+)
+
+SNAPSHOT_DOCTYPE = "Promotional Scheme Report Snapshot"
+# global default: {"watermark": ..., "schemes": {scheme: modified its rows were written for}}
+STATE_KEY = "promotional_scheme_report_snapshot"
+WATERMARK_OVERLAP_MINUTES = 10
+
+ROW_FIELDS = [column["fieldname"] for column in report.get_columns()]
+SNAPSHOT_FIELDS = ["name", "creation", "modified", "owner", "modified_by", "scheme", *ROW_FIELDS]
+
+INSERT_BATCH_SIZE = 5000
+
+
+# -------------------------
+# State
+# -------------------------
+def _state():
+    value = frappe.db.get_global(STATE_KEY)
+    state = frappe._dict(json.loads(value)) if value else frappe._dict()
+    state.setdefault("watermark", None)
+    state.setdefault("schemes", {})
+    return state
+
+
+def _save_state(state):
+    frappe.db.set_global(STATE_KEY, json.dumps(state, default=str))
+
+
+def snapshot_watermark():
+    """When the snapshot was last refreshed up to (None: never built)."""
+    return _state().watermark
+
+
+# -------------------------
+# Refresh
+# -------------------------
+def _report_side(select_the_party):
+    # the report shows everything but Buying schemes as Selling
+    return "Buying" if (select_the_party or "").strip() == "Buying" else "Selling"
+
+
+def _invoice_changes(since, until):
+    """{party_side: [(party, posting_date)]} of invoices submitted / cancelled in (since, until]."""
+    changes = {}
+    for party_side, (_, header, _, party_field, _) in INVOICE_TABLES.items():
+        rows = frappe.db.sql(
+            f"""
+            SELECT DISTINCT {party_field}, posting_date
+            FROM {header}
+            WHERE docstatus IN (1, 2) AND modified > %s AND modified <= %s
+            """,
+            (since, until),
+        )
+        changes[party_side] = [(party, getdate(posting_date)) for party, posting_date in rows if party]
+    return changes
+
+
+def _parties_in_window(changes, valid_from, valid_to):
+    """Parties of changes ([(party, posting_date)]) whose posting date is inside the validity."""
+    valid_from = getdate(valid_from) if valid_from else None
+    valid_to = getdate(valid_to) if valid_to else None
+    return {
+        party
+        for party, posting_date in changes
+        if (valid_from is None or posting_date >= valid_from) and (valid_to is None or posting_date <= valid_to)
+    }
+
+
+def _scheme_rows(scheme_doc, parties=None):
+    """
+    Unfiltered report rows of scheme_doc, all of them or only those of
+    parties (then exactly the rows a full run would have for them).
+    """
+    plan = report._plan_report_filters({})
+    ctx = report._prepare_scheme(scheme_doc, {}, plan)
+    if not ctx:
+        return []
+    ctx.use_ledger = ledger_covers(ctx.scheme_doc, *ctx.window)
+
+    inferred = not ctx.party_scope.restricts
+    if parties is not None:
+        # the changed parties the scheme covers, listed like explicit ones
+        parties = sorted(parties) if inferred else ctx.party_scope.members(parties)
+        if not parties:
+            return []
+        ctx.party_scope = PartyScope(ctx.party_side, parties)
+        ctx.parties = [(ctx.party_scope.party_type, party) for party in parties]
+
+    totals_map = report._scheme_totals(ctx, {}, {}, plan)
+    totals_map, grid_parties, display_keys = report._scheme_grid(ctx, totals_map, plan)
+    if parties is not None and inferred:
+        # a full run only shows the parties that have totals
+        found = {party for (party, _) in totals_map}
+        grid_parties = [p for p in grid_parties if p[1] in found]
+    return report._grid_rows(ctx, grid_parties, display_keys, totals_map, {})
+
+
+def _keys_follow_invoices(scheme_doc):
+    # Item Code schemes listing item groups only show the invoiced item codes
+    return (
+        (scheme_doc.apply_on or "").strip() != "Item Group"
+        and not extract_item_codes(scheme_doc)
+        and bool(extract_item_groups(scheme_doc))
+    )
+
+
+def _write_rows(scheme_name, rows, parties=None):
+    """Replace the snapshot rows of scheme_name (only those of parties, if given)."""
+    filters = {"scheme": scheme_name}
+    if parties is not None:
+        filters["party_name"] = ["in", sorted(parties)]
+    frappe.db.delete(SNAPSHOT_DOCTYPE, filters)
+
+    timestamp, user = now(), frappe.session.user
+    values = [
+        (frappe.generate_hash(length=10), timestamp, timestamp, user, user, scheme_name, *(row.get(f) for f in ROW_FIELDS))
+        for row in rows
+    ]
+    for start in range(0, len(values), INSERT_BATCH_SIZE):
+        frappe.db.bulk_insert(SNAPSHOT_DOCTYPE, SNAPSHOT_FIELDS, values[start:start + INSERT_BATCH_SIZE])
+
+
+def refresh_report_snapshot(full=False, log=None):
+    """
+    Bring the snapshot up to date (scheduler: hourly_long). full rewrites
+    every scheme. Commits per scheme; the watermark moves only once
+    everything is written, so an interrupted run is simply repeated.
+    """
+    log = log or (lambda msg: None)
+    state = _state()
+    run_started = now()
+    full = full or not state.watermark
+
+    schemes = {
+        row.name: row
+        for row in frappe.get_all(
+            "Custom Promotional Scheme", fields=["name", "modified", "select_the_party", "valid_from", "valid_to"]
+        )
+    }
+
+    for name in set(state.schemes) - set(schemes):
+        frappe.db.delete(SNAPSHOT_DOCTYPE, {"scheme": name})
+        state.schemes.pop(name)
+        log(f"{name}: removed")
+    if full:
+        # rows of schemes the state doesn't know about (e.g. restored backup)
+        frappe.db.delete(SNAPSHOT_DOCTYPE, {"scheme": ["not in", list(schemes) or [""]]})
+
+    changes = {}
+    if not full:
+        since = add_to_date(get_datetime(state.watermark), minutes=-WATERMARK_OVERLAP_MINUTES)
+        changes = _invoice_changes(since, run_started)
+
+    # scheme -> None (all rows) or the parties to recompute
+    todo = {}
+    for name, row in schemes.items():
+        if full or state.schemes.get(name) != str(row.modified):
+            todo[name] = None
+            continue
+        parties = _parties_in_window(changes.get(_report_side(row.select_the_party), ()), row.valid_from, row.valid_to)
+        if parties:
+            todo[name] = parties
+
+    for scheme_doc in load_schemes(list(todo)):
+        parties = todo[scheme_doc.name]
+        if parties is not None and _keys_follow_invoices(scheme_doc):
+            parties = None
+        rows = _scheme_rows(scheme_doc, parties)
+        _write_rows(scheme_doc.name, rows, parties)
+        state.schemes[scheme_doc.name] = str(schemes[scheme_doc.name].modified)
+        _save_state(state)
+        frappe.db.commit()
+        log(f"{scheme_doc.name}: {len(rows)} rows" + (f" for {len(parties)} parties" if parties is not None else ""))
+
+    state.watermark = run_started
+    _save_state(state)
+    frappe.db.commit()
+    return {"schemes": len(todo), "watermark": run_started}
+
+
+# -------------------------
+# Report side
+# -------------------------
+def snapshot_answers(filters):
+    """The snapshot can stand in for a live run with these filters."""
+    return (
+        not report._is_checked(filters.get("live"))
+        and not filters.get("from_date")
+        and not filters.get("to_date")
+        and bool(snapshot_watermark())
+    )
+
+
+def get_snapshot_rows(filters):
+    """Report rows for filters out of the snapshot, in the live report's order."""
+    plan = report._plan_report_filters(filters)
+    scheme_names = report._report_scheme_names(plan)
+    if not scheme_names:
+        return []
+
+    row_filters = {"scheme": ["in", scheme_names]}
+    if plan.party_name:
+        row_filters["party_name"] = plan.party_name
+    if report._is_checked(filters.get("show_only_eligible")):
+        row_filters["eligibility_status"] = "Eligible"
+
+    by_scheme = {}
+    for row in frappe.get_all(SNAPSHOT_DOCTYPE, filters=row_filters, fields=["scheme", *ROW_FIELDS]):
+        by_scheme.setdefault(row.pop("scheme"), []).append(row)
+
+    predicates = report._report_predicates(filters)
+    result_rows = []
+    for name in scheme_names:
+        rows = by_scheme.get(name, [])
+        # party-major, item keys ascending, as the rows are built
+        rows.sort(key=report._row_key)
+        result_rows.extend(row for row in rows if all(p(row) for p in predicates))
+    return result_rows
@@ -0,0 +1,116 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Opt-in evaluation trace for apply_promotional_schemes.
+
+For a sampled invoice we record how many schemes were considered, how many
+the party / item match pruned, which were evaluated and which slab each one
+picked, plus wall time per phase. One JSON line per invoice goes to the
+"promotional_scheme" logger (logs/promotional_scheme.log on the site).
+
+Sampling is set in site_config.json:
+    "promotional_scheme_trace_rate": 0.01    # 1% of submits, 0 / unset = off
+frappe.flags.promotional_scheme_trace = True forces a trace for the request
+(e.g. from bench console). Unsampled invoices get a no-op trace.
+"""
+
+import json
+import random
+from contextlib import nullcontext
+from time import perf_counter
+
+import frappe
+
+TRACE_RATE_CONF = "promotional_scheme_trace_rate"
+PHASES = ("scheme_fetch", "party_match", "item_match", "slab_selection", "mutation")
+
+_NO_PHASE = nullcontext()
+
+
+class _Phase:
+    __slots__ = ("name", "started", "trace")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = perf_counter()
+
+    def __exit__(self, *exc):
+        timings = self.trace.timings
+        timings[self.name] = timings.get(self.name, 0.0) + (perf_counter() - self.started)
+        return False
+
+
+class SchemeTrace:
+    """Counters + phase timings for one invoice. Disabled traces record nothing."""
+
+    __slots__ = (
+        "considered",
+        "doc",
+        "enabled",
+        "evaluated",
+        "outcomes",
+        "pruned_by_item",
+        "pruned_by_party",
+        "started",
+        "timings",
+    )
+
+    def __init__(self, doc=None, enabled=False):
+        self.enabled = enabled
+        self.doc = doc
+        self.started = perf_counter() if enabled else 0.0
+        self.timings = {}
+        self.considered = 0
+        self.pruned_by_party = 0
+        self.pruned_by_item = 0
+        self.evaluated = 0
+        self.outcomes = []
+
+    def phase(self, name):
+        """with trace.phase("party_match"): ... adds the block's wall time to that phase."""
+        return _Phase(self, name) if self.enabled else _NO_PHASE
+
+    def scheme(self, scheme_name, slab, applied):
+        """Outcome of one evaluated scheme: the slab it picked (None = no slab reached)."""
+        if self.enabled:
+            self.outcomes.append({"scheme": scheme_name, "slab": slab, "applied": applied})
+
+    def as_dict(self):
+        doc = self.doc
+        return {
+            "doctype": getattr(doc, "doctype", None),
+            "name": getattr(doc, "name", None),
+            "considered": self.considered,
+            "pruned_by_party": self.pruned_by_party,
+            "pruned_by_item": self.pruned_by_item,
+            "evaluated": self.evaluated,
+            "schemes": self.outcomes,
+            "phase_ms": {name: round(self.timings.get(name, 0.0) * 1000, 3) for name in PHASES},
+            "total_ms": round((perf_counter() - self.started) * 1000, 3),
+        }
+
+    def finish(self):
+        if not self.enabled:
+            return
+        try:
+            frappe.logger("promotional_scheme", allow_site=True).info(json.dumps(self.as_dict(), default=str))
+        except Exception:
+            # tracing must never break a submit
+            pass
+
+
+def start_trace(doc):
+    """SchemeTrace for doc, enabled for the sampled share of invoices."""
+    enabled = bool(frappe.flags.promotional_scheme_trace)
+    if not enabled:
+        rate = frappe.conf.get(TRACE_RATE_CONF) or 0
+        try:
+            rate = float(rate)
+        except (TypeError, ValueError):
+            rate = 0.0
+        enabled = rate > 0 and random.random() < rate
+    return SchemeTrace(doc, enabled=enabled)
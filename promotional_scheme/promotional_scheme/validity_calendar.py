@@ -0,0 +1,144 @@
+# Copyright (c) 2026, aits and contributors
+# For license information, please see license.txt
+
+"""
+Validity calendar: which Custom Promotional Schemes are active on a date, or
+overlap a date range, without a query per call.
+
+Every submit used to filter schemes by valid_from <= today <= valid_to in the
+database (and with nowdate(), so a back-dated invoice got today's schemes);
+the scheme form ran its own overlap query. Here the validity windows of all
+schemes are loaded once per process and scheme version (INDEX_VERSION_KEY,
+bumped on every scheme change) and cut into elementary intervals: the sorted
+start / end+1 dates split the timeline into segments in which the set of
+active schemes is constant. A date is found with one bisect; a segment's
+schemes are worked out the first time it is asked for and kept. Schemes
+without both dates are never active, as with the old filter.
+"""
+
+from bisect import bisect_right
+from datetime import timedelta
+
+import frappe
+from frappe.utils import getdate, nowdate
+
+from promotional_scheme.promotional_scheme.scheme_index import _current_version
+
+CALENDAR_FIELDS = ("name", "modified", "scheme_name", "select_the_party", "valid_from", "valid_to")
+
+# site -> ValidityCalendar, per process
+_calendar_cache = {}
+
+
+class ValidityCalendar:
+    """
+    Validity windows of all schemes, per party side. rows: dicts with
+    CALENDAR_FIELDS in scheme order (the order the hook has always used);
+    every result keeps that order.
+    """
+
+    def __init__(self, rows, version=""):
+        self.version = version
+        self.sides = {}
+        for order, row in enumerate(rows):
+            if not (row.get("valid_from") and row.get("valid_to")):
+                continue
+            side = (row.get("select_the_party") or "").strip()
+            self.sides.setdefault(side, _SideCalendar()).add(order, row)
+        for calendar in self.sides.values():
+            calendar.seal()
+
+    def segment(self, party_side, on_date):
+        """
+        (start, end) of the elementary interval on_date falls in, end exclusive
+        (either may be None: open ended). Same segment = same active schemes.
+        """
+        calendar = self.sides.get(party_side)
+        if calendar is None:
+            return (None, None)
+        return calendar.segment(getdate(on_date))
+
+    def active_on(self, party_side, on_date):
+        """Rows of the party_side schemes active on on_date."""
+        calendar = self.sides.get(party_side)
+        if calendar is None:
+            return []
+        return calendar.active_on(getdate(on_date))
+
+    def overlapping(self, from_date, to_date, party_side=None):
+        """Rows of the schemes whose window overlaps [from_date, to_date] (any side by default)."""
+        from_date, to_date = getdate(from_date), getdate(to_date)
+        sides = [party_side] if party_side is not None else list(self.sides)
+        result = []
+        for side in sides:
+            calendar = self.sides.get(side)
+            if calendar is not None:
+                result.extend(calendar.overlapping(from_date, to_date))
+        if len(sides) > 1:
+            result.sort(key=lambda row: row["_order"])
+        return result
+
+
+class _SideCalendar:
+    __slots__ = ("bounds", "by_start", "rows", "segments", "starts")
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, order, row):
+        row = frappe._dict(row)
+        row["_order"] = order  # position among all schemes
+        row["valid_from"] = getdate(row["valid_from"])
+        row["valid_to"] = getdate(row["valid_to"])
+        self.rows.append(row)
+
+    def seal(self):
+        # scheme positions by start date, for "started by D" prefixes
+        self.by_start = sorted(range(len(self.rows)), key=lambda pos: self.rows[pos]["valid_from"])
+        self.starts = [self.rows[pos]["valid_from"] for pos in self.by_start]
+        # elementary interval k is [bounds[k - 1], bounds[k]), with open ends
+        bounds = set()
+        for row in self.rows:
+            bounds.add(row["valid_from"])
+            bounds.add(row["valid_to"] + timedelta(days=1))
+        self.bounds = sorted(bounds)
+        # k -> tuple of positions, filled on first use
+        self.segments = {}
+
+    def segment(self, on_date):
+        k = bisect_right(self.bounds, on_date)
+        start = self.bounds[k - 1] if k > 0 else None
+        end = self.bounds[k] if k < len(self.bounds) else None
+        return (start, end)
+
+    def _started_by(self, on_date):
+        return self.by_start[: bisect_right(self.starts, on_date)]
+
+    def active_on(self, on_date):
+        k = bisect_right(self.bounds, on_date)
+        positions = self.segments.get(k)
+        if positions is None:
+            started = self._started_by(on_date)
+            positions = tuple(sorted(pos for pos in started if self.rows[pos]["valid_to"] >= on_date))
+            self.segments[k] = positions
+        return [self.rows[pos] for pos in positions]
+
+    def overlapping(self, from_date, to_date):
+        positions = sorted(pos for pos in self._started_by(to_date) if self.rows[pos]["valid_to"] >= from_date)
+        return [self.rows[pos] for pos in positions]
+
+
+def get_validity_calendar():
+    """The calendar for the current site, rebuilt when any scheme changed."""
+    version = _current_version()
+    calendar = _calendar_cache.get(frappe.local.site)
+    if calendar is None or calendar.version != version:
+        rows = frappe.get_all("Custom Promotional Scheme", fields=list(CALENDAR_FIELDS))
+        calendar = ValidityCalendar(rows, version)
+        _calendar_cache[frappe.local.site] = calendar
+    return calendar
+
+
+def get_active_schemes(party_side, on_date=None):
+    """Rows ({CALENDAR_FIELDS}) of the party_side schemes active on on_date (default today)."""
+    return get_validity_calendar().active_on(party_side, on_date or nowdate())
@@ -0,0 +1,109 @@
+// Copyright (c) 2026, aits and contributors
+// For license information, please see license.txt
+
+// ---------------------------------------
+// Promotional scheme preview on draft Sales / Purchase Invoices
+// ---------------------------------------
+// Asks promotional_scheme.promotional_scheme.api.preview_promotional_schemes
+// what would be applied on submit and shows it as the form intro. Calls are
+// debounced so typing in the items table sends one request per pause.
+// The same file is the doctype_js of both invoices, so it may be evaluated
+// twice: everything lives in one closure and handlers are registered once.
+
+(() => {
+    if (window.__promotional_scheme_preview_loaded) return;
+    window.__promotional_scheme_preview_loaded = true;
+
+    const PREVIEW_METHOD = "promotional_scheme.promotional_scheme.api.preview_promotional_schemes";
+    const PREVIEW_DEBOUNCE_MS = 400;
+    const PREVIEW_FIELDS = ["doctype", "customer", "customer_group", "territory", "supplier", "supplier_group", "posting_date"];
+    const PREVIEW_ITEM_FIELDS = ["item_code", "item_group", "qty", "rate", "net_amount", "base_net_amount"];
+
+    function preview_payload(frm) {
+        const doc = {};
+        PREVIEW_FIELDS.forEach(f => { if (frm.doc[f] !== undefined) doc[f] = frm.doc[f]; });
+        doc.items = (frm.doc.items || []).map(row => {
+            const line = {};
+            PREVIEW_ITEM_FIELDS.forEach(f => { line[f] = row[f]; });
+            return line;
+        });
+        return doc;
+    }
+
+    function clear_preview(frm) {
+        // only clear an intro we set
+        if (frm.__promotional_scheme_intro) {
+            frm.set_intro("");
+            frm.__promotional_scheme_intro = false;
+        }
+    }
+
+    function render_preview(frm, preview) {
+        const applied = (preview.schemes || []).filter(s => s.applies);
+        if (!applied.length) {
+            clear_preview(frm);
+            return;
+        }
+
+        const lines = {};
+        (preview.lines || []).forEach(l => { lines[l.idx] = l; });
+
+        let html = `<b>${__("Promotional schemes on submit")}</b><ul style="margin:4px 0 0 16px;padding:0;">`;
+        applied.forEach(s => {
+            const rows = s.lines.map(idx => {
+                const l = lines[idx];
+                return l && l.new_rate !== l.rate
+                    ? `#${idx} ${frappe.utils.escape_html(l.item_code || "")}: ${format_currency(l.rate)} → ${format_currency(l.new_rate)}`
+                    : `#${idx}`;
+            });
+            html += `<li>${frappe.utils.escape_html(s.scheme_name || s.scheme)} (${frappe.utils.escape_html(s.validation_type)})`
+                + `<br><span class="text-muted small">${rows.join(", ")}</span></li>`;
+        });
+        html += "</ul>";
+        frm.set_intro(html, "blue");
+        frm.__promotional_scheme_intro = true;
+    }
+
+    function request_preview(frm) {
+        if (frm.doc.docstatus !== 0 || !(frm.doc.items || []).some(row => row.item_code)) {
+            clear_preview(frm);
+            return;
+        }
+
+        frappe.call({
+            method: PREVIEW_METHOD,
+            args: { doc: preview_payload(frm) },
+            // background refresh, no freeze / progress
+            freeze: false,
+            callback(r) {
+                if (r.message) render_preview(frm, r.message);
+            }
+        });
+    }
+
+    function schedule_preview(frm) {
+        if (!frm.__promotional_scheme_preview) {
+            frm.__promotional_scheme_preview = frappe.utils.debounce(() => request_preview(frm), PREVIEW_DEBOUNCE_MS);
+        }
+        frm.__promotional_scheme_preview();
+    }
+
+    function preview_events(party_fields) {
+        const events = { refresh: schedule_preview, posting_date: schedule_preview };
+        party_fields.forEach(f => { events[f] = schedule_preview; });
+        return events;
+    }
+
+    const PREVIEW_ROW_EVENTS = {
+        item_code: frm => schedule_preview(frm),
+        qty: frm => schedule_preview(frm),
+        rate: frm => schedule_preview(frm),
+        items_add: frm => schedule_preview(frm),
+        items_remove: frm => schedule_preview(frm),
+    };
+
+    frappe.ui.form.on("Sales Invoice", preview_events(["customer", "customer_group", "territory"]));
+    frappe.ui.form.on("Sales Invoice Item", PREVIEW_ROW_EVENTS);
+    frappe.ui.form.on("Purchase Invoice", preview_events(["supplier"]));
+    frappe.ui.form.on("Purchase Invoice Item", PREVIEW_ROW_EVENTS);
+})();